@@ -0,0 +1,93 @@
+import os
+from collections import Counter, OrderedDict
+
+from PyQt5.QtCore import Qt, QSize
+from PyQt5.QtGui import QIcon, QPixmap
+
+ASSET_DIRECTORIES = ('icons', 'bg_imgs')
+DEFAULT_TEAM_ICON = 'favicon.ico'
+CACHE_SIZE = 256
+
+
+class AssetCache:
+    """ Index of the image directories with shared QIcon/QPixmap objects.
+
+    The directories are listed once, so looking up a team without a logo never touches the
+    file system. Decoded images are kept in a bounded LRU and loads counts how often every
+    file was actually read."""
+
+    def __init__(self, directories=ASSET_DIRECTORIES, size=CACHE_SIZE):
+        self.directories = directories
+        self.size = size
+        self.index = {}
+        self.cache = OrderedDict()
+        self.loads = Counter()
+        self.hits = 0
+        self.misses = 0
+        self.scan()
+
+    def scan(self):
+        self.index.clear()
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if entry.is_file():
+                    path = os.path.join(directory, entry.name)
+                    # files can be asked for with or without extension
+                    self.index.setdefault((directory, entry.name), path)
+                    self.index.setdefault((directory, os.path.splitext(entry.name)[0]), path)
+
+    def path(self, name, directory='icons'):
+        return self.index.get((directory, name))
+
+    def cached(self, key, load):
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        value = load()
+        self.cache[key] = value
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        return value
+
+    def load_pixmap(self, path, size):
+        self.loads[path] += 1
+        pixmap = QPixmap(path)
+        if size is not None and not pixmap.isNull():
+            pixmap = pixmap.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        return pixmap
+
+    def pixmap(self, name, size=None, directory='icons'):
+        """ Shared pixmap of an indexed file, scaled to fit size. Don't paint on it, copy it first."""
+        path = self.path(name, directory)
+        if path is None:
+            return QPixmap()
+        if size is not None and not isinstance(size, QSize):
+            size = QSize(size, size)
+        key = ('pixmap', path, None if size is None else (size.width(), size.height()))
+        return self.cached(key, lambda: self.load_pixmap(path, size))
+
+    def icon(self, name, directory='icons'):
+        path = self.path(name, directory)
+        if path is None:
+            return QIcon()
+
+        def load():
+            self.loads[path] += 1
+            return QIcon(path)
+        return self.cached(('icon', path), load)
+
+    def team_icon(self, team_name):
+        if self.path(team_name) is None:
+            return self.icon(DEFAULT_TEAM_ICON)
+        return self.icon(team_name)
+
+    def stats(self):
+        return {'indexed': len(set(self.index.values())), 'cached': len(self.cache), 'hits': self.hits,
+                'misses': self.misses, 'loads': sum(self.loads.values())}
+
+
+assets = AssetCache()
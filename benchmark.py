@@ -0,0 +1,323 @@
+import argparse
+import contextlib
+import csv
+import datetime
+import gc
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from cli import all_matches, can_generate, draw_groups
+from tools import DEFAULT_STYLESHEET, DataBaseManager, RemoteQueue
+
+HISTORY = ['2015.csv', '2016.csv', '2017.csv']
+YEARS = 10
+REPEAT = 5
+TOLERANCE = 0.2  # slower than the baseline by more than this is a regression
+QUEUED_UPDATES = 200
+
+
+def fit_history(files=HISTORY):
+    """ The numbers a synthetic history is drawn from, fitted from the match csv files.
+
+    teams: teams per year, fitted as a linear trend, group_size: mean teams per group, ko_share:
+    part of the teams reaching the KO stages, returning: part of a year's teams that played the
+    year before, winning_scores: {winning score: matches}, the losing team always ends at 0."""
+    years = []
+    winning_scores = Counter()
+    for file_name in files:
+        teams = set()
+        groups = set()
+        ko = 0
+        with open(file_name, 'r', encoding='utf-8') as csv_file:
+            for row in csv.reader(csv_file, delimiter=';', quotechar='"'):
+                teams.update(row[:2])
+                winning_scores[max(int(row[2]), int(row[3]))] += 1
+                stage = row[5]
+                if stage.startswith('KO') and not stage.startswith('KO_FINAL'):
+                    ko = max(ko, 2 * int(stage[2:]))
+                elif not stage.startswith('KO'):
+                    groups.add(stage)
+        years.append({'teams': teams, 'groups': len(groups), 'ko': ko})
+
+    counts = [len(year['teams']) for year in years]
+    mean = statistics.mean(counts)
+    x_mean = (len(counts) - 1) / 2.
+    slope = 0.
+    if len(counts) > 1:
+        slope = sum((x - x_mean) * (n - mean) for x, n in enumerate(counts)) / \
+            sum((x - x_mean) ** 2 for x in range(len(counts)))
+    returning = [len(year['teams'] & before['teams']) / float(len(year['teams']))
+                 for before, year in zip(years, years[1:])]
+    return {'teams': {'first': mean - slope * x_mean, 'per_year': slope},
+            'group_size': statistics.mean(math.ceil(len(y['teams']) / float(y['groups'])) for y in years),
+            'ko_share': statistics.mean(y['ko'] / float(len(y['teams'])) for y in years),
+            'returning': statistics.mean(returning) if returning else 0.,
+            'winning_scores': dict((str(score), count) for score, count in sorted(winning_scores.items()))}
+
+
+class HistoryGenerator:
+    """ Plays synthetic tournaments through DataBaseManager the way the GUI and cli.py do.
+
+    Every team has a hidden strength deciding its matches, the winning scores follow the fitted
+    distribution. The last tournament is only drawn, its matches are left to the benchmarks."""
+
+    def __init__(self, model, seed=0, teams=None):
+        self.model = model
+        self.rng = random.Random(seed)
+        self.teams = teams
+        self.strengths = []
+        self.scores = [int(s) for s in model['winning_scores']]
+        self.weights = [model['winning_scores'][s] for s in model['winning_scores']]
+
+    def team_count(self, year):
+        if self.teams:
+            return self.teams
+        return max(4, int(round(self.model['teams']['first'] + self.model['teams']['per_year'] * year)))
+
+    def pick_teams(self, count, before):
+        returning = [t for t in before if self.rng.random() < self.model['returning']][:count]
+        rest = [t for t in range(len(self.strengths)) if t not in set(before)]
+        self.rng.shuffle(rest)
+        teams = returning + rest[:count - len(returning)]
+        while len(teams) < count:
+            teams.append(len(self.strengths))
+            self.strengths.append(self.rng.gauss(0., 1.))
+        return teams
+
+    @staticmethod
+    def name(team):
+        return 'Synthetic Team %04d' % team
+
+    def result(self, match, teams):
+        s1 = self.strengths[teams[match['team1']]]
+        s2 = self.strengths[teams[match['team2']]]
+        score = self.rng.choices(self.scores, self.weights)[0]
+        if self.rng.random() < 1. / (1. + math.exp(s2 - s1)):
+            return dict(match, team1_score=score, team2_score=0, status=2)
+        return dict(match, team1_score=0, team2_score=score, status=2)
+
+    def play(self, database, tournament_id, teams):
+        for _stage, match in all_matches(database, tournament_id):
+            if match['status'] != 2 and match['team1_id'] and match['team2_id']:
+                database.update_match(self.result(match, teams))
+
+    def tournament(self, database, year, before, finish=True):
+        count = self.team_count(year)
+        teams = self.pick_teams(count, before)
+        group_size = max(2, int(round(self.model['group_size'])))
+        teams_in_ko = 2 ** int(math.log(max(2, count * self.model['ko_share']), 2))
+        name = 'Synthetic Cup %d' % (2015 + year)
+        database.store_tournament({'name': name, 'stylesheet': DEFAULT_STYLESHEET, 'num_teams': count,
+                                   'group_size': group_size, 'teams_in_ko': teams_in_ko, 'ko_mode': 'single',
+                                   'teams': [{'name': self.name(t)} for t in teams]})
+        tournament = {'id': database.get_tournament_id(name), 'name': name}
+        draw_groups(database, tournament, seed=self.rng.randrange(2 ** 32))
+        names = dict((self.name(t), t) for t in teams)
+        while finish:
+            status = database.get_tournament_status(tournament['id'])
+            if not can_generate(status):
+                break
+            database.generate_matches(tournament['id'], status)
+            self.play(database, tournament['id'], names)
+        return teams
+
+    def history(self, database, years=YEARS):
+        teams = []
+        for year in range(years):
+            teams = self.tournament(database, year, teams, finish=year < years - 1)
+        return database
+
+
+def measure(run, repeat=REPEAT, setup=None):
+    """ {min, median, mean} in ms of repeat runs, setup() (not timed) prepares the argument of
+    every run. The garbage collector is off while timing, as in timeit."""
+    times = []
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            run(argument)
+            times.append((time.perf_counter() - start) * 1000)
+        finally:
+            gc.enable()
+    return {'runs': repeat, 'min': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times)}
+
+
+def database_benchmarks(database, queue_file):
+    """ [(name, run, setup)] of the DataBaseManager hot paths. The writes run on clones, so every
+    run starts from the same history."""
+    tournaments = database.get_tournament_list()
+    finished = tournaments[-2]['id'] if len(tournaments) > 1 else tournaments[-1]['id']
+    current = tournaments[-1]['id']
+
+    def generated():
+        clone = database.clone()
+        clone.generate_matches(current, clone.get_tournament_status(current))
+        return clone
+
+    def enter_results(clone):
+        for group in clone.get_tournament_groups(current):
+            for match in group['matches']:
+                clone.update_match(dict(match, team1_score=0, team2_score=1, status=2))
+
+    def empty_queue():
+        if os.path.exists(queue_file):
+            os.remove(queue_file)
+        return RemoteQueue(queue_file)
+
+    def append_updates(queue):
+        for i in range(QUEUED_UPDATES):
+            queue.append(DataBaseManager.create_remote_update('update', 'Matches', ['team1_score'], [[i]],
+                                                              where={'id': [i]}))
+
+    return [
+        ('get_tournament_groups', lambda _: database.get_tournament_groups(finished), None),
+        ('get_tournament_groups (open)', lambda _: database.get_tournament_groups(current), None),
+        ('get_tournament_ko_stages', lambda _: database.get_tournament_ko_stages(finished), None),
+        ('get_tournament_status', lambda _: database.get_tournament_status(finished), None),
+        ('get_all_time_table', lambda _: database.get_all_time_table(), None),
+        ('generate_matches', lambda clone: clone.generate_matches(current, clone.get_tournament_status(current)),
+         database.clone),
+        ('update_match (all group results)', enter_results, generated),
+        ('RemoteQueue.append (%d updates)' % QUEUED_UPDATES, append_updates, empty_queue),
+    ]
+
+
+def widget_benchmarks(database):
+    """ [(name, run, setup)] of the widgets showing a tournament, on the offscreen platform unless
+    QT_QPA_PLATFORM says otherwise. Empty without PyQt5."""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5.QtWidgets import QApplication, QVBoxLayout, QWidget
+        from widgets import GroupStageWidget, GroupWidget, KOStageContainerWidget
+    except ImportError:
+        return []
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    tournaments = database.get_tournament_list()
+    finished = tournaments[-2]['id'] if len(tournaments) > 1 else tournaments[-1]['id']
+    groups = database.get_tournament_groups(finished)
+    ko_stages = list(database.get_tournament_ko_stages(finished).values())
+    group_widget = GroupWidget()
+    ko_widget = KOStageContainerWidget()
+    # GroupStageWidget paints with its parent's style, as in the main window
+    window = QWidget()
+    window.setLayout(QVBoxLayout())
+    stage_widget = GroupStageWidget(window)
+    window.layout().addWidget(stage_widget)
+    window.resize(1200, 800)
+    window.show()
+
+    def set_groups(_):
+        for group in groups:
+            group_widget.set_group(group, editable=True)
+        app.processEvents()
+
+    def set_ko_stages(_):
+        for stage in ko_stages:
+            ko_widget.set_group(stage, editable=True)
+        app.processEvents()
+
+    def set_stage(_, window=window):  # keeps the window alive as long as the benchmark
+        stage_widget.set_groups(groups)
+        app.processEvents()
+
+    return [
+        ('GroupWidget.set_group (%d groups)' % len(groups), set_groups, None),
+        ('KOStageContainerWidget.set_group (%d stages)' % len(ko_stages), set_ko_stages, None),
+        ('GroupStageWidget.set_groups', set_stage, None),
+    ]
+
+
+def run(benchmarks, repeat=REPEAT, only=None):
+    results = {}
+    for name, benchmark, setup in benchmarks:
+        if only and not any(part in name for part in only):
+            continue
+        # the database code prints what it does, which is not what is measured
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results[name] = measure(benchmark, repeat, setup)
+        print('%-45s %10.2f ms  (min %.2f)' % (name, results[name]['median'], results[name]['min']))
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """ Print the medians against the baseline, returns the names of the regressions."""
+    if baseline.get('config') != results.get('config'):
+        print('note: the baseline was run with %s' % baseline.get('config'))
+    regressions = []
+    print('%-45s %10s %10s %8s' % ('', 'baseline', 'now', ''))
+    for name, result in results['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print('%-45s %10s %10.2f    new' % (name, '-', result['median']))
+            continue
+        ratio = result['median'] / before['median'] if before['median'] else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 / (1 + tolerance):
+            flag = 'faster'
+        print('%-45s %10.2f %10.2f %7.2fx %s' % (name, before['median'], result['median'], ratio, flag))
+    return regressions
+
+
+def parser():
+    main = argparse.ArgumentParser(description='Time the hot paths on a synthetic tournament history.')
+    main.add_argument('--years', type=int, default=YEARS, help='tournaments in the history')
+    main.add_argument('--teams', type=int, help='teams per tournament instead of the fitted trend')
+    main.add_argument('--seed', type=int, default=0)
+    main.add_argument('--repeat', type=int, default=REPEAT, help='runs per benchmark')
+    main.add_argument('--only', action='append', help='benchmarks whose name contains this, can be repeated')
+    main.add_argument('--no-widgets', action='store_true', help='skip the Qt widgets')
+    main.add_argument('-o', '--output', help='write the results as json, e.g. to store a baseline')
+    main.add_argument('--compare', metavar='BASELINE', help='flag regressions against these results')
+    main.add_argument('--tolerance', type=float, default=TOLERANCE,
+                      help='slowdown of the median counted as regression (default: %(default)s)')
+    return main
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    model = fit_history()
+    config = {'years': args.years, 'teams': args.teams, 'seed': args.seed, 'repeat': args.repeat}
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        database = HistoryGenerator(model, args.seed, args.teams).history(DataBaseManager.in_memory(), args.years)
+    history = {'tournaments': len(database.get_tournament_list()), 'teams': len(database.get_teams()),
+               'matches': sum(t['games'] for t in database.get_all_time_table()[0]['teams']) // 2,
+               'seconds': round(time.perf_counter() - start, 2)}
+    print('history: %(tournaments)s tournaments, %(teams)s teams, %(matches)s matches (%(seconds)s s)' % history)
+
+    with tempfile.TemporaryDirectory() as directory:
+        benchmarks = database_benchmarks(database, os.path.join(directory, 'remote_queue'))
+        if not args.no_widgets:
+            benchmarks += widget_benchmarks(database)
+        results = run(benchmarks, args.repeat, args.only)
+
+    data = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'config': config, 'model': model, 'history': history, 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(data, output, indent=2)
+            output.write('\n')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline:
+            if compare(data, json.load(baseline), args.tolerance):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
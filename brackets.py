@@ -0,0 +1,61 @@
+import math
+
+
+def create_double_elimination_bracket(team_count):
+    """ Create the slot graph of a double elimination bracket for team_count (power of two) teams.
+
+    Every slot is one match of the upper bracket ('U'), lower bracket ('L') or grand final ('F').
+    winner_to and loser_to hold the (slot, side) the winner/loser of a slot moves on to, so
+    advancing a team after a result is a single lookup."""
+    assert team_count >= 4 and (team_count & (team_count - 1)) == 0
+    upper_rounds = int(math.log2(team_count))
+    slots = []
+
+    def add_round(bracket, round, match_count):
+        first = len(slots)
+        for position in range(match_count):
+            slots.append({'slot': first + position, 'bracket': bracket, 'round': round, 'position': position,
+                          'winner_to': None, 'loser_to': None})
+        return slots[first:]
+
+    upper = [add_round('U', r, team_count >> r) for r in range(1, upper_rounds + 1)]
+    # the lower bracket alternates between rounds that pair its own winners and rounds
+    # that let the losers of the next upper round drop in
+    lower = [add_round('L', r, team_count >> ((r + 1) // 2 + 1)) for r in range(1, 2 * (upper_rounds - 1) + 1)]
+    grand_final = add_round('F', 1, 1)[0]
+
+    for r, rnd in enumerate(upper):
+        for slot in rnd:
+            i = slot['position']
+            if r + 1 < len(upper):
+                slot['winner_to'] = (upper[r + 1][i // 2]['slot'], i % 2)
+            else:
+                slot['winner_to'] = (grand_final['slot'], 0)
+            if r == 0:
+                slot['loser_to'] = (lower[0][i // 2]['slot'], i % 2)
+            else:
+                # drop in reversed order to avoid early rematches
+                target = lower[2 * r - 1]
+                slot['loser_to'] = (target[len(target) - 1 - i]['slot'], 1)
+
+    for r, rnd in enumerate(lower):
+        for slot in rnd:
+            i = slot['position']
+            if r + 1 == len(lower):
+                slot['winner_to'] = (grand_final['slot'], 1)
+            elif r % 2 == 0:
+                slot['winner_to'] = (lower[r + 1][i]['slot'], 0)
+            else:
+                slot['winner_to'] = (lower[r + 1][i // 2]['slot'], i % 2)
+    return slots
+
+
+def ko_size(stage_name):
+    """ Number of teams starting the KO phase, taken from the name of its first stage."""
+    if stage_name is None:
+        return 0
+    if stage_name.startswith('DE'):
+        return int(stage_name[2:])
+    if stage_name.startswith('KO_FINAL'):
+        return 2
+    return 2 * int(stage_name[2:])
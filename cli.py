@@ -0,0 +1,250 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+import re
+import sys
+
+import querylog
+from draw import DrawState, draw_teams
+from tools import DATABASE_FILE, DEFAULT_STYLESHEET, BracketError, DataBaseManager, TournamentStageStatus
+
+
+class CommandError(Exception):
+    pass
+
+
+def find_tournament(database, key):
+    """ The tournament with the id or name key."""
+    for tournament in database.get_tournament_list():
+        if str(tournament['id']) == key or tournament['name'] == key:
+            return tournament
+    raise CommandError('no tournament %r' % key)
+
+
+def all_matches(database, tournament_id):
+    """ (stage name, match) of every match, group matches first."""
+    for group in database.get_tournament_groups(tournament_id):
+        for match in group['matches'] or []:
+            yield group['name'], match
+    for stage in database.get_tournament_ko_stages(tournament_id).values():
+        for match in stage['matches']:
+            yield stage['name'], match
+
+
+def score(match):
+    if match['status'] == 0:
+        return '-'
+    return '%s:%s' % (match['team1_score'], match['team2_score'])
+
+
+def list_tournaments(database, args):
+    for tournament in database.get_tournament_list():
+        status = database.get_tournament_status(tournament['id'])
+        print('%4s  %-30s %3s teams  %s' % (tournament['id'], tournament['name'], tournament['num_teams'],
+                                            status['name'] if status else ''))
+
+
+def create(database, args):
+    teams = list(args.team)
+    if args.teams_file:
+        with open(args.teams_file, encoding='utf-8') as teams_file:
+            teams += [line.strip() for line in teams_file if line.strip()]
+    if len(teams) < 2:
+        raise CommandError('a tournament needs at least two teams')
+    data = {'name': args.name, 'stylesheet': DEFAULT_STYLESHEET, 'num_teams': len(teams),
+            'group_size': args.group_size, 'teams_in_ko': args.teams_in_ko,
+            # a double elimination bracket needs at least two rounds
+            'ko_mode': args.ko_mode if args.teams_in_ko >= 4 else 'single',
+            'teams': [{'name': name} for name in teams]}
+    if not database.store_tournament(data):
+        raise CommandError('could not create %r' % args.name)
+
+
+def draw_groups(database, tournament, seed=None, ratings=True, rounds=1):
+    """ Draw the open group slots of a tournament, returns the seed that draws them again."""
+    status = database.get_tournament_status(tournament['id'])
+    if status['current_stage'] != 0 or status['status'] == TournamentStageStatus.INITIALIZED:
+        raise CommandError('%s can not be drawn (%s)' % (tournament['name'], status['name']))
+    groups = database.get_tournament_groups(tournament['id'])
+    teams = [t['id'] for t in database.get_tournament_teams(tournament['id'])]
+    state = DrawState([max(g['size'], len(g['teams'])) for g in groups], teams)
+    for g, group in enumerate(groups):
+        for s, team in enumerate(group['teams']):
+            state.move(team['id'], (g, s))
+    seed = seed if seed is not None else random.randrange(2 ** 32)
+    draw_teams(state, database.get_draw_info(tournament['id']) if ratings else None, seed)
+    database.update_tournament_groups(tournament['id'], [
+        {'id': group['id'], 'teams': teams, 'rounds': rounds} for group, teams in zip(groups, state.groups())])
+    return seed
+
+
+def can_generate(status):
+    """ Whether the current stage is complete and the next one gets its matches from generate."""
+    return status['status'] == TournamentStageStatus.COMPLETE and not status['name'].startswith('KO_FINAL_') \
+        and not status['name'].startswith('DE')
+
+
+def draw(database, args):
+    tournament = find_tournament(database, args.tournament)
+    seed = draw_groups(database, tournament, args.seed, not args.random, args.rounds)
+    database.remote_queue.execute_updates()
+    print('drew %s with seed %r' % (tournament['name'], seed))
+
+
+def generate(database, args):
+    tournament = find_tournament(database, args.tournament)
+    status = database.get_tournament_status(tournament['id'])
+    if not can_generate(status):
+        raise CommandError('%s has no matches to generate (%s, %s)' % (tournament['name'], status['name'],
+                                                                       status['status'].name))
+    database.generate_matches(tournament['id'], status)
+    database.remote_queue.execute_updates()
+
+
+def matches(database, args):
+    tournament = find_tournament(database, args.tournament)
+    for stage, match in all_matches(database, tournament['id']):
+        if args.open and match['status'] == 2:
+            continue
+        print('%5s  %-10s %-30s %-30s %s' % (match['id'], stage, match['team1'], match['team2'], score(match)))
+
+
+def result(database, args):
+    tournament = find_tournament(database, args.tournament)
+    for stage, match in all_matches(database, tournament['id']):
+        if match['id'] == args.match:
+            break
+    else:
+        raise CommandError('%s has no match %r' % (tournament['name'], args.match))
+    # matches are played until one team reaches 0
+    if args.status == 2 and not (0 == args.score1 < args.score2 or 0 == args.score2 < args.score1):
+        raise CommandError('a finished match needs one team at 0 and the other above')
+    match = dict(match, team1_score=args.score1, team2_score=args.score2, status=args.status)
+    try:
+        database.update_match(match)
+    except BracketError as ex:
+        raise CommandError(str(ex))
+    database.remote_queue.execute_updates()
+
+
+def standings(database, args):
+    tournament = find_tournament(database, args.tournament)
+    for group in database.get_tournament_groups(tournament['id']):
+        print('Group %s' % group['name'])
+        for rank, team in enumerate(group['teams'], 1):
+            print('%3d. %-30s %2s %2s %2s %4s:%-4s' % (rank, team['name'], team['games'], team['won'],
+                                                     team['lost'], team['score'], team['conceded']))
+    for stage in database.get_tournament_ko_stages(tournament['id']).values():
+        print(stage['name'])
+        for match in stage['matches']:
+            print('     %-30s %-30s %s' % (match['team1'], match['team2'], score(match)))
+
+
+def export(database, args):
+    tournament = find_tournament(database, args.tournament)
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        if args.format == 'csv':
+            # the format import_flunkyrocks.py reads
+            year = re.search(r'\d{4}', tournament['name'])
+            writer = csv.writer(out, delimiter=';', quotechar='"')
+            for stage, match in all_matches(database, tournament['id']):
+                if match['status'] == 2:
+                    writer.writerow([match['team1'], match['team2'], match['team1_score'], match['team2_score'],
+                                     year.group() if year else '', stage])
+        else:
+            data = {'tournament': tournament,
+                    'status': database.get_tournament_status(tournament['id']),
+                    'teams': database.get_tournament_teams(tournament['id']),
+                    'groups': database.get_tournament_groups(tournament['id']),
+                    'ko_stages': list(database.get_tournament_ko_stages(tournament['id']).values())}
+            json.dump(data, out, indent=2, ensure_ascii=False, default=lambda value: getattr(value, 'name', str(value)))
+            out.write('\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def queries(database, args):
+    log = args.log or os.environ.get('TOURNAMENT_QUERY_LOG') or querylog.LOG_FILE
+    if not os.path.exists(log):
+        raise CommandError('no query log %r, set TOURNAMENT_QUERY_LOG to write one' % log)
+    querylog.report(log, None if args.all else args.day, args.limit)
+
+
+def parser():
+    main = argparse.ArgumentParser(prog='tournament-planner', description='Run tournaments without the GUI.')
+    main.add_argument('--db', default=DATABASE_FILE, help='database file (default: %(default)s)')
+    commands = main.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser('list', help='list the tournaments')
+    command.set_defaults(run=list_tournaments)
+
+    command = commands.add_parser('create', help='create a tournament')
+    command.add_argument('name')
+    command.add_argument('--team', action='append', default=[], help='a team, can be repeated')
+    command.add_argument('--teams-file', help='a file with one team per line')
+    command.add_argument('--group-size', type=int, default=4)
+    command.add_argument('--teams-in-ko', type=int, default=8)
+    command.add_argument('--ko-mode', choices=('single', 'double'), default='single')
+    command.set_defaults(run=create)
+
+    command = commands.add_parser('draw', help='draw the groups')
+    command.add_argument('tournament', help='id or name')
+    command.add_argument('--seed', type=int, help='draw the same groups again')
+    command.add_argument('--random', action='store_true', help='ignore ratings and last year\'s groups')
+    command.add_argument('--rounds', type=int, default=1, help='rounds per group')
+    command.set_defaults(run=draw)
+
+    command = commands.add_parser('generate', help='generate the matches of the next stage')
+    command.add_argument('tournament', help='id or name')
+    command.set_defaults(run=generate)
+
+    command = commands.add_parser('matches', help='list the matches')
+    command.add_argument('tournament', help='id or name')
+    command.add_argument('--open', action='store_true', help='only matches not finished yet')
+    command.set_defaults(run=matches)
+
+    command = commands.add_parser('result', help='enter the result of a match')
+    command.add_argument('tournament', help='id or name')
+    command.add_argument('match', type=int, help='match id, see matches')
+    command.add_argument('score1', type=int)
+    command.add_argument('score2', type=int)
+    command.add_argument('--status', type=int, choices=(1, 2), default=2, help='1: in progress, 2: finished')
+    command.set_defaults(run=result)
+
+    command = commands.add_parser('standings', help='show the group tables and KO matches')
+    command.add_argument('tournament', help='id or name')
+    command.set_defaults(run=standings)
+
+    command = commands.add_parser('export', help='write a tournament as json or csv')
+    command.add_argument('tournament', help='id or name')
+    command.add_argument('--format', choices=('json', 'csv'), default='json')
+    command.add_argument('-o', '--output', help='file instead of stdout')
+    command.set_defaults(run=export)
+
+    command = commands.add_parser('queries', help='the most expensive database queries of a day')
+    command.add_argument('--log', help='query log file (default: $TOURNAMENT_QUERY_LOG or %s)' % querylog.LOG_FILE)
+    command.add_argument('--day', default=datetime.date.today().isoformat(), help='YYYY-MM-DD (default: today)')
+    command.add_argument('--all', action='store_true', help='every day in the log')
+    command.add_argument('--limit', type=int, default=10)
+    command.set_defaults(run=queries)
+    return main
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    try:
+        args.run(DataBaseManager(args.db, sync=args.db == DATABASE_FILE), args)
+    except CommandError as ex:
+        print('tournament-planner: %s' % ex, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+import itertools
+import math
+import os
+import time
+
+CLINCHED = 'clinched'
+ELIMINATED = 'eliminated'
+ALIVE = 'alive'
+# time a group may take to solve on the GUI thread, the teams it could not decide in time stay alive
+BUDGET_MS = 50
+
+
+class OutOfTime(Exception):
+    pass
+
+
+def qualification_spots(teams_in_ko, group_count):
+    """ (places qualifying directly from every group, number of best next-placed teams qualifying)"""
+    if group_count == 0:
+        return 0, 0
+    direct = teams_in_ko // group_count
+    return direct, teams_in_ko - direct * group_count
+
+
+class GroupSolver:
+    """ Decides for every team of a group whether it can still finish inside or outside the top k places.
+
+    Only who wins the remaining matches is enumerated (memoised on the number of wins per team,
+    pruned with the best/worst case of every team). Scores have no upper limit, so where a tie
+    on wins decides, a team winning one of its remaining matches can still reach any higher
+    diff and score and a team losing one any lower diff; the margins of two teams are taken as
+    independent, which may keep a team open that actually is decided but never claims too much.
+    Teams equal on won, diff and score are ranked by the direct comparison like the group table
+    does, but only where that is settled: the tied teams have played all their matches and no
+    team still playing can end up on the same stats. Every other tie counts as possibly going
+    either way, so clinched/eliminated is never claimed too early."""
+
+    def __init__(self, teams, remaining, played=(), deadline=None):
+        """ teams: [(won, diff, score)], remaining: [(index of team1, index of team2)],
+        played: [(index of team1, index of team2, team1 score, team2 score)] of the finished matches,
+        deadline: time.monotonic() after which can_finish raises OutOfTime"""
+        self.deadline = deadline
+        self.teams = [tuple(t) for t in teams]
+        self.remaining = list(remaining)
+        self.team_count = len(self.teams)
+        # rem[i][team]: matches left for team from the i-th remaining match on
+        self.rem = [[0] * self.team_count for i in range(len(self.remaining) + 1)]
+        for i in range(len(self.remaining) - 1, -1, -1):
+            self.rem[i] = list(self.rem[i + 1])
+            for team in self.remaining[i]:
+                self.rem[i][team] += 1
+        # direct[t][u]: 1 if u wins the direct comparison against t, -1 if it loses, 0 if it is even
+        self.direct = {}
+        finished = [u for u in range(self.team_count) if self.rem[0][u] == 0]
+        for stats, tied in itertools.groupby(sorted(finished, key=lambda u: self.teams[u]), lambda u: self.teams[u]):
+            tied = list(tied)
+            # the group table leaves teams without a point of data in their order
+            if len(tied) < 2 or stats == (0, 0, 0):
+                continue
+            table = dict((u, [0, 0, 0]) for u in tied)
+            for a, b, score_a, score_b in played:
+                if a in table and b in table:
+                    table[a][0] += score_a > score_b
+                    table[b][0] += score_b > score_a
+                    table[a][1] += score_a - score_b
+                    table[b][1] += score_b - score_a
+                    table[a][2] += score_a
+                    table[b][2] += score_b
+            for t in tied:
+                self.direct[t] = dict((u, (table[u] > table[t]) - (table[u] < table[t])) for u in tied if u != t)
+
+    def can_finish(self, t, k, outside):
+        """ True if team t can finish inside the top k places (outside=False) or below them (outside=True)."""
+        if outside and k >= self.team_count:
+            return False
+        if not outside and k >= self.team_count:
+            return True
+        wins = tuple(team[0] for team in self.teams)
+        return self.search_wins(t, k, outside, 0, wins, {})
+
+    def search_wins(self, t, k, outside, i, wins, memo):
+        key = (i, wins)
+        if key in memo:
+            return memo[key]
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise OutOfTime()
+        rem = self.rem[i]
+        t_min = wins[t]
+        t_max = wins[t] + rem[t]
+        others = [u for u in range(self.team_count) if u != t]
+        if outside:
+            if sum(1 for u in others if wins[u] + rem[u] >= t_min) < k:
+                result = False
+            elif sum(1 for u in others if wins[u] > t_max) >= k:
+                result = True
+            else:
+                result = None
+        else:
+            if sum(1 for u in others if wins[u] > t_max) >= k:
+                result = False
+            elif sum(1 for u in others if wins[u] + rem[u] >= t_min) < k:
+                result = True
+            else:
+                result = None
+        if result is None and i == len(self.remaining):
+            result = self.decide_ties(t, k, outside, wins)
+        elif result is None:
+            result = False
+            a, b = self.remaining[i]
+            # let t lose first when looking for a bad finish, win first otherwise
+            winners = (b, a) if (a == t) == outside else (a, b)
+            for winner in winners:
+                next_wins = list(wins)
+                next_wins[winner] += 1
+                if self.search_wins(t, k, outside, i + 1, tuple(next_wins), memo):
+                    result = True
+                    break
+        memo[key] = result
+        return result
+
+    def bounds(self, team, won):
+        """ (worst, best) (diff, score) of team once it has won games, given its remaining matches."""
+        _, diff, score = self.teams[team]
+        wins = won - self.teams[team][0]
+        losses = self.rem[0][team] - wins
+        # a won match adds the margin to diff and score, a lost one takes it off diff
+        worst = (-math.inf if losses else diff + wins, score + wins)
+        best = (math.inf if wins else diff - losses, math.inf if wins else score)
+        return worst, best
+
+    def direct_comparison(self, t, u, wins):
+        """ 1 if u surely ranks above t when both end equal on won, diff and score, -1 if surely
+        below, 0 if it can go either way."""
+        result = self.direct.get(t, {}).get(u, 0)
+        if result:
+            # a team still playing could join the tie and change the direct comparison
+            stats = self.teams[t][1:]
+            for v in range(self.team_count):
+                if self.rem[0][v] and wins[v] == wins[t]:
+                    worst, best = self.bounds(v, wins[v])
+                    if worst <= stats <= best:
+                        return 0
+        return result
+
+    def decide_ties(self, t, k, outside, wins):
+        """ All remaining matches decided by wins, the margins decide the ties on wins."""
+        t_worst, t_best = self.bounds(t, wins[t])
+        above = 0
+        for u in range(self.team_count):
+            if u == t:
+                continue
+            if wins[u] != wins[t]:
+                above += wins[u] > wins[t]
+            elif outside:
+                u_best = self.bounds(u, wins[u])[1]
+                above += u_best > t_worst or u_best == t_worst and self.direct_comparison(t, u, wins) >= 0
+            else:
+                u_worst = self.bounds(u, wins[u])[0]
+                above += u_worst > t_best or u_worst == t_best and self.direct_comparison(t, u, wins) > 0
+        return above >= k if outside else above < k
+
+
+def solve_group(group, direct, extra, budget=None):
+    """ {team id: CLINCHED / ELIMINATED / ALIVE} for a group of get_tournament_groups, teams not
+    decided within budget ms are ALIVE."""
+    teams = group['teams']
+    index = dict((team['id'], i) for i, team in enumerate(teams))
+    stats = [(int(team['won']), int(team['diff']), int(team['score'])) for team in teams]
+    if group['matches']:
+        remaining = [(index[m['team1_id']], index[m['team2_id']]) for m in group['matches'] if m['status'] != 2]
+        played = [(index[m['team1_id']], index[m['team2_id']], int(m['team1_score']), int(m['team2_score']))
+                  for m in group['matches'] if m['status'] == 2]
+    else:
+        remaining = list(itertools.combinations(range(len(teams)), 2))
+        played = []
+    # the next placed team may still qualify as one of the best of all groups
+    reach = direct + 1 if extra else direct
+
+    if not remaining:
+        # the table is final, including the direct comparison
+        return dict((team['id'], CLINCHED if i < direct else ELIMINATED if i >= reach else ALIVE)
+                    for i, team in enumerate(teams))
+
+    deadline = time.monotonic() + budget / 1000. if budget is not None else None
+    solver = GroupSolver(stats, remaining, played, deadline)
+    result = {}
+    for i, team in enumerate(teams):
+        try:
+            if direct > 0 and not solver.can_finish(i, direct, outside=True):
+                result[team['id']] = CLINCHED
+            elif not solver.can_finish(i, reach, outside=False):
+                result[team['id']] = ELIMINATED
+            else:
+                result[team['id']] = ALIVE
+        except OutOfTime:
+            result[team['id']] = ALIVE
+    return result
+
+
+class QualificationTracker:
+    """ Keeps the solved state of every group and only solves groups again whose table or
+    remaining matches changed, so a match update costs one group. Solving a group stops after
+    budget ms (TOURNAMENT_CLINCH_MS, default BUDGET_MS), it runs on the GUI thread."""
+
+    def __init__(self, budget=None):
+        if budget is None:
+            budget = float(os.environ.get('TOURNAMENT_CLINCH_MS', BUDGET_MS))
+        self.budget = budget
+        self.groups = {}
+        self.solved = 0
+
+    def update(self, groups, teams_in_ko):
+        """ Annotates every team of groups with 'qualification' and returns {team id: state}."""
+        direct, extra = qualification_spots(teams_in_ko, len(groups))
+        states = {}
+        for group in groups:
+            key = (direct, extra,
+                   tuple((t['id'], t['won'], t['diff'], t['score']) for t in group['teams']),
+                   tuple((m['id'], m['status'], m['team1_score'], m['team2_score']) for m in group['matches']))
+            cached = self.groups.get(group['id'])
+            if cached is None or cached[0] != key:
+                cached = (key, solve_group(group, direct, extra, self.budget))
+                self.groups[group['id']] = cached
+                self.solved += 1
+            for team in group['teams']:
+                team['qualification'] = cached[1][team['id']]
+            states.update(cached[1])
+        return states
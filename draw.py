@@ -0,0 +1,236 @@
+import math
+import random
+from collections import Counter
+
+
+class DrawError(Exception):
+    pass
+
+
+def make_pots(teams, ratings, pot_size, default_rating=0):
+    """ Split teams into pots of pot_size teams, strongest rated teams first."""
+    ranked = sorted(teams, key=lambda t: ratings.get(t, default_rating), reverse=True)
+    return [ranked[i:i + pot_size] for i in range(0, len(ranked), pot_size)]
+
+
+def solve_draw(pots, group_count, group_size, separate=None, assigned=None, balance_halves=True,
+               separate_halves=False, seed=None, max_steps=200000):
+    """ Draw the teams of pots into group_count groups of at most group_size teams.
+
+    Constraints: at most one team per pot in every group, teams with the same key in separate
+    (e.g. last year's group) never share a group, every pot is balanced over the two halves of
+    the groups (the two halves of the bracket) and, with separate_halves, teams sharing a key are
+    spread over both halves as well. assigned maps teams to groups they are already placed in.
+
+    Solved by backtracking over the team with the fewest remaining groups, pruning the groups of
+    all affected teams after every placement. Returns a list of group_count lists of teams."""
+    rng = random.Random(seed)
+    separate = separate if separate is not None else {}
+    assigned = assigned if assigned is not None else {}
+
+    pot_of = {}
+    for p, pot in enumerate(pots):
+        if len(pot) > group_count:
+            raise DrawError('pot %r has %r teams for %r groups' % (p + 1, len(pot), group_count))
+        for team in pot:
+            pot_of[team] = p
+    pot_half_limit = [int(math.ceil(len(pot) / 2.0)) for pot in pots]
+    key_half_limit = dict((k, int(math.ceil(c / 2.0))) for k, c in Counter(separate.values()).items())
+    half_of = [0 if g < group_count // 2 else 1 for g in range(group_count)]
+
+    groups = [[] for g in range(group_count)]
+    group_pots = [set() for g in range(group_count)]
+    group_keys = [set() for g in range(group_count)]
+    pot_halves = [[0, 0] for pot in pots]
+    key_halves = dict((k, [0, 0]) for k in key_half_limit)
+    by_pot = [[] for pot in pots]
+    by_key = dict((k, []) for k in key_half_limit)
+
+    def allowed(team, g):
+        p = pot_of.get(team)
+        k = separate.get(team)
+        h = half_of[g]
+        if len(groups[g]) >= group_size:
+            return False
+        if p is not None and (p in group_pots[g] or (balance_halves and pot_halves[p][h] >= pot_half_limit[p])):
+            return False
+        if k is not None and (k in group_keys[g] or
+                              (separate_halves and key_halves[k][h] >= key_half_limit[k])):
+            return False
+        return True
+
+    def place(team, g, sign=1):
+        p = pot_of.get(team)
+        k = separate.get(team)
+        h = half_of[g]
+        if sign > 0:
+            groups[g].append(team)
+        else:
+            groups[g].remove(team)
+        if p is not None:
+            (group_pots[g].add if sign > 0 else group_pots[g].discard)(p)
+            pot_halves[p][h] += sign
+        if k is not None:
+            (group_keys[g].add if sign > 0 else group_keys[g].discard)(k)
+            key_halves[k][h] += sign
+
+    for team, g in assigned.items():
+        place(team, g)
+
+    free = [t for t in pot_of if t not in assigned]
+    for team in free:
+        by_pot[pot_of[team]].append(team)
+        if team in separate:
+            by_key[separate[team]].append(team)
+    domains = dict((t, set(g for g in range(group_count) if allowed(t, g))) for t in free)
+    steps = [0]
+
+    def solve():
+        if not domains:
+            return True
+        steps[0] += 1
+        if steps[0] > max_steps:
+            raise DrawError('no valid draw found within %r steps' % max_steps)
+        fewest = min(len(d) for d in domains.values())
+        team = rng.choice([t for t in domains if len(domains[t]) == fewest])
+        choices = list(domains.pop(team))
+        rng.shuffle(choices)
+        for g in choices:
+            place(team, g)
+            # prune: only teams sharing the pot or key, or the group if it is full now
+            affected = set(by_pot[pot_of[team]])
+            if team in separate:
+                affected.update(by_key[separate[team]])
+            if len(groups[g]) >= group_size:
+                affected.update(domains.keys())
+            saved = {}
+            wiped = False
+            for other in affected:
+                if other in domains:
+                    saved[other] = domains[other]
+                    domains[other] = set(x for x in domains[other] if allowed(other, x))
+                    if not domains[other]:
+                        wiped = True
+                        break
+            if not wiped and solve():
+                return True
+            domains.update(saved)
+            place(team, g, -1)
+        domains[team] = set(choices)
+        return False
+
+    if not solve():
+        raise DrawError('no valid draw for these pots and constraints')
+    for group in groups:
+        group.sort(key=lambda t: pot_of.get(t, len(pots)))
+    return groups
+
+
+def seed_ko_bracket(pots, separate=None, seed=None):
+    """ Order the qualified teams for the first KO round, which pairs neighbours.
+
+    Every match gets at most one team per pot (e.g. group winner vs. runner-up), teams with the
+    same key (their group) never meet in the first round and end up in different bracket halves."""
+    match_count = sum(len(pot) for pot in pots) // 2
+    # a pot with more teams than matches has to play against itself
+    pots = [pot[i:i + match_count] for pot in pots for i in range(0, len(pot), match_count)]
+    matches = solve_draw(pots, match_count, 2, separate=separate, separate_halves=True, seed=seed)
+    return [team for match in matches for team in match]
+
+
+class DrawState:
+    """ The slots of every group of a draw and the teams not placed yet.
+
+    where maps every placed team to its (group, slot), so moving or swapping a team never
+    searches the groups. The draw widgets only render this state."""
+
+    def __init__(self, group_sizes, teams=()):
+        self.slots = [[None] * size for size in group_sizes]
+        self.where = {}
+        # a dict keeps the order the teams are listed in
+        self.unassigned = dict.fromkeys(teams)
+
+    def position(self, team):
+        """ (group, slot) of a placed team, None for an unassigned one."""
+        return self.where.get(team)
+
+    def take(self, team):
+        position = self.where.pop(team, None)
+        if position is None:
+            self.unassigned.pop(team, None)
+        else:
+            self.slots[position[0]][position[1]] = None
+        return position
+
+    def put(self, team, position):
+        if position is None:
+            self.unassigned[team] = None
+        else:
+            self.slots[position[0]][position[1]] = team
+            self.where[team] = position
+
+    def move(self, team, target):
+        """ Put team into the target (group, slot), or back to the unassigned teams if target is None.
+        A team already in target takes the old place of team. Returns the team swapped out or None."""
+        source = self.where.get(team)
+        if source == target:
+            return None
+        occupant = None if target is None else self.slots[target[0]][target[1]]
+        self.take(team)
+        if occupant is not None:
+            self.take(occupant)
+            self.put(occupant, source)
+        self.put(team, target)
+        return occupant
+
+    def empty_slots(self):
+        return [(g, s) for g, slots in enumerate(self.slots) for s, team in enumerate(slots) if team is None]
+
+    def fill(self, draw=None, seed=None):
+        """ Place the unassigned teams into the empty slots in one pass, returns [(team, (group, slot))].
+
+        draw lists the teams to add to every group (e.g. from solve_draw), without it the teams are
+        shuffled with seed. The teams are sorted first, so a seed gives the same draw whatever order
+        they were listed in."""
+        empty = self.empty_slots()
+        if draw is None:
+            teams = sorted(self.unassigned)
+            random.Random(seed).shuffle(teams)
+            placed = list(zip(teams, empty))
+        else:
+            free = {}
+            for g, s in empty:
+                free.setdefault(g, []).append((g, s))
+            placed = [(team, position) for g, teams in enumerate(draw) for team, position in zip(teams, free.get(g, ()))]
+        for team, position in placed:
+            self.move(team, position)
+        return placed
+
+    def assigned(self):
+        """ {team: group} of the placed teams."""
+        return dict((team, position[0]) for team, position in self.where.items())
+
+    def groups(self):
+        return [[team for team in slots if team is not None] for slots in self.slots]
+
+    def complete(self):
+        return not self.unassigned
+
+
+def draw_teams(state, draw_info=None, seed=None):
+    """ Fill the empty slots of a DrawState, returns the placed teams like DrawState.fill.
+
+    With draw_info ({'ratings': {team: rating}, 'previous_groups': {team: group}}) the teams are
+    drawn from rating pots keeping the teams already placed, otherwise or if that fails randomly."""
+    draw = None
+    if draw_info is not None and state.slots:
+        assigned = state.assigned()
+        # sorted, so teams with equal ratings don't depend on the order they were moved in
+        pots = make_pots(sorted(assigned) + sorted(state.unassigned), draw_info['ratings'], len(state.slots))
+        try:
+            groups = solve_draw(pots, len(state.slots), max(len(slots) for slots in state.slots),
+                                separate=draw_info['previous_groups'], assigned=assigned, seed=seed)
+            draw = [[t for t in group if t not in assigned] for group in groups]
+        except DrawError as ex:
+            print('pot draw failed, drawing randomly:', ex)
+    return state.fill(draw, seed)
@@ -1,6 +1,8 @@
 import math
+import sys
 from collections import OrderedDict
 
+from search import TeamSearchIndex
 from tools import DataBaseManager, InsertNotUniqueException
 import csv
 
@@ -21,6 +23,27 @@ flunky_rocks = {'2015': '*{background-color: rgb(30,143,158); color: rgb(0,0,80)
 
 database = DataBaseManager()
 
+# near-duplicates of known teams are reported, with --merge they are imported as the known team
+merge = '--merge' in sys.argv
+known_teams = TeamSearchIndex(t['name'] for t in database.get_teams())
+aliases = {}
+
+
+def resolve_team(name):
+    if name not in aliases:
+        aliases[name] = name
+        if name not in known_teams:
+            similar = known_teams.similar(name)
+            if similar:
+                score, other = similar[0]
+                print('%s looks like %s (%.2f)%s' % (name, other, score, ', merged' if merge else ''))
+                if merge:
+                    aliases[name] = other
+            if aliases[name] == name:
+                known_teams.add(name)
+    return aliases[name]
+
+
 for year in sorted(flunky_rocks.keys()):
     groups = OrderedDict()
     matches = OrderedDict()
@@ -31,8 +54,8 @@ for year in sorted(flunky_rocks.keys()):
     with open('%s.csv' % year, 'r', encoding='utf-8') as csv_file:
         reader = csv.reader(csv_file, delimiter=';', quotechar='"')
         for row in reader:
-            team1 = row[0]
-            team2 = row[1]
+            team1 = resolve_team(row[0])
+            team2 = resolve_team(row[1])
             score1 = row[2]
             score2 = row[3]
             # year = row[4]
@@ -80,3 +103,5 @@ for year in sorted(flunky_rocks.keys()):
             'finals': finals,
             'matches': matches}
     database.import_two_stage_tournament(data)
+
+database.rebuild_ratings()
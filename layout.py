@@ -47,13 +47,21 @@ class FlowLayout(QLayout):
     def __init__(self, parent=None, margin=0, spacing=-1):
         super(FlowLayout, self).__init__(parent)
 
+        self.itemList = []
+        # size hint and spacing per item and style, cleared by invalidate()
+        self.hints = None
+        self.minimum = None
+        self.heights = {}
+        self.style_spacing = {}
+        # what the last real layout placed, to restart at the first changed item
+        self.last_rect = None
+        self.placed = []
+
         if parent is not None:
             self.setContentsMargins(margin, margin, margin, margin)
 
         self.setSpacing(spacing)
 
-        self.itemList = []
-
     def __del__(self):
         item = self.takeAt(0)
         while item:
@@ -61,6 +69,7 @@ class FlowLayout(QLayout):
 
     def addItem(self, item):
         self.itemList.append(item)
+        self.clear_cache()
 
     def count(self):
         return len(self.itemList)
@@ -73,10 +82,22 @@ class FlowLayout(QLayout):
 
     def takeAt(self, index):
         if 0 <= index < len(self.itemList):
-            return self.itemList.pop(index)
+            item = self.itemList.pop(index)
+            self.clear_cache()
+            return item
 
         return None
 
+    def clear_cache(self):
+        self.hints = None
+        self.minimum = None
+        self.heights.clear()
+        self.style_spacing.clear()
+
+    def invalidate(self):
+        self.clear_cache()
+        super(FlowLayout, self).invalidate()
+
     def expandingDirections(self):
         return Qt.Orientations(Qt.Orientation(0))
 
@@ -84,8 +105,10 @@ class FlowLayout(QLayout):
         return True
 
     def heightForWidth(self, width):
-        height = self.doLayout(QRect(0, 0, width, 0), True)
-        return height
+        # Qt probes many widths while resizing, they stay valid until the next invalidate()
+        if width not in self.heights:
+            self.heights[width] = self.doLayout(QRect(0, 0, width, 0), True)
+        return self.heights[width]
 
     def setGeometry(self, rect):
         super(FlowLayout, self).setGeometry(rect)
@@ -95,36 +118,64 @@ class FlowLayout(QLayout):
         return self.minimumSize()
 
     def minimumSize(self):
-        size = QSize()
+        if self.minimum is None:
+            size = QSize()
+
+            for item in self.itemList:
+                size = size.expandedTo(item.minimumSize())
 
-        for item in self.itemList:
-            size = size.expandedTo(item.minimumSize())
+            margin, _, _, _ = self.getContentsMargins()
 
-        margin, _, _, _ = self.getContentsMargins()
+            size += QSize(2 * margin, 2 * margin)
+            self.minimum = size
+        return QSize(self.minimum)
 
-        size += QSize(2 * margin, 2 * margin)
-        return size
+    def spacings(self, style):
+        if style not in self.style_spacing:
+            self.style_spacing[style] = (
+                self.spacing() + style.layoutSpacing(QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Horizontal),
+                self.spacing() + style.layoutSpacing(QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Vertical))
+        return self.style_spacing[style]
+
+    def item_hints(self):
+        if self.hints is None:
+            self.hints = [(item.sizeHint(),) + self.spacings(item.widget().style()) for item in self.itemList]
+        return self.hints
 
     def doLayout(self, rect, testOnly):
-        x = rect.x()
-        y = rect.y()
-        lineHeight = 0
-
-        for item in self.itemList:
-            wid = item.widget()
-            spaceX = self.spacing() + wid.style().layoutSpacing(QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Horizontal)
-            spaceY = self.spacing() + wid.style().layoutSpacing(QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Vertical)
-            nextX = x + item.sizeHint().width() + spaceX
+        hints = self.item_hints()
+        start = 0
+        if not testOnly:
+            # items in front of the first added, removed or resized one keep their place
+            if rect == self.last_rect:
+                while start < len(self.placed) and start < len(self.itemList) and \
+                        self.placed[start][0] is self.itemList[start] and self.placed[start][1] == hints[start][0]:
+                    start += 1
+            del self.placed[start:]
+            self.last_rect = QRect(rect)
+
+        if start > 0:
+            x, y, lineHeight = self.placed[start - 1][2]
+        else:
+            x = rect.x()
+            y = rect.y()
+            lineHeight = 0
+
+        for i in range(start, len(self.itemList)):
+            hint, spaceX, spaceY = hints[i]
+            nextX = x + hint.width() + spaceX
             if nextX - spaceX > rect.right() and lineHeight > 0:
                 x = rect.x()
                 y = y + lineHeight + spaceY
-                nextX = x + item.sizeHint().width() + spaceX
+                nextX = x + hint.width() + spaceX
                 lineHeight = 0
 
             if not testOnly:
-                item.setGeometry(QRect(QPoint(x, y), item.sizeHint()))
+                self.itemList[i].setGeometry(QRect(QPoint(x, y), hint))
 
             x = nextX
-            lineHeight = max(lineHeight, item.sizeHint().height())
+            lineHeight = max(lineHeight, hint.height())
+            if not testOnly:
+                self.placed.append((self.itemList[i], hint, (x, y, lineHeight)))
 
         return y + lineHeight - rect.y()
@@ -0,0 +1,80 @@
+import time
+
+from PyQt5.QtCore import QTimer
+
+IDLE_SECONDS = 120
+POOL_SIZE = 64
+
+
+class WidgetPool:
+    """ Released widgets by kind, handed out again instead of building new ones.
+
+    Releasing disconnects the given signals and calls reset_state() if the widget has it, so a
+    reused widget carries neither old connections nor old dialogs. Widgets idle for longer than
+    idle_seconds are deleted, at most size widgets are kept per kind."""
+
+    def __init__(self, idle_seconds=IDLE_SECONDS, size=POOL_SIZE):
+        self.idle_seconds = idle_seconds
+        self.size = size
+        self.free = {}
+        self.timer = None
+        self.created = 0
+        self.reused = 0
+        self.trimmed = 0
+
+    def take(self, kind, factory):
+        free = self.free.get(kind)
+        if free:
+            self.reused += 1
+            return free.pop()[0]
+        self.created += 1
+        return factory()
+
+    def release(self, kind, widget, signals=()):
+        for signal in signals:
+            try:
+                signal.disconnect()
+            except TypeError:  # nothing connected
+                pass
+        if hasattr(widget, 'reset_state'):
+            widget.reset_state()
+        widget.hide()
+        widget.setParent(None)
+        free = self.free.setdefault(kind, [])
+        if len(free) >= self.size:
+            self.trimmed += 1
+            widget.deleteLater()
+            return
+        free.append((widget, time.monotonic()))
+        self.schedule_trim()
+
+    def schedule_trim(self):
+        if self.timer is None:
+            self.timer = QTimer()
+            self.timer.setSingleShot(True)
+            self.timer.timeout.connect(self.trim)
+        if not self.timer.isActive():
+            self.timer.start(self.idle_seconds * 1000)
+
+    def trim(self, idle_seconds=None):
+        """ Delete the widgets released more than idle_seconds ago."""
+        idle_seconds = self.idle_seconds if idle_seconds is None else idle_seconds
+        deadline = time.monotonic() - idle_seconds
+        for kind, free in self.free.items():
+            keep = []
+            for widget, released in free:
+                if released > deadline:
+                    keep.append((widget, released))
+                else:
+                    self.trimmed += 1
+                    widget.deleteLater()
+            self.free[kind] = keep
+        if any(self.free.values()):
+            self.schedule_trim()
+
+    def stats(self):
+        return {'created': self.created, 'reused': self.reused, 'trimmed': self.trimmed,
+                'free': dict((kind, len(free)) for kind, free in self.free.items())}
+
+
+pool = WidgetPool()
@@ -0,0 +1,185 @@
+import atexit
+import bisect
+import datetime
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+from threading import Lock
+
+LOG_FILE = 'query_log'
+SLOW_MS = 25.
+FLUSH_SECONDS = 60
+FINGERPRINT_CACHE = 1000
+# upper edges of the histogram buckets in ms, the last bucket holds everything slower
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+SPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """ The statement with literals replaced by ?, so statements differing only in their values
+    are counted together: "WHERE id IN (1, 2, 3)" -> "WHERE id IN (?...)"."""
+    sql = NUMBER.sub('?', STRING.sub('?', sql))
+    return SPACE.sub(' ', VALUE_LIST.sub('(?...)', sql)).strip()
+
+
+def now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+class QueryLog:
+    """ Timing of the statements DataBaseManager.execute_query runs, off unless enabled.
+
+    Statements are aggregated by fingerprint into count, time, rows, calling methods and a
+    histogram over BUCKETS. Statements slower than threshold ms are written to the log file at
+    once together with their EXPLAIN QUERY PLAN, the aggregates every FLUSH_SECONDS and at exit.
+    The log has one json object per line, report() reads it back."""
+
+    def __init__(self):
+        self.enabled = False
+        self.file_name = None
+        self.threshold = SLOW_MS
+        self.stats = {}
+        self.slow_queries = []
+        # the statements are mostly the same prepared strings, only fingerprint them once
+        self.fingerprints = {}
+        self.lock = Lock()
+        self.flushed = time.monotonic()
+        self.registered = False
+
+    def enable(self, file_name=LOG_FILE, threshold=SLOW_MS):
+        """ Start timing, file_name=None keeps the log in memory (stats and slow_queries)."""
+        self.file_name = file_name
+        self.threshold = threshold
+        self.enabled = True
+        if not self.registered:
+            atexit.register(self.flush)
+            self.registered = True
+
+    def disable(self):
+        self.flush()
+        self.enabled = False
+
+    def record(self, query, method, seconds, rows):
+        ms = seconds * 1000
+        sql = query.executedQuery()
+        key = self.fingerprints.get(sql)
+        if key is None:
+            if len(self.fingerprints) >= FINGERPRINT_CACHE:
+                self.fingerprints.clear()
+            key = self.fingerprints[sql] = fingerprint(sql)
+        with self.lock:
+            stat = self.stats.get(key)
+            if stat is None:
+                stat = self.stats[key] = {'count': 0, 'ms': 0., 'max_ms': 0., 'rows': 0, 'methods': Counter(),
+                                          'histogram': [0] * (len(BUCKETS) + 1)}
+            stat['count'] += 1
+            stat['ms'] += ms
+            stat['max_ms'] = max(stat['max_ms'], ms)
+            stat['rows'] += rows
+            stat['methods'][method] += 1
+            stat['histogram'][bisect.bisect_left(BUCKETS, ms)] += 1
+        if ms >= self.threshold:
+            entry = {'type': 'slow', 'time': now(), 'ms': round(ms, 3), 'rows': rows, 'method': method,
+                     'sql': sql, 'parameters': query.parameters(), 'plan': query.explain()}
+            self.slow_queries.append(entry)
+            self.write(entry)
+        if time.monotonic() - self.flushed > FLUSH_SECONDS:
+            self.flush()
+
+    def write(self, entry):
+        if self.file_name is None:
+            return
+        try:
+            with open(self.file_name, 'a', encoding='utf-8') as log:
+                log.write(json.dumps(entry, default=str) + '\n')
+        except OSError as ex:
+            print('query log:', ex)
+
+    def flush(self):
+        """ Write the aggregates collected since the last flush, in memory they keep adding up."""
+        if self.file_name is None:
+            return
+        with self.lock:
+            stats, self.stats = self.stats, {}
+            self.flushed = time.monotonic()
+        if stats:
+            self.write({'type': 'stats', 'time': now(), 'stats': stats})
+
+
+def merge(stats, more):
+    for key, stat in more.items():
+        into = stats.setdefault(key, {'count': 0, 'ms': 0., 'max_ms': 0., 'rows': 0, 'methods': Counter(),
+                                      'histogram': [0] * (len(BUCKETS) + 1)})
+        into['count'] += stat['count']
+        into['ms'] += stat['ms']
+        into['max_ms'] = max(into['max_ms'], stat['max_ms'])
+        into['rows'] += stat['rows']
+        into['methods'].update(stat['methods'])
+        into['histogram'] = [a + b for a, b in zip(into['histogram'], stat['histogram'])]
+    return stats
+
+
+def read(file_name=LOG_FILE, day=None):
+    """ (stats by fingerprint, slow queries) of the log entries written on day ('YYYY-MM-DD',
+    None for all)."""
+    stats = {}
+    slow = []
+    with open(file_name, encoding='utf-8') as log:
+        for line in log:
+            try:
+                entry = json.loads(line)
+            except ValueError:  # a line cut off by a crash
+                continue
+            if day is not None and not entry['time'].startswith(day):
+                continue
+            if entry['type'] == 'stats':
+                merge(stats, entry['stats'])
+            elif entry['type'] == 'slow':
+                slow.append(entry)
+    return stats, slow
+
+
+def histogram_line(histogram):
+    """ The histogram as one bar per bucket, scaled to its largest bucket."""
+    bars = ' .:-=+*#'
+    top = max(histogram) or 1
+    return ''.join(bars[int(math.ceil(count * (len(bars) - 1) / float(top)))] for count in histogram)
+
+
+def report(file_name=LOG_FILE, day=None, limit=10):
+    """ Print the statements with the most time spent in them and the slowest single statements."""
+    stats, slow = read(file_name, day)
+    total = sum(stat['ms'] for stat in stats.values())
+    print('%d statements, %d fingerprints, %.0f ms%s' % (sum(s['count'] for s in stats.values()), len(stats),
+                                                       total, ' on %s' % day if day else ''))
+    print('histogram buckets (ms): %s, more' % ', '.join('%g' % edge for edge in BUCKETS))
+    ranked = sorted(stats.items(), key=lambda item: -item[1]['ms'])[:limit]
+    for key, stat in ranked:
+        methods = ', '.join('%s %d' % m for m in Counter(stat['methods']).most_common(3))
+        print('\n%8.1f ms %5.1f%%  %6d x  mean %.2f ms  max %.1f ms  %d rows  [%s]' % (
+            stat['ms'], 100. * stat['ms'] / total if total else 0., stat['count'], stat['ms'] / stat['count'],
+            stat['max_ms'], stat['rows'], histogram_line(stat['histogram'])))
+        print('    %s' % methods)
+        print('    %s' % key)
+    if slow:
+        print('\nslowest statements:')
+    for entry in sorted(slow, key=lambda e: -e['ms'])[:limit]:
+        print('\n%8.1f ms  %s  %s  %d rows' % (entry['ms'], entry['time'], entry['method'], entry['rows']))
+        print('    %s' % SPACE.sub(' ', entry['sql']).strip())
+        if entry['parameters']:
+            print('    %s' % entry['parameters'])
+        for line in entry['plan']:
+            print('      %s' % line)
+
+
+query_log = QueryLog()
+if os.environ.get('TOURNAMENT_QUERY_LOG'):
+    query_log.enable(os.environ['TOURNAMENT_QUERY_LOG'],
+                     float(os.environ.get('TOURNAMENT_SLOW_QUERY_MS', SLOW_MS)))
@@ -0,0 +1,40 @@
+import math
+
+DEFAULT_RATING = 1500.0
+K_FACTOR = 32.0
+
+
+def expected_score(rating, opponent_rating):
+    return 1.0 / (1.0 + 10 ** ((opponent_rating - rating) / 400.0))
+
+
+def rating_delta(rating1, rating2, score1, score2, k=K_FACTOR):
+    """ Elo points team1 gains (and team2 loses) for a finished match.
+
+    Clear wins count more than narrow ones, damped by the rating gap so that favourites
+    don't farm points off weak teams."""
+    score1 = int(score1)
+    score2 = int(score2)
+    if score1 == score2:
+        return k * (0.5 - expected_score(rating1, rating2))
+    result = 1.0 if score1 > score2 else 0.0
+    winner_gap = rating1 - rating2 if result == 1.0 else rating2 - rating1
+    multiplier = math.log(abs(score1 - score2) + 1) * 2.2 / (winner_gap * 0.001 + 2.2)
+    return k * multiplier * (result - expected_score(rating1, rating2))
+
+
+def compute_ratings(matches, k=K_FACTOR, ratings=None):
+    """ Replay finished matches in chronological order, starting from ratings ({team: (rating, games)}).
+
+    matches: iterable of (match_id, team1, team2, team1_score, team2_score)
+    returns ({team: (rating, games)}, [(match_id, team1, team2, delta)])"""
+    ratings = dict(ratings or {})
+    deltas = []
+    for match_id, team1, team2, score1, score2 in matches:
+        rating1, games1 = ratings.get(team1, (DEFAULT_RATING, 0))
+        rating2, games2 = ratings.get(team2, (DEFAULT_RATING, 0))
+        delta = rating_delta(rating1, rating2, score1, score2, k)
+        ratings[team1] = (rating1 + delta, games1 + 1)
+        ratings[team2] = (rating2 - delta, games2 + 1)
+        deltas.append((match_id, team1, team2, delta))
+    return ratings, deltas
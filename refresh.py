@@ -0,0 +1,65 @@
+import time
+from collections import Counter
+
+from PyQt5.QtCore import QTimer
+
+from tracing import span
+
+GROUPS = 'groups'
+KO = 'ko'
+STATUS = 'status'
+TEAMS = 'teams'
+ALL = frozenset((GROUPS, KO, STATUS, TEAMS))
+
+DELAY = 50
+MAX_DELAY = 250
+
+
+class RefreshScheduler:
+    """ Collects which parts of a view are dirty and refreshes them in one pass.
+
+    Every mark() restarts a short timer, so a burst of edits ends in a single call of
+    refresh(parts). A steady stream of marks is still flushed after max_delay ms."""
+
+    def __init__(self, refresh, delay=DELAY, max_delay=MAX_DELAY):
+        self.refresh = refresh
+        self.delay = delay
+        self.max_delay = max_delay
+        self.dirty = set()
+        self.first_mark = None
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+        self.requested = 0
+        self.performed = 0
+        self.parts = Counter()
+
+    def mark(self, *parts):
+        self.requested += 1
+        self.dirty.update(parts)
+        now = time.monotonic()
+        if self.first_mark is None:
+            self.first_mark = now
+        waited = (now - self.first_mark) * 1000
+        if waited < self.max_delay:
+            self.timer.start(int(min(self.delay, self.max_delay - waited)))
+
+    def cancel(self):
+        self.timer.stop()
+        self.dirty = set()
+        self.first_mark = None
+
+    def flush(self):
+        self.timer.stop()
+        if not self.dirty:
+            return
+        parts = frozenset(self.dirty)
+        self.dirty = set()
+        self.first_mark = None
+        self.performed += 1
+        self.parts.update(parts)
+        with span('RefreshScheduler.flush', 'refresh', parts=sorted(parts)):
+            self.refresh(parts)
+
+    def stats(self):
+        return {'requested': self.requested, 'performed': self.performed, 'parts': dict(self.parts)}
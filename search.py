@@ -0,0 +1,176 @@
+import heapq
+import math
+import re
+import unicodedata
+
+N = 3
+MIN_OVERLAP = 0.5  # part of the query grams a name has to contain
+RECENCY_WEIGHT = 0.15
+LIMIT = 50
+MERGE_THRESHOLD = 0.75
+
+TRANSLATE = str.maketrans({'ß': 'ss', 'æ': 'ae', 'ø': 'o', 'œ': 'oe', 'ł': 'l'})
+NON_WORD = re.compile(r'[\W_]+')
+NUMBER = re.compile(r'\d+')
+
+
+def normalise(text):
+    """ Lower case words without accents, 'Flunkinése  Polonaise!' -> 'flunkinese polonaise'."""
+    text = unicodedata.normalize('NFKD', text.lower().translate(TRANSLATE))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return NON_WORD.sub(' ', text).strip()
+
+
+def ngrams(text, n=N, complete=True):
+    """ The n-grams of a normalised text, words padded with blanks. An incomplete text (still
+    being typed) gets no trailing padding."""
+    padded = ' ' + text + (' ' if complete else '')
+    return set(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+def prefixes(text, n=N):
+    """ The word starts up to n letters, a short query is looked up as a whole."""
+    keys = set()
+    for word in text.split():
+        for i in range(1, n + 1):
+            keys.add('^' + word[:i])
+    return keys
+
+
+class TeamSearchIndex:
+    """ Inverted n-gram index over team names for typo tolerant lookups.
+
+    Names are normalised and cut into trigrams, the postings map every gram to the names
+    containing it. A query only visits the postings of its rarest grams and scores the names
+    found there by gram overlap, so a lookup doesn't depend on the number of teams. Names that
+    have been used recently rank higher."""
+
+    def __init__(self, names=(), n=N):
+        self.n = n
+        self.names = []
+        self.ids = {}
+        self.grams = []
+        self.postings = {}
+        self.used = {}
+        self.now = 0
+        self.ranked = {}
+        self.lookups = 0
+        self.visited = 0
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def add(self, name, used=None):
+        """ Index a name, used orders names the way they have been used (e.g. the id of the last
+        tournament they played in)."""
+        if name in self.ids:
+            return self.ids[name]
+        name_id = len(self.names)
+        self.names.append(name)
+        self.ids[name] = name_id
+        norm = normalise(name)
+        grams = ngrams(norm, self.n)
+        self.grams.append(grams)
+        for key in grams | prefixes(norm, self.n):
+            self.postings.setdefault(key, []).append(name_id)
+        self.ranked.clear()
+        if used:
+            self.touch(name, used)
+        return name_id
+
+    def touch(self, name, used=None):
+        """ Mark a name as just used."""
+        name_id = self.ids.get(name)
+        if name_id is None:
+            return
+        if used is None:
+            used = self.now + 1
+        self.now = max(self.now, used)
+        self.used[name_id] = max(self.used.get(name_id, 0), used)
+        self.ranked.clear()
+
+    def recency(self, name_id):
+        used = self.used.get(name_id)
+        if not used:
+            return 0.
+        return RECENCY_WEIGHT * used / self.now
+
+    def by_recency(self, key):
+        """ The names of a posting, most recently used and then shortest first, sorted once per
+        change of the index."""
+        if key not in self.ranked:
+            ids = self.postings.get(key, ())
+            self.visited += len(ids)
+            self.ranked[key] = sorted(ids, key=lambda i: (-self.used.get(i, 0), len(self.names[i])))
+        return self.ranked[key]
+
+    def candidates(self, grams, min_overlap):
+        """ {name_id: overlap} of the names sharing at least min_overlap of the grams.
+
+        A name with that many grams has to show up in one of the len(grams) - needed + 1 rarest
+        postings, the common grams are only used to count overlaps."""
+        lists = sorted((self.postings.get(g, ()) for g in grams), key=len)
+        needed = max(1, int(math.ceil(len(lists) * min_overlap)))
+        found = set().union(*lists[:len(lists) - needed + 1])
+        self.visited += len(found)
+        result = {}
+        for name_id in found:
+            overlap = len(grams & self.grams[name_id])
+            if overlap >= needed:
+                result[name_id] = overlap
+        return result
+
+    def scores(self, text, limit=LIMIT, min_overlap=MIN_OVERLAP, complete=False):
+        """ [(score, name)] of the best matches for text, best first.
+
+        score is the mean of query coverage and Dice similarity plus the recency bonus. With
+        complete=False the text is treated as a prefix still being typed."""
+        self.lookups += 1
+        norm = normalise(text)
+        if not norm:
+            ranked = ((self.recency(name_id), name) for name_id, name in enumerate(self.names))
+            return heapq.nlargest(limit, ranked, key=lambda r: r[0])
+        if len(norm) < self.n or (not complete and len(norm) == self.n and ' ' not in norm):
+            # too short to be misspelled, every name with a word starting like this matches
+            return [(1. + self.recency(name_id), self.names[name_id])
+                    for name_id in self.by_recency('^' + norm)[:limit]]
+        grams = ngrams(norm, self.n, complete)
+        ranked = []
+        for name_id, overlap in self.candidates(grams, min_overlap).items():
+            coverage = overlap / len(grams)
+            dice = 2. * overlap / (len(grams) + len(self.grams[name_id]))
+            ranked.append(((coverage + dice) / 2 + self.recency(name_id), self.names[name_id]))
+        return heapq.nlargest(limit, ranked, key=lambda r: r[0])
+
+    def search(self, text, limit=LIMIT):
+        """ Names matching the text typed so far, best first."""
+        return [name for _score, name in self.scores(text, limit)]
+
+    def similar(self, name, threshold=MERGE_THRESHOLD, limit=5):
+        """ [(similarity, name)] of other indexed names that are probably the same team.
+
+        Names with different numbers ('Koma Oma 1', 'Koma Oma 2') are different teams."""
+        norm = normalise(name)
+        grams = ngrams(norm, self.n)
+        numbers = NUMBER.findall(norm)
+        result = []
+        for name_id, overlap in self.candidates(grams, threshold).items():
+            other = self.names[name_id]
+            if other == name or NUMBER.findall(normalise(other)) != numbers:
+                continue
+            if normalise(other) == norm:
+                result.append((1., other))
+                continue
+            dice = 2. * overlap / (len(grams) + len(self.grams[name_id]))
+            if dice >= threshold:
+                result.append((dice, other))
+        return heapq.nlargest(limit, result)
+
+    def stats(self):
+        return {'names': len(self.names), 'grams': len(self.postings), 'lookups': self.lookups,
+                'visited': self.visited}
@@ -0,0 +1,344 @@
+import hashlib
+import itertools
+import multiprocessing
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from brackets import create_double_elimination_bracket, ko_size
+from draw import DrawError, seed_ko_bracket
+from ratings import DEFAULT_RATING
+
+ITERATIONS = 100000
+CHUNK_SIZE = 25000
+CACHE_SIZE = 16
+# different valid seedings drawn per set of qualifying groups, the simulations pick one at random
+SEEDINGS = 16
+
+_executor = None
+# guards the executor and the cache, simulate runs on the display window's simulation threads
+_executor_lock = Lock()
+_cache = OrderedDict()
+
+
+def available():
+    return np is not None
+
+
+def fit_score_model(ratings, margins):
+    """ Score model from the match history: Elo ratings decide who wins, the margin of a win is
+    drawn from the distribution of all finished matches.
+
+    ratings: {team: rating}, margins: {winning score: number of matches}"""
+    margins = dict((int(m), int(c)) for m, c in margins.items() if int(m) > 0 and int(c) > 0)
+    if not margins:
+        margins = {1: 1}
+    total = float(sum(margins.values()))
+    values = sorted(margins)
+    return {'ratings': dict(ratings),
+            'margin_values': values,
+            'margin_probs': [margins[m] / total for m in values]}
+
+
+def build_state(groups, ko_stages, model, first_ko_stage):
+    """ Reduce the data of get_tournament_groups/get_tournament_ko_stages to what the simulation needs.
+
+    The state only consists of tuples and plain numbers, so it can be hashed and sent to worker
+    processes cheaply."""
+    state_groups = []
+    names = {}
+    for group in groups:
+        teams = []
+        for team in group['teams']:
+            names[team['id']] = team['name']
+            teams.append((team['id'], int(team['won']), int(team['diff']), int(team['score']),
+                          int(team['conceded'])))
+        remaining = []
+        if group['matches']:
+            for m in group['matches']:
+                if m['status'] != 2:
+                    remaining.append((m['team1_id'], m['team2_id']))
+        else:
+            remaining = list(itertools.combinations([t[0] for t in teams], 2))
+        state_groups.append((tuple(teams), tuple(remaining)))
+
+    entrants = ()
+    known = []
+    mode = 'double' if first_ko_stage is not None and first_ko_stage.startswith('DE') else 'single'
+    first_stage = None
+    for stage in (ko_stages.values() if hasattr(ko_stages, 'values') else ko_stages):
+        if stage['name'] == 'KO_FINAL_3':
+            continue
+        for m in stage['matches']:
+            names[m['team1_id']] = m['team1']
+            names[m['team2_id']] = m['team2']
+            if mode == 'double':
+                key = (m['bracket'], m['round'])
+            else:
+                key = ko_size(stage['name'])
+            if first_stage is None:
+                first_stage = key
+            if key == first_stage and (mode == 'single' or key == ('U', 1)):
+                entrants += (m['team1_id'], m['team2_id'])
+            if m['status'] == 2:
+                winner = m['team1_id'] if int(m['team1_score']) > int(m['team2_score']) else m['team2_id']
+                known.append((key, m['team1_id'], m['team2_id'], winner))
+
+    team_ids = sorted(names)
+    ratings = model['ratings']
+    return {
+        'teams': tuple(team_ids),
+        'names': tuple(names[t] for t in team_ids),
+        'ratings': tuple(float(ratings.get(t, DEFAULT_RATING)) for t in team_ids),
+        'margin_values': tuple(model['margin_values']),
+        'margin_probs': tuple(model['margin_probs']),
+        'groups': tuple(state_groups),
+        'ko_mode': mode,
+        'ko_size': ko_size(first_ko_stage),
+        'entrants': entrants,
+        'known': tuple(known)
+    }
+
+
+def state_hash(state, iterations):
+    return hashlib.sha1(repr((sorted(state.items()), iterations)).encode('utf-8')).hexdigest()
+
+
+def round_names(state):
+    if state['ko_size'] == 0:
+        return []
+    if state['ko_mode'] == 'double':
+        return ['Grand Final', 'Title']
+    names = []
+    left = state['ko_size'] // 2
+    while left > 1:
+        names.append('Final' if left == 2 else 'Last %r' % left)
+        left //= 2
+    return names + ['Title']
+
+
+def simulate(state, iterations=ITERATIONS, workers=None):
+    """ Play the rest of the tournament iterations times.
+
+    Returns {team_id: {'name', 'qualify', 'rounds': [probability per entry of round_names]}},
+    the last round being the title. Results are cached per state, so refreshing an unchanged
+    tournament costs nothing."""
+    global _executor
+    key = state_hash(state, iterations)
+    with _executor_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    chunks = [CHUNK_SIZE] * (iterations // CHUNK_SIZE)
+    if iterations % CHUNK_SIZE:
+        chunks.append(iterations % CHUNK_SIZE)
+    seed = int(key[:8], 16)
+    if len(chunks) > 1:
+        with _executor_lock:
+            if _executor is None:
+                # the GUI process runs threads (remote sync, stall watchdog), forking it could copy a held lock
+                _executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                                mp_context=multiprocessing.get_context('spawn'))
+            executor = _executor
+        futures = [executor.submit(simulate_chunk, state, size, seed + i) for i, size in enumerate(chunks)]
+        counts = [f.result() for f in futures]
+    else:
+        counts = [simulate_chunk(state, size, seed) for size in chunks]
+    qualified = sum(c[0] for c in counts)
+    reached = sum(c[1] for c in counts)
+
+    result = OrderedDict()
+    for i, team in enumerate(state['teams']):
+        result[team] = {'name': state['names'][i],
+                        'qualify': qualified[i] / float(iterations),
+                        'rounds': [r[i] / float(iterations) for r in reached]}
+    with _executor_lock:
+        _cache[key] = result
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def shutdown():
+    """ Stop the worker processes, called when the application quits."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+
+def simulate_chunk(state, n, seed):
+    """ Worker: simulate n tournaments at once, every array has one row per simulation.
+
+    Returns (times qualified per team, times reaching each KO round per team)."""
+    rng = np.random.default_rng(seed)
+    index = dict((t, i) for i, t in enumerate(state['teams']))
+    ratings = np.array(state['ratings'])
+    team_count = len(ratings)
+    margins = (np.array(state['margin_values']), np.array(state['margin_probs']))
+    known = [(k, index[a], index[b], index[w]) for k, a, b, w in state['known']]
+
+    if state['entrants']:
+        entrants = np.tile(np.array([index[t] for t in state['entrants']]), (n, 1))
+    elif state['ko_size'] > 0:
+        entrants, extra_groups = simulate_groups(state, index, ratings, margins, rng, n)
+        entrants = seed_entrants(entrants, extra_groups, len(state['groups']), rng)
+    else:
+        return np.zeros(team_count), np.zeros((0, team_count))
+    qualified = np.bincount(entrants.ravel(), minlength=team_count)
+
+    if state['ko_mode'] == 'double':
+        reached = simulate_double_elimination(entrants, ratings, known, rng)
+    else:
+        reached = simulate_knockout(entrants, ratings, known, rng)
+    return qualified, np.array([np.bincount(r.ravel(), minlength=team_count) for r in reached])
+
+
+def play(a, b, ratings, known, key, rng):
+    """ True where team a beats team b."""
+    p = 1.0 / (1.0 + 10 ** ((ratings[b] - ratings[a]) / 400.0))
+    win = rng.random(p.shape) < p
+    for k, team1, team2, winner in known:
+        if k == key:
+            win[(a == team1) & (b == team2)] = winner == team1
+            win[(a == team2) & (b == team1)] = winner == team2
+    return win
+
+
+def simulate_groups(state, index, ratings, margins, rng, n):
+    group_count = len(state['groups'])
+    direct = state['ko_size'] // group_count
+    extra = state['ko_size'] - direct * group_count
+    qualified = []
+    candidates = []
+    candidate_keys = []
+    candidate_groups = []
+    for g, (teams, remaining) in enumerate(state['groups']):
+        ids = np.array([index[t[0]] for t in teams])
+        local = dict((t[0], i) for i, t in enumerate(teams))
+        stats = np.array([t[1:] for t in teams], dtype=np.int64)
+        won, diff, score, conceded = [np.tile(stats[:, c], (n, 1)) for c in range(4)]
+        for team1, team2 in remaining:
+            a = local[team1]
+            b = local[team2]
+            win = play(np.full(n, ids[a]), np.full(n, ids[b]), ratings, (), None, rng)
+            margin = rng.choice(margins[0], size=n, p=margins[1])
+            won[:, a] += win
+            won[:, b] += ~win
+            signed = np.where(win, margin, -margin)
+            diff[:, a] += signed
+            diff[:, b] -= signed
+            score[:, a] += np.where(win, margin, 0)
+            score[:, b] += np.where(win, 0, margin)
+            conceded[:, a] += np.where(win, 0, margin)
+            conceded[:, b] += np.where(win, margin, 0)
+        # won DESC, diff DESC, score DESC, conceded ASC packed into one integer,
+        # the direct comparison is replaced by a random tie break
+        key = (won << 45) + (np.clip(diff + 2048, 0, 4095) << 33) + (np.clip(score, 0, 4095) << 21) + \
+              ((4095 - np.clip(conceded, 0, 4095)) << 9)
+        order = np.argsort(-(key + rng.integers(0, 512, size=key.shape)), axis=1)
+        qualified.append(ids[order[:, :direct]])
+        if extra and len(teams) > direct:
+            candidates.append(ids[order[:, direct]])
+            candidate_groups.append(g)
+            candidate_keys.append(np.take_along_axis(key, order[:, direct:direct + 1], axis=1)[:, 0])
+    if extra:
+        candidates = np.stack(candidates, axis=1)
+        candidate_keys = np.stack(candidate_keys, axis=1) + rng.integers(0, 512, size=candidates.shape)
+        best = np.argsort(-candidate_keys, axis=1)[:, :extra]
+        qualified.append(np.take_along_axis(candidates, best, axis=1))
+        extra_groups = np.array(candidate_groups)[best]
+    else:
+        extra_groups = np.zeros((n, 0), dtype=np.int64)
+    return np.concatenate(qualified, axis=1), extra_groups
+
+
+@lru_cache(maxsize=1024)
+def seeded_orders(group_count, direct, extra_groups):
+    """ Orders of the qualifier columns of simulate_groups as create_ko_stages seeds them, SEEDINGS
+    of them: the places of every group are the pots, the best next-placed teams the last one, and
+    teams of the same group are kept apart. None where seed_ko_bracket finds no seeding, the
+    real draw is random then."""
+    pots = [[] for i in range(direct + (1 if extra_groups else 0))]
+    separate = {}
+    for g in range(group_count):
+        for q in range(direct):
+            separate[len(separate)] = g
+            pots[q].append(len(separate) - 1)
+    for g in extra_groups:
+        separate[len(separate)] = g
+        pots[direct].append(len(separate) - 1)
+    orders = []
+    for seed in range(SEEDINGS):
+        try:
+            orders.append(tuple(seed_ko_bracket(pots, separate=separate, seed=seed)))
+        except DrawError:
+            orders.append(None)
+    return orders
+
+
+def seed_entrants(entrants, extra_groups, group_count, rng):
+    """ The qualifiers of every simulation in the order of the first KO round."""
+    n, size = entrants.shape
+    extra = extra_groups.shape[1]
+    direct = (size - extra) // group_count
+    if extra:
+        # the seeding only depends on which groups the extra teams come from, not on their order
+        order = np.argsort(extra_groups, axis=1)
+        extra_groups = np.take_along_axis(extra_groups, order, axis=1)
+        entrants = np.concatenate((entrants[:, :size - extra],
+                                   np.take_along_axis(entrants[:, size - extra:], order, axis=1)), axis=1)
+    combinations, inverse = np.unique(extra_groups, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    choice = rng.integers(0, SEEDINGS, size=n)
+    seeded = np.empty_like(entrants)
+    for c, combination in enumerate(combinations):
+        rows = inverse == c
+        orders = seeded_orders(group_count, direct, tuple(int(g) for g in combination))
+        orders = np.array([o if o is not None else rng.permutation(size) for o in orders])
+        seeded[rows] = np.take_along_axis(entrants[rows], orders[choice[rows]], axis=1)
+    return seeded
+
+
+def simulate_knockout(entrants, ratings, known, rng):
+    """ Winners of neighbouring matches meet in the next round, like generate_matches pairs them."""
+    reached = []
+    while entrants.shape[1] > 1:
+        a = entrants[:, 0::2]
+        b = entrants[:, 1::2]
+        win = play(a, b, ratings, known, entrants.shape[1], rng)
+        entrants = np.where(win, a, b)
+        reached.append(entrants)
+    return reached
+
+
+def simulate_double_elimination(entrants, ratings, known, rng):
+    """ Walk the slot graph once, slots are ordered so that both teams of a slot are known when
+    it is reached."""
+    n, team_count = entrants.shape
+    slots = create_double_elimination_bracket(team_count)
+    sides = np.full((len(slots), 2, n), -1, dtype=np.int64)
+    sides[:team_count // 2, 0] = entrants[:, 0::2].T
+    sides[:team_count // 2, 1] = entrants[:, 1::2].T
+    grand_final = None
+    champion = None
+    for slot in slots:
+        a, b = sides[slot['slot']]
+        win = play(a, b, ratings, known, (slot['bracket'], slot['round']), rng)
+        if slot['bracket'] == 'F':
+            grand_final = np.stack((a, b), axis=1)
+            champion = np.where(win, a, b)
+        if slot['winner_to'] is not None:
+            sides[slot['winner_to'][0], slot['winner_to'][1]] = np.where(win, a, b)
+        if slot['loser_to'] is not None:
+            sides[slot['loser_to'][0], slot['loser_to'][1]] = np.where(win, b, a)
+    return [grand_final, champion]
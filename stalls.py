@@ -0,0 +1,136 @@
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+
+from PyQt5.QtCore import Qt, QTimer
+
+STALL_MS = 200
+HEARTBEAT_MS = 50
+HANG_SECONDS = 5
+RECENT_STALLS = 50
+LATENCY_SAMPLES = 2000
+SOURCE = os.path.dirname(os.path.abspath(__file__))
+# the sqlite wrapper and query helpers are below every database call, the stall belongs to the caller
+WRAPPERS = {'storage.py', 'tools.py:execute_query', 'tools.py:execute', 'tools.py:simple_get',
+            'tools.py:simple_get_multiple'}
+
+
+def site(stack):
+    """ 'file.py:function' of the innermost frame in the planner's own code, the line is left out so
+    samples at different lines of one function count together."""
+    for frame in reversed(stack):
+        name = os.path.basename(frame.filename)
+        if os.path.dirname(os.path.abspath(frame.filename)) == SOURCE and name not in WRAPPERS \
+                and '%s:%s' % (name, frame.name) not in WRAPPERS:
+            return '%s:%s' % (name, frame.name)
+    if stack:
+        return '%s:%s' % (os.path.basename(stack[-1].filename), stack[-1].name)
+    return '(no python frame)'
+
+
+def percentile(values, p):
+    if not values:
+        return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+class StallWatchdog:
+    """ Reports when the Qt event loop stops turning.
+
+    A heartbeat timer on the main thread stamps the time every interval ms, its lateness is the
+    event loop latency. A monitor thread checks the stamp, once it is older than threshold ms
+    the main thread's Python stack is taken with sys._current_frames() and sampled again on every
+    check until the next heartbeat ends the stall. Stalls are counted per site, the innermost
+    frame of the planner's code, a stall longer than HANG_SECONDS prints its stack at once."""
+
+    def __init__(self, threshold=None, interval=HEARTBEAT_MS):
+        if threshold is None:
+            threshold = float(os.environ.get('TOURNAMENT_STALL_MS', STALL_MS))
+        self.threshold = threshold
+        self.interval = interval
+        self.timer = QTimer()
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.heartbeat)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.main_thread = None
+        self.beat = None
+        self.stall = None
+        self.stalls = deque(maxlen=RECENT_STALLS)
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.sites = {}
+        self.count = 0
+        self.stalled_ms = 0.
+        self.max_ms = 0.
+
+    def start(self):
+        """ Start watching the event loop of the calling thread."""
+        self.main_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self.stopped.clear()
+        self.timer.start()
+        self.thread = threading.Thread(target=self.monitor, name='stall watchdog', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.timer.stop()
+
+    def heartbeat(self):
+        now = time.monotonic()
+        with self.lock:
+            late = (now - self.beat) * 1000 - self.interval
+            self.beat = now
+            stall, self.stall = self.stall, None
+        self.latencies.append(max(0., late))
+        if stall is not None:
+            self.finish(stall, late + self.interval)
+
+    def monitor(self):
+        while not self.stopped.wait(self.threshold / 4000.):
+            with self.lock:
+                blocked = (time.monotonic() - self.beat) * 1000
+                if blocked < self.threshold:
+                    continue
+                frame = sys._current_frames().get(self.main_thread)
+                stack = traceback.extract_stack(frame) if frame is not None else []
+                del frame
+                where = site(stack)
+                if self.stall is None:
+                    self.stall = {'started': time.time() - blocked / 1000, 'site': where,
+                                  'stack': ''.join(traceback.format_list(stack)), 'samples': Counter(),
+                                  'reported': False}
+                stall = self.stall
+                stall['samples'][where] += 1
+            if blocked > HANG_SECONDS * 1000 and not stall['reported']:
+                stall['reported'] = True
+                print('event loop blocked for %.1f s in %s\n%s' % (blocked / 1000, where, stall['stack']))
+
+    def finish(self, stall, ms):
+        stall['ms'] = ms
+        # where the stall was seen most, the first sample breaks ties
+        stall['site'] = max(stall['samples'], key=lambda s: (stall['samples'][s], s == stall['site']))
+        self.stalls.append(stall)
+        self.count += 1
+        self.stalled_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        entry = self.sites.setdefault(stall['site'], {'site': stall['site'], 'count': 0, 'ms': 0., 'max_ms': 0.})
+        entry['count'] += 1
+        entry['ms'] += ms
+        entry['max_ms'] = max(entry['max_ms'], ms)
+        print('event loop stalled for %.0f ms in %s' % (ms, stall['site']))
+
+    def stats(self):
+        latencies = list(self.latencies)
+        return {'threshold_ms': self.threshold, 'stalls': self.count, 'stalled_ms': self.stalled_ms,
+                'max_ms': self.max_ms,
+                'latency_ms': {'p50': percentile(latencies, 0.5), 'p95': percentile(latencies, 0.95),
+                               'max': max(latencies) if latencies else 0.},
+                'sites': sorted(self.sites.values(), key=lambda s: -s['ms']),
+                'recent': list(self.stalls)}
@@ -0,0 +1,268 @@
+import os
+import re
+import sqlite3
+import tempfile
+import weakref
+from collections import deque
+from operator import itemgetter
+
+MEMORY = ':memory:'
+PLACEHOLDER = re.compile(r"'[^']*'|:(\w+)")
+
+
+class Error:
+    def __init__(self, text=''):
+        self._text = text
+
+    def text(self):
+        return self._text
+
+
+class Record:
+    def __init__(self, query):
+        self.query = query
+
+    def value(self, key):
+        return self.query.value(key)
+
+
+class Database:
+    """ An sqlite3 database with the calls DataBaseManager makes, instead of a QSqlDatabase.
+
+    Every DataBaseManager method opens the database and closes it when done, nested calls share
+    the connection, which is closed when the outermost call closes it. An in-memory database
+    would be gone with its connection, so it stays open."""
+
+    def __init__(self, name=''):
+        self.name = name
+        self.connection = None
+        self.depth = 0
+        self.path = None
+
+    @classmethod
+    def temporary_copy(cls, source):
+        """ A database on a temporary copy of the file source, the file is deleted with the database."""
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        db = cls(path)
+        db.path = path
+        weakref.finalize(db, os.remove, path)
+        Database(source).backup(db)
+        return db
+
+    def setDatabaseName(self, name):
+        self.name = name
+
+    def databaseName(self):
+        return self.name
+
+    def open(self):
+        if self.connection is None:
+            # isolation_level None: no implicit transactions, transaction() starts one like Qt
+            self.connection = sqlite3.connect(self.name, isolation_level=None, check_same_thread=False)
+        self.depth += 1
+        return True
+
+    def close(self):
+        self.depth = max(0, self.depth - 1)
+        if self.depth == 0 and self.connection is not None:
+            if self.connection.in_transaction:
+                self.connection.rollback()
+            if self.name != MEMORY:
+                self.connection.close()
+                self.connection = None
+
+    def isOpen(self):
+        return self.connection is not None
+
+    def transaction(self):
+        if self.connection.in_transaction:
+            return False
+        self.connection.execute('BEGIN')
+        return True
+
+    def commit(self):
+        if not self.connection.in_transaction:
+            return False
+        self.connection.commit()
+        return True
+
+    def rollback(self):
+        if not self.connection.in_transaction:
+            return False
+        self.connection.rollback()
+        return True
+
+    def backup(self, target):
+        """ Copy the whole database into target with the sqlite backup API, pages at a time in C."""
+        self.open()
+        target.open()
+        try:
+            self.connection.backup(target.connection)
+        finally:
+            target.close()
+            self.close()
+
+    def tables(self):
+        return [row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+
+    def columns(self, table):
+        return [row[1] for row in self.connection.execute('PRAGMA table_info(%s)' % table)]
+
+
+class Query:
+    """ The part of QSqlQuery DataBaseManager uses, on a Database.
+
+    Placeholders are named (':name'), unbound ones are NULL and prepare() clears the bound values.
+    NULL is read as '' and an unknown column as None, as QSqlQuery does."""
+
+    def __init__(self, db):
+        self.db = db
+        self.sql = ''
+        self.names = []
+        self.bound = {}
+        self.cursor = None
+        self.buffered = None
+        self.columns = {}
+        self.row = None
+        self.error = Error()
+
+    def prepare(self, sql):
+        self.sql = sql
+        self.names = [name for name in PLACEHOLDER.findall(sql) if name]
+        self.bound = {}
+        return True
+
+    def bindValue(self, placeholder, value):
+        self.bound[placeholder] = value
+
+    def boundValue(self, placeholder):
+        return self.bound.get(placeholder)
+
+    def boundValues(self):
+        return dict(self.bound)
+
+    def executedQuery(self):
+        return self.sql
+
+    def lastError(self):
+        return self.error
+
+    def setForwardOnly(self, forward_only):
+        pass
+
+    def parameters(self):
+        return dict((name, self.bound.get(':' + name)) for name in self.names)
+
+    def run(self, execute):
+        self.row = None
+        self.buffered = None
+        try:
+            self.cursor = execute(self.db.connection)
+        except sqlite3.Error as ex:
+            self.cursor = None
+            self.columns = {}
+            self.error = Error(str(ex))
+            return False
+        self.error = Error()
+        self.columns = {}
+        for i, column in enumerate(self.cursor.description or ()):
+            self.columns.setdefault(column[0], i)
+        return True
+
+    def exec_(self, sql=None):
+        if sql is not None:
+            self.prepare(sql)
+        return self.run(lambda connection: connection.execute(self.sql, self.parameters()))
+
+    def execBatch(self, mode=None):
+        """ Run the query once per row of the bound lists."""
+        columns = [self.bound.get(':' + name) for name in self.names]
+        rows = [dict(zip(self.names, values)) for values in zip(*columns)]
+        return self.run(lambda connection: connection.executemany(self.sql, rows))
+
+    def buffer(self):
+        """ Fetch all rows now instead of row by row, returns their number (the changed rows of a
+        write), so the time spent reading them can be measured together with the statement."""
+        if self.cursor is None:
+            return 0
+        if self.cursor.description is None:
+            return max(0, self.cursor.rowcount)
+        self.buffered = deque(self.cursor.fetchall())
+        return len(self.buffered)
+
+    def explain(self):
+        """ The EXPLAIN QUERY PLAN lines of the prepared statement with the bound values, indented by
+        their depth in the plan."""
+        parameters = self.parameters()
+        if any(isinstance(value, list) for value in parameters.values()):  # execBatch, explain the first row
+            parameters = dict((name, value[0] if isinstance(value, list) and value else value)
+                              for name, value in parameters.items())
+        try:
+            rows = self.db.connection.execute('EXPLAIN QUERY PLAN ' + self.sql, parameters).fetchall()
+        except sqlite3.Error as ex:
+            return ['(%s)' % ex]
+        depth = {0: -1}
+        lines = []
+        for node, parent, _unused, detail in rows:
+            depth[node] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[node] + detail)
+        return lines
+
+    def rows(self):
+        """ The remaining rows as tuples, next() is done afterwards."""
+        self.row = None
+        if self.buffered is not None:
+            rows = list(self.buffered)
+            self.buffered.clear()
+            return rows
+        if self.cursor is None:
+            return []
+        return self.cursor.fetchall()
+
+    def reader(self, keys):
+        """ A function from a row of rows() to the tuple of the values of keys, with the column
+        indexes looked up once. NULL is read as '' and an unknown column as None, as by value()."""
+        indexes = [self.columns.get(key) for key in keys]
+        if None in indexes:
+            def read(row):
+                return tuple(None if i is None else '' if row[i] is None else row[i] for i in indexes)
+            return read
+        if len(indexes) < 2:
+            get = (lambda row: (row[indexes[0]],)) if indexes else (lambda row: ())
+        else:
+            get = itemgetter(*indexes)
+
+        def read(row):
+            values = get(row)
+            if None in values:
+                return tuple('' if value is None else value for value in values)
+            return values
+        return read
+
+    def next(self):
+        if self.buffered is not None:
+            self.row = self.buffered.popleft() if self.buffered else None
+            return self.row is not None
+        if self.cursor is None:
+            return False
+        self.row = self.cursor.fetchone()
+        return self.row is not None
+
+    def value(self, key):
+        if self.row is None:
+            return None
+        index = key if isinstance(key, int) else self.columns.get(key)
+        if index is None or index >= len(self.row):
+            return None
+        value = self.row[index]
+        return '' if value is None else value
+
+    def isNull(self, key):
+        if self.row is None:
+            return True
+        index = key if isinstance(key, int) else self.columns.get(key)
+        return index is None or self.row[index] is None
+
+    def record(self):
+        return Record(self)
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from functools import lru_cache
+
+from PyQt5.QtGui import QColor
+
+
+def parse_declarations(block):
+    styles = OrderedDict()
+    for pair in block.split(';'):
+        try:
+            _key, _val = pair.split(':')
+            styles[_key.strip()] = _val.strip()
+        except ValueError:  # invalid pair
+            pass
+    return styles
+
+
+@lru_cache(maxsize=128)
+def parse_stylesheet(sheet):
+    """ {selector: {property: value}} of a stylesheet, a sheet without selectors applies to '*'.
+
+    Parsed once per stylesheet text, the result is shared and must not be modified."""
+    selectors = OrderedDict()
+    if not sheet:
+        return selectors
+    if '{' not in sheet:
+        selectors['*'] = parse_declarations(sheet)
+        return selectors
+    for sel in sheet.split('}'):
+        if '{' in sel:
+            _key, _val = sel.split('{')
+            selectors[_key.strip()] = parse_declarations(_val.strip())
+    return selectors
+
+
+@lru_cache(maxsize=256)
+def parse_color(css_color):
+    """ (r, g, b, a) of a css colour."""
+    if css_color.startswith('rgb('):
+        r, g, b = [int(t.strip()) for t in css_color[4:].replace(')', '').split(',')]
+        return r, g, b, 255
+    elif css_color.startswith('rgba('):
+        r, g, b, a = [int(t.strip()) for t in css_color[5:].replace(')', '').split(',')]
+        return r, g, b, a
+    return QColor(css_color).getRgb()
+
+
+def css_color(css_color):
+    return QColor(*parse_color(css_color))
+
+
+class Theme:
+    """ A tournament stylesheet, parsed once."""
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.selectors = parse_stylesheet(sheet)
+
+
+@lru_cache(maxsize=32)
+def compile_theme(sheet):
+    return Theme(sheet)
@@ -1,5 +1,7 @@
 import math
 import pickle
+import sys
+import time
 from collections import OrderedDict
 from enum import Enum
 from random import shuffle
@@ -7,13 +9,29 @@ from threading import Thread, Lock
 from urllib.error import URLError
 from urllib.request import urlopen
 
-from PyQt5.QtCore import QVariant, pyqtSignal, QObject
-from PyQt5.QtSql import QSqlQuery, QSqlDatabase
+from brackets import create_double_elimination_bracket
+from draw import DrawError, seed_ko_bracket
+from querylog import query_log
+from ratings import DEFAULT_RATING, compute_ratings
+from storage import MEMORY, Database, Query
+from tracing import tracer, traced
 try:
     from remote_connection import RemoteConnectionManager
 except ImportError:
     pass
 
+DATABASE_FILE = 'flunkyrock.db'
+# the matches the ratings are computed from, matches of deleted stages are left behind without cascades
+RATED_MATCHES = 'status == 2 AND tournament_stage IN (SELECT id FROM Tournament_Stages)'
+# the columns of a row of a group or the all time table
+STANDING_KEYS = ['id', 'name', 'games', 'won', 'lost', 'diff', 'score', 'conceded']
+DEFAULT_STYLESHEET = '*{background-color: rgb(161,58,139); color: rgb(255,255,255)} ' \
+                     '*[highlighted]{color: rgb(40,154,183)}' \
+                     '*[bg_img]{background-image: url(bg_imgs/2018.png)}' \
+                     'QLabel, QLineEdit, ' \
+                     'QRadioButton{background-color: rgba(255, 255, 255, 0)} ' \
+                     '*[transp_bg="true"]{background-color: rgba(255, 255, 255, 0)}'
+
 
 class TournamentStageStatus(Enum):
     INITIALIZED = 1  # Stage 0: NOT YET ENOUGH TEAMS    , Stage 1+: MATCHES GENERATED
@@ -21,6 +39,11 @@ class TournamentStageStatus(Enum):
     COMPLETE = 3      # Stage 0: DRAW COMPLETE           , Stage 1+: STAGE COMPLETE
 
 
+class BracketError(Exception):
+    """ A result that would move teams out of bracket matches that are already played."""
+    pass
+
+
 class DBException(Exception):
     def __init__(self, query):
         super().__init__(query.lastError().text())
@@ -70,14 +93,33 @@ def create_balanced_round_robin(list):
     return s
 
 
-class RemoteQueue(QObject):
-    sync_status = pyqtSignal(dict)
+class Callbacks(list):
+    """ Functions called with the arguments of emit(), in the thread calling it. A Qt front end
+    forwards them to a signal to get back into the GUI thread."""
+
+    def connect(self, callback):
+        self.append(callback)
+
+    def disconnect(self, callback=None):
+        if callback is None:
+            self.clear()
+        else:
+            self.remove(callback)
+
+    def emit(self, *args):
+        for callback in list(self):
+            callback(*args)
 
-    def __init__(self):
-        super().__init__()
+
+class RemoteQueue:
+    """ Updates for the remote database. Without file_name the queue is neither stored nor synced,
+    for databases the remote must never see."""
+
+    def __init__(self, file_name='remote_queue'):
+        self.sync_status = Callbacks()
         self.queue = []
-        self.file_name = 'remote_queue'
-        remote_sync = True
+        self.file_name = file_name
+        remote_sync = file_name is not None
         self.mutex = Lock()
         self.thread = None
         try:
@@ -91,11 +133,17 @@ class RemoteQueue(QObject):
         except FileNotFoundError:
             pass
 
+    @traced()
     def save(self):
+        if self.file_name is None:
+            return
         with open(self.file_name, 'wb') as output:
             pickle.dump(self.queue, output)
 
+    @traced()
     def load(self):
+        if self.file_name is None:
+            return
         with open(self.file_name, 'rb') as input:
             self.queue = pickle.load(input)
 
@@ -123,6 +171,7 @@ class RemoteQueue(QObject):
         self.thread = Thread(target=self.execute)
         self.thread.start()
 
+    @traced()
     def execute(self):
         success = True
         if self.ONLINE_MODE and self.internet_on():
@@ -147,18 +196,38 @@ class RemoteQueue(QObject):
         self.mutex.release()
 
 
-class DataBaseManager(QObject):
+class DataBaseManager:
+    """ The tournament database. name is a file, MEMORY or (with db) ignored, sync=False keeps the
+    changes away from the remote, as the in_memory, temporary_copy and clone databases do."""
 
-    def __init__(self):
-        super().__init__()
-        self.db = QSqlDatabase.addDatabase('QSQLITE')
-        self.db.setDatabaseName('flunkyrock.db')
-        self.remote_queue = RemoteQueue()
+    def __init__(self, name=DATABASE_FILE, sync=True, db=None):
+        self.db = db if db is not None else Database(name)
+        self.remote_queue = RemoteQueue() if sync else RemoteQueue(file_name=None)
         self.init()
 
+    @classmethod
+    def in_memory(cls):
+        return cls(MEMORY, sync=False)
+
+    @classmethod
+    def temporary_copy(cls, source=DATABASE_FILE):
+        """ A copy of source in a temporary file, deleted with the database."""
+        return cls(sync=False, db=Database.temporary_copy(source))
+
+    @traced()
+    def clone(self):
+        """ An in-memory snapshot of this database, e.g. to play through what-if scenarios."""
+        db = Database(MEMORY)
+        self.db.open()
+        try:
+            self.db.backup(db)
+        finally:
+            self.db.close()
+        return DataBaseManager(sync=False, db=db)
+
     def init(self):
         self.db.open()
-        query = QSqlQuery()
+        query = Query(self.db)
         try:
             if 'Teams' not in self.db.tables():
                 query.exec_('CREATE TABLE Teams ('
@@ -236,18 +305,74 @@ class DataBaseManager(QObject):
                             'FOREIGN KEY(field) REFERENCES Tournament_Fields(id),'
                             'FOREIGN KEY(tournament_stage) REFERENCES Tournament_Stages(id) ON DELETE CASCADE'
                             ')')
+
+            if 'Bracket_Slots' not in self.db.tables():
+                query.exec_('CREATE TABLE Bracket_Slots ('
+                            'tournament_stage INTEGER,'
+                            'slot INTEGER,'
+                            'bracket VARCHAR(1),'
+                            'round INTEGER,'
+                            'position INTEGER,'
+                            'winner_slot INTEGER,'
+                            'winner_side INTEGER,'
+                            'loser_slot INTEGER,'
+                            'loser_side INTEGER,'
+                            'team1 INTEGER,'
+                            'team2 INTEGER,'
+                            'match INTEGER,'
+                            'FOREIGN KEY(tournament_stage) REFERENCES Tournament_Stages(id) ON DELETE CASCADE,'
+                            'FOREIGN KEY(team1) REFERENCES Teams(id),'
+                            'FOREIGN KEY(team2) REFERENCES Teams(id),'
+                            'FOREIGN KEY(match) REFERENCES Matches(id)'
+                            ')')
+                query.exec_('CREATE UNIQUE INDEX Bracket_Slots_Slot ON Bracket_Slots(tournament_stage, slot)')
+                query.exec_('CREATE INDEX Bracket_Slots_Match ON Bracket_Slots(match)')
+
+            # ratings are derived from Matches and therefore never synced with the remote
+            if 'Team_Ratings' not in self.db.tables():
+                query.exec_('CREATE TABLE Team_Ratings ('
+                            'team INTEGER PRIMARY KEY,'
+                            'rating REAL NOT NULL,'
+                            'games INTEGER NOT NULL DEFAULT 0,'
+                            'FOREIGN KEY (team) REFERENCES Teams(id)'
+                            ')')
+
+                query.exec_('CREATE TABLE Rated_Matches ('
+                            'match INTEGER PRIMARY KEY,'
+                            'team1 INTEGER,'
+                            'team2 INTEGER,'
+                            'delta REAL NOT NULL,'
+                            'FOREIGN KEY (match) REFERENCES Matches(id) ON DELETE CASCADE'
+                            ')')
+            # databases from before the ratings have finished matches that were never rated
+            query.exec_('SELECT COUNT() FROM Matches WHERE %s AND id NOT IN (SELECT match FROM Rated_Matches)'
+                        % RATED_MATCHES)
+            unrated = query.value(0) if query.next() else 0
         finally:
             self.db.close()
+        if unrated:
+            self.rebuild_ratings()
 
     @staticmethod
     def execute_query(query, batch=False):
         def execute():
             if batch:
-                return query.execBatch(mode=QSqlQuery.ValuesAsRows)
+                return query.execBatch()
             else:
                 return query.exec_()
 
-        if not execute():
+        if not (query_log.enabled or tracer.enabled):
+            success = execute()
+        else:
+            start = time.perf_counter()
+            success = execute()
+            # sqlite reads the rows as they are fetched, fetch them here to time them with the statement
+            rows = query.buffer() if success else 0
+            end = time.perf_counter()
+            if query_log.enabled:
+                query_log.record(query, sys._getframe(1).f_code.co_name, end - start, rows)
+            tracer.add('sql', 'sqlite', start, end, {'sql': query.executedQuery(), 'rows': rows})
+        if not success:
             if query.lastError().text().startswith('UNIQUE constraint failed'):
                 raise InsertNotUniqueException(query)
             else:
@@ -259,18 +384,15 @@ class DataBaseManager(QObject):
         return query.value(key)
 
     @staticmethod
-    def simple_get_multiple(query, keys):
-        result = []
-        while query.next():
-            row = {}
-            for key in keys:
-                row[key] = query.value(key)
-            result.append(row)
-        return result
+    def simple_get_multiple(query, keys, columns=None):
+        """ A dict of keys per remaining row, columns maps keys read from a column of another name.
+        The column indexes are looked up once per query."""
+        read = query.reader([columns.get(key, key) for key in keys] if columns else keys)
+        return [dict(zip(keys, read(row))) for row in query.rows()]
 
     def get_current_id(self, table):
         assert self.db.isOpen()
-        query = QSqlQuery()
+        query = Query(self.db)
         query.prepare('SELECT * FROM SQLITE_SEQUENCE WHERE name=:table')
         query.bindValue(':table', table)
         self.execute_query(query)
@@ -301,7 +423,7 @@ class DataBaseManager(QObject):
     # used for import-script
     def add_team(self, team_name):
         self.db.open()
-        query = QSqlQuery()
+        query = Query(self.db)
         try:
             query.prepare('INSERT INTO Teams(name) VALUES (:team_name)')
             query.bindValue(':team_name', team_name)
@@ -311,6 +433,7 @@ class DataBaseManager(QObject):
         finally:
             self.db.close()
 
+    @traced()
     def update_tournament_groups(self, tournament_id, groups):
         g_ids = []
         t_ids = []
@@ -323,7 +446,7 @@ class DataBaseManager(QObject):
 
         local_update_queue = []
         try:
-            query = QSqlQuery()
+            query = Query(self.db)
 
             # get all entries to be deleted in Group_Teams
             query.prepare('SELECT Groups.id FROM Groups JOIN '
@@ -335,7 +458,7 @@ class DataBaseManager(QObject):
 
             # delete all entries in Group_Teams
             query.prepare('DELETE FROM Group_Teams WHERE group_id = (:id)')
-            query.bindValue(':id', [QVariant(_id) for _id in del_ids])
+            query.bindValue(':id', del_ids)
             self.execute_query(query, batch=True)
 
             for _id in del_ids:
@@ -344,8 +467,8 @@ class DataBaseManager(QObject):
 
             # add new Group_Teams
             query.prepare('INSERT INTO Group_Teams(group_id, team) VALUES (:group_id, :team_id)')
-            query.bindValue(':group_id', [QVariant(g) for g in g_ids])
-            query.bindValue(':team_id', [QVariant(t) for t in t_ids])
+            query.bindValue(':group_id', g_ids)
+            query.bindValue(':team_id', t_ids)
             self.execute_query(query, batch=True)
 
             local_update_queue.append(
@@ -374,10 +497,15 @@ class DataBaseManager(QObject):
         finally:
             self.db.close()
 
+    @traced()
     def update_match(self, match):
         self.db.open()
+        self.db.transaction()
+        local_update_queue = []
         try:
-            query = QSqlQuery()
+            query = Query(self.db)
+            # before the update, the bracket compares the old result with the new one
+            self.advance_bracket(query, match, local_update_queue)
             query.prepare('UPDATE Matches SET team1_score = :t1_s, team2_score = :t2_s, status= :status '
                           'WHERE id == :m_id')
             query.bindValue(':t1_s', match['team1_score'])
@@ -385,7 +513,7 @@ class DataBaseManager(QObject):
             query.bindValue(':status', match['status'])
             query.bindValue(':m_id', match['id'])
             self.execute_query(query)
-            self.remote_queue.append(
+            local_update_queue.append(
                 self.create_remote_update('update', 'Matches', ['team1_score', 'team2_score', 'status'],
                                           [
                                               [match['team1_score']],
@@ -393,17 +521,462 @@ class DataBaseManager(QObject):
                                               [match['status']]
                                           ], where={'id': [match['id']]}
                                           ))
+            self.update_ratings(query, match)
+            self.db.commit()
+            self.remote_queue.extend(local_update_queue)
+        except DBException as ex:
+            print('db_error:', ex)
+            self.db.rollback()
+        except BracketError:
+            self.db.rollback()
+            raise
+        finally:
+            self.db.close()
+
+    def update_ratings(self, query, match):
+        self.replay_ratings(query, match['id'])
+
+    def replay_ratings(self, query, first_id):
+        # Elo is sequential: every match rated after first_id was rated from the ratings the earlier ones
+        # left, so the rated matches from first_id on are reverted and the finished ones replayed in id
+        # order, as rebuild_ratings does. Entering the result of the latest match only touches that match.
+        query.prepare('SELECT match, team1, team2, delta FROM Rated_Matches WHERE match >= :m_id')
+        query.bindValue(':m_id', first_id)
+        self.execute_query(query)
+        reverted = []
+        while query.next():
+            reverted.append((query.value(0), query.value(1), query.value(2), query.value(3)))
+        query.prepare('SELECT id, team1, team2, team1_score, team2_score FROM Matches '
+                      'WHERE %s AND id >= :m_id ORDER BY id' % RATED_MATCHES)
+        query.bindValue(':m_id', first_id)
+        self.execute_query(query)
+        replayed = []
+        while query.next():
+            replayed.append((query.value(0), query.value(1), query.value(2), query.value(3), query.value(4)))
+        if not reverted and not replayed:
+            return
+
+        teams = sorted(set(t for m in reverted + replayed for t in m[1:3]))
+        team_replacement = '(%s)' % ','.join([':t%r' % t for t in teams])
+        query.prepare('SELECT team, rating, games FROM Team_Ratings WHERE team IN %s' % team_replacement)
+        for t in teams:
+            query.bindValue(':t%r' % t, t)
+        self.execute_query(query)
+        ratings = {}
+        while query.next():
+            ratings[query.value(0)] = (query.value(1), query.value(2))
+        for match_id, team1, team2, delta in reverted:
+            for team, change in ((team1, delta), (team2, -delta)):
+                rating, games = ratings[team]
+                ratings[team] = (rating - change, games - 1)
+        ratings, deltas = compute_ratings(replayed, ratings=ratings)
+
+        query.prepare('DELETE FROM Rated_Matches WHERE match >= :m_id')
+        query.bindValue(':m_id', first_id)
+        self.execute_query(query)
+        teams = list(ratings.keys())
+        query.prepare('INSERT OR REPLACE INTO Team_Ratings(team, rating, games) VALUES (:team, :rating, :games)')
+        query.bindValue(':team', teams)
+        query.bindValue(':rating', [ratings[t][0] for t in teams])
+        query.bindValue(':games', [ratings[t][1] for t in teams])
+        self.execute_query(query, batch=True)
+        # as after rebuild_ratings, teams without a rated match have no rating
+        query.exec_('DELETE FROM Team_Ratings WHERE games == 0')
+        if deltas:
+            query.prepare('INSERT INTO Rated_Matches(match, team1, team2, delta) VALUES (:m_id, :t1, :t2, :delta)')
+            for i, key in enumerate([':m_id', ':t1', ':t2', ':delta']):
+                query.bindValue(key, [d[i] for d in deltas])
+            self.execute_query(query, batch=True)
+
+    @traced()
+    def rebuild_ratings(self):
+        self.db.open()
+        self.db.transaction()
+        try:
+            query = Query(self.db)
+            query.setForwardOnly(True)
+            query.prepare('SELECT id, team1, team2, team1_score, team2_score FROM Matches '
+                          'WHERE %s ORDER BY id' % RATED_MATCHES)
+            self.execute_query(query)
+            matches = []
+            while query.next():
+                matches.append((query.value(0), query.value(1), query.value(2), query.value(3), query.value(4)))
+            ratings, deltas = compute_ratings(matches)
+
+            query.exec_('DELETE FROM Rated_Matches')
+            query.exec_('DELETE FROM Team_Ratings')
+            teams = list(ratings.keys())
+            query.prepare('INSERT INTO Team_Ratings(team, rating, games) VALUES (:team, :rating, :games)')
+            query.bindValue(':team', teams)
+            query.bindValue(':rating', [ratings[t][0] for t in teams])
+            query.bindValue(':games', [ratings[t][1] for t in teams])
+            self.execute_query(query, batch=True)
+            query.prepare('INSERT INTO Rated_Matches(match, team1, team2, delta) VALUES (:m_id, :t1, :t2, :delta)')
+            for i, key in enumerate([':m_id', ':t1', ':t2', ':delta']):
+                query.bindValue(key, [d[i] for d in deltas])
+            self.execute_query(query, batch=True)
+            self.db.commit()
+            print('rated %r matches of %r teams' % (len(deltas), len(teams)))
+        except DBException as ex:
+            print('db_error:', ex)
+            self.db.rollback()
+        finally:
+            self.db.close()
+
+    def get_team_ratings(self):
+        self.db.open()
+        query = Query(self.db)
+        try:
+            query.prepare('SELECT team, rating FROM Team_Ratings')
+            self.execute_query(query)
+            ratings = {}
+            while query.next():
+                ratings[query.value('team')] = query.value('rating')
+            return ratings
+        finally:
+            self.db.close()
+
+    def advance_bracket(self, query, match, local_update_queue):
+        """ Move the winner and loser of a double elimination match into their next slots, or out of
+        them again when the result changes or the match is no longer finished. Raises BracketError
+        if a team would have to leave a match that is already in progress or finished."""
+        # only matches of a double elimination stage have a bracket slot
+        query.prepare('SELECT Bracket_Slots.tournament_stage as stage, winner_slot, winner_side, '
+                      'loser_slot, loser_side, Matches.team1 as team1, Matches.team2 as team2, '
+                      'Matches.team1_score as team1_score, Matches.team2_score as team2_score, '
+                      'Matches.status as status '
+                      'FROM Bracket_Slots JOIN Matches ON Bracket_Slots.match = Matches.id '
+                      'WHERE Bracket_Slots.match = :m_id')
+        query.bindValue(':m_id', match['id'])
+        self.execute_query(query)
+        if not query.next():
+            return
+        stage_id = query.value('stage')
+        targets = []
+        for kind in ('winner', 'loser'):
+            if not query.isNull('%s_slot' % kind):
+                targets.append((query.value('%s_slot' % kind), query.value('%s_side' % kind)))
+            else:
+                targets.append(None)
+        teams = (query.value('team1'), query.value('team2'))
+
+        def outcome(score1, score2, status):
+            # (winner, loser) of a finished match, (None, None) otherwise
+            if status != 2:
+                return None, None
+            return teams if int(score1) > int(score2) else (teams[1], teams[0])
+
+        old = outcome(query.value('team1_score'), query.value('team2_score'), query.value('status'))
+        new = outcome(match['team1_score'], match['team2_score'], match['status'])
+        moves = [(target, team) for target, old_team, team in zip(targets, old, new)
+                 if target is not None and team != old_team]
+        for (slot, side), team in moves:
+            if self.get_bracket_slot(query, stage_id, slot)['status'] != 0:
+                raise BracketError('the next match of this result is already played, reset that one first')
+        for (slot, side), team in moves:
+            if team is None:
+                self.clear_bracket_slot(query, stage_id, slot, side, local_update_queue)
+            else:
+                self.fill_bracket_slot(query, stage_id, slot, side, team, local_update_queue)
+
+    def get_bracket_slot(self, query, stage_id, slot):
+        query.prepare('SELECT Bracket_Slots.team1 as team1, Bracket_Slots.team2 as team2, match, '
+                      'COALESCE(Matches.status, 0) as status FROM Bracket_Slots '
+                      'LEFT JOIN Matches ON Bracket_Slots.match = Matches.id '
+                      'WHERE Bracket_Slots.tournament_stage = :ts_id AND slot = :slot')
+        query.bindValue(':ts_id', stage_id)
+        query.bindValue(':slot', slot)
+        self.execute_query(query)
+        assert query.next()
+        return {'teams': [None if query.isNull('team1') else query.value('team1'),
+                          None if query.isNull('team2') else query.value('team2')],
+                'match': None if query.isNull('match') else query.value('match'),
+                'status': query.value('status')}
+
+    def clear_bracket_slot(self, query, stage_id, slot, side, local_update_queue):
+        # the slot's match was not started, it is created again once both teams are known
+        bracket_slot = self.get_bracket_slot(query, stage_id, slot)
+        column = 'team%r' % (side + 1)
+        query.prepare('UPDATE Bracket_Slots SET %s = NULL, match = NULL '
+                      'WHERE tournament_stage = :ts_id AND slot = :slot' % column)
+        query.bindValue(':ts_id', stage_id)
+        query.bindValue(':slot', slot)
+        self.execute_query(query)
+        local_update_queue.append(self.create_remote_update('update', 'Bracket_Slots', [column, 'match'],
+                                                            [[None], [None]],
+                                                            where={'tournament_stage': [stage_id], 'slot': [slot]}))
+        if bracket_slot['match'] is not None:
+            query.prepare('DELETE FROM Matches WHERE id = :m_id')
+            query.bindValue(':m_id', bracket_slot['match'])
+            self.execute_query(query)
+            local_update_queue.append(self.create_remote_update('delete', 'Matches', [], [],
+                                                                where={'id': [bracket_slot['match']]}))
+
+    def fill_bracket_slot(self, query, stage_id, slot, side, team_id, local_update_queue):
+        bracket_slot = self.get_bracket_slot(query, stage_id, slot)
+        if bracket_slot['status'] != 0:
+            raise BracketError('bracket slot %r is already played, not moving team %r' % (slot, team_id))
+        teams = bracket_slot['teams']
+        match_id = bracket_slot['match']
+        teams[side] = team_id
+        column = 'team%r' % (side + 1)
+
+        query.prepare('UPDATE Bracket_Slots SET %s = :team WHERE tournament_stage = :ts_id AND slot = :slot' % column)
+        query.bindValue(':team', team_id)
+        query.bindValue(':ts_id', stage_id)
+        query.bindValue(':slot', slot)
+        self.execute_query(query)
+        local_update_queue.append(self.create_remote_update('update', 'Bracket_Slots', [column], [[team_id]],
+                                                            where={'tournament_stage': [stage_id], 'slot': [slot]}))
+
+        if None in teams:
+            return
+        if match_id is None:
+            query.prepare('INSERT INTO Matches(team1, team2, status, tournament_stage) VALUES (:t1, :t2, 0, :ts_id)')
+            query.bindValue(':t1', teams[0])
+            query.bindValue(':t2', teams[1])
+            query.bindValue(':ts_id', stage_id)
+            self.execute_query(query)
+            match_id = self.get_current_id('Matches')
+            local_update_queue.append(self.create_remote_update('insert', 'Matches',
+                                                                ['id', 'team1', 'team2', 'status', 'tournament_stage'],
+                                                                [[match_id], [teams[0]], [teams[1]], [0], [stage_id]]
+                                                                ))
+            query.prepare('UPDATE Bracket_Slots SET match = :m_id WHERE tournament_stage = :ts_id AND slot = :slot')
+            query.bindValue(':m_id', match_id)
+            query.bindValue(':ts_id', stage_id)
+            query.bindValue(':slot', slot)
+            self.execute_query(query)
+            local_update_queue.append(self.create_remote_update('update', 'Bracket_Slots', ['match'], [[match_id]],
+                                                                where={'tournament_stage': [stage_id],
+                                                                       'slot': [slot]}))
+        else:
+            query.prepare('UPDATE Matches SET %s = :team WHERE id = :m_id' % column)
+            query.bindValue(':team', team_id)
+            query.bindValue(':m_id', match_id)
+            self.execute_query(query)
+            local_update_queue.append(self.create_remote_update('update', 'Matches', [column], [[team_id]],
+                                                                where={'id': [match_id]}))
+
+    def create_bracket_slots(self, query, stage_id, team_count, local_update_queue):
+        slots = create_double_elimination_bracket(team_count)
+        keys = ['tournament_stage', 'slot', 'bracket', 'round', 'position',
+                'winner_slot', 'winner_side', 'loser_slot', 'loser_side']
+        values = [[stage_id for s in slots],
+                  [s['slot'] for s in slots],
+                  [s['bracket'] for s in slots],
+                  [s['round'] for s in slots],
+                  [s['position'] for s in slots],
+                  [s['winner_to'][0] if s['winner_to'] else None for s in slots],
+                  [s['winner_to'][1] if s['winner_to'] else None for s in slots],
+                  [s['loser_to'][0] if s['loser_to'] else None for s in slots],
+                  [s['loser_to'][1] if s['loser_to'] else None for s in slots]]
+        query.prepare('INSERT INTO Bracket_Slots(%s) VALUES (%s)' % (', '.join(keys),
+                                                                      ', '.join([':%s' % k for k in keys])))
+        for key, column in zip(keys, values):
+            query.bindValue(':%s' % key, column)
+        self.execute_query(query, batch=True)
+        local_update_queue.append(self.create_remote_update('insert', 'Bracket_Slots', keys, values))
+
+    def create_ko_stages(self, query, tournament_id, teams_in_ko, local_update_queue, ko_mode='single'):
+        if ko_mode == 'double':
+            stage_names = ['DE%r' % int(teams_in_ko)]
+        else:
+            # create ko-stages including 3rd place final
+            stage_names = []
+            index = 2
+            while teams_in_ko >= 1:
+                if teams_in_ko > 2:
+                    stage_names.append('KO%r' % int(teams_in_ko / 2))
+                elif teams_in_ko == 2:
+                    if index > 2:
+                        stage_names.append('KO_FINAL_3')
+                    else:
+                        stage_names.append('KO_FINAL_1')
+                else:
+                    if index > 3:
+                        stage_names.append('KO_FINAL_1')
+                    else:
+                        break
+                index += 1
+                teams_in_ko /= 2
+
+        index = 2
+        for name in stage_names:
+            query.prepare('INSERT INTO Tournament_Stages(tournament, stage_index, name) VALUES (:t_id, :idx, :name)')
+            query.bindValue(':t_id', tournament_id)
+            query.bindValue(':idx', index)
+            query.bindValue(':name', name)
+            self.execute_query(query)
+            ts_id = self.get_current_id('Tournament_Stages')
+
+            local_update_queue.append(self.create_remote_update('insert', 'Tournament_Stages',
+                                                                ['id', 'tournament', 'stage_index', 'name'],
+                                                                [[ts_id], [tournament_id], [index], [name]]
+                                                                ))
+
+            query.prepare('INSERT INTO KO_Stages(tournament_stage) VALUES (:ts_id)')
+            query.bindValue(':ts_id', ts_id)
+            self.execute_query(query)
+
+            local_update_queue.append(self.create_remote_update('insert', 'KO_Stages',
+                                                                ['tournament_stage'],
+                                                                [[ts_id]]
+                                                                ))
+            if name.startswith('DE'):
+                self.create_bracket_slots(query, ts_id, int(name[2:]), local_update_queue)
+            index += 1
+
+    def get_group_qualifiers(self, tournament_id, group_stage_id, team_count):
+        groups = self.get_tournament_groups(tournament_id)
+        self.db.open()
+        query = Query(self.db)
+        direct_qualification = math.floor(team_count/len(groups))
+        qualified = []
+
+        # remember rank and group of every team, KO seeding uses them as pots and to keep groups apart
+        for group in groups:
+            for q in range(direct_qualification):
+                direct = group['teams'].pop(0)
+                direct['pot'] = q
+                direct['group'] = group['id']
+                qualified.append(direct)
+        if len(qualified) < team_count:
+            # fill the rest of the spots with the next best teams...
+            left_over_teams = []
+            for group in groups:
+                left_over = group['teams'].pop(0)
+                left_over['pot'] = direct_qualification
+                left_over['group'] = group['id']
+                left_over_teams.append(left_over)
+                #for t in group['teams']:
+                #    left_over_teams.append(t['id'])
+            print('drawing best from the %r. ranked of each group: %r' % (direct_qualification+1, left_over_teams))
+            team_replacement = '(%s)' % ', '.join(['%r' % t['id'] for t in left_over_teams])
+            query.prepare(
+                'SELECT id as id, Teams.name as name, COALESCE(Games, 0) as games, '
+                'COALESCE(Won, 0) as won, '
+                'COALESCE(Lost, 0) as lost, COALESCE(Bierferenz, 0) as diff, '
+                'COALESCE(Score, 0) as score, COALESCE(Against, 0) as conceded '
+                'FROM Teams LEFT JOIN (SELECT team, SUM(Win)+SUM(Loss) as Games, SUM(Win) As Won, '
+                'SUM(Loss) as Lost, Sum(score)-Sum(against) as Bierferenz, SUM(score) as Score , '
+                'SUM(against) as Against FROM ( SELECT team1 as team, '
+                'CASE WHEN team1_score > team2_score THEN 1 ELSE 0 END as Win, team2_score as against, '
+                'CASE WHEN team1_score < team2_score THEN 1 ELSE 0 END as Loss, team1_score as score'
+                ' FROM Matches WHERE tournament_stage = :stage_id '
+                'UNION ALL SELECT team2 as team, '
+                'CASE WHEN team2_score > team1_score THEN 1 ELSE 0 END as Win, team1_score as against, '
+                'CASE WHEN team2_score < team1_score THEN 1 ELSE 0 END as Loss, team2_score as score '
+                'FROM Matches WHERE tournament_stage = :stage_id '
+                ') t '
+                'GROUP BY team) as g_table ON Teams.id=g_table.team WHERE Teams.id in '
+                '%s'
+                ' ORDER By won DESC, diff DESC, score DESC, conceded' % team_replacement)
+            query.bindValue(':stage_id', group_stage_id)
+
+            self.execute_query(query)
+            table = self.simple_get_multiple(query, ['id', 'name', 'won', 'diff'])
+            left_over_groups = dict((t['id'], t['group']) for t in left_over_teams)
+            for i in range(team_count-len(qualified)):
+                team = table.pop(0)
+                team['pot'] = direct_qualification
+                team['group'] = left_over_groups[team['id']]
+                qualified.append(team)
+
+        print('qualified:', [t['name'] for t in qualified])
+        return qualified
+
+    @staticmethod
+    def seed_qualifiers(qualified):
+        pots = [[] for i in range(max(t['pot'] for t in qualified) + 1)]
+        teams = {}
+        for team in qualified:
+            pots[team['pot']].append(team['id'])
+            teams[team['id']] = team
+        try:
+            order = seed_ko_bracket(pots, separate=dict((t['id'], t['group']) for t in qualified))
+            return [teams[t] for t in order]
+        except DrawError as ex:
+            print('seeding failed, drawing randomly:', ex)
+            shuffle(qualified)
+            return qualified
+
+    @traced()
+    def get_draw_info(self, tournament_id):
+        self.db.open()
+        query = Query(self.db)
+        try:
+            query.prepare('SELECT Teams.id as id, COALESCE(rating, :default) as rating FROM Tournament_Teams '
+                          'JOIN Teams ON Tournament_Teams.team = Teams.id '
+                          'LEFT JOIN Team_Ratings ON Team_Ratings.team = Teams.id '
+                          'WHERE Tournament_Teams.tournament = :t_id')
+            query.bindValue(':default', DEFAULT_RATING)
+            query.bindValue(':t_id', tournament_id)
+            self.execute_query(query)
+            ratings = {}
+            while query.next():
+                ratings[query.value('id')] = query.value('rating')
+
+            # groups of the previous tournament, teams that met there are kept apart
+            query.prepare('SELECT team, group_id FROM Group_Teams JOIN Groups ON Group_Teams.group_id = Groups.id '
+                          'JOIN Tournament_Stages ON Groups.group_stage = Tournament_Stages.id '
+                          'WHERE Tournament_Stages.tournament = '
+                          '(SELECT MAX(id) FROM Tournaments WHERE id < :t_id)')
+            query.bindValue(':t_id', tournament_id)
+            self.execute_query(query)
+            previous_groups = {}
+            while query.next():
+                if query.value('team') in ratings:
+                    previous_groups[query.value('team')] = query.value('group_id')
+            return {'ratings': ratings, 'previous_groups': previous_groups}
+        finally:
+            self.db.close()
+
+    @traced()
+    def get_first_ko_stage(self, tournament_id):
+        self.db.open()
+        query = Query(self.db)
+        try:
+            query.prepare('SELECT name FROM Tournament_Stages WHERE tournament == :t_id AND stage_index == 2')
+            query.bindValue(':t_id', tournament_id)
+            self.execute_query(query)
+            return query.value('name') if query.next() else None
+        finally:
+            self.db.close()
+
+    @traced()
+    def get_score_model_data(self, tournament_id):
+        first_ko_stage = self.get_first_ko_stage(tournament_id)
+        ratings = self.get_team_ratings()
+        self.db.open()
+        query = Query(self.db)
+        try:
+            # matches are played until one team reaches 0, so the winner's score is the margin
+            query.prepare('SELECT MAX(team1_score, team2_score) as margin, COUNT() as count FROM Matches '
+                          'WHERE status == 2 GROUP BY margin')
+            self.execute_query(query)
+            margins = {}
+            while query.next():
+                margins[query.value('margin')] = query.value('count')
+            return {'ratings': ratings, 'margins': margins, 'first_ko_stage': first_ko_stage}
         finally:
             self.db.close()
 
+    @traced()
     def generate_matches(self, tournament_id, data):
         print('database got generate-request', tournament_id, data)
 
         def delete_stage_matches(stage_id):
-            q = QSqlQuery()
+            q = Query(self.db)
+            q.prepare('SELECT MIN(id) FROM Matches WHERE tournament_stage = (:id) AND status == 2')
+            q.bindValue(':id', stage_id)
+            self.execute_query(q)
+            first_rated = q.value(0) if q.next() else None
             q.prepare('DELETE FROM Matches WHERE tournament_stage = (:id)')
             q.bindValue(':id', stage_id)
             self.execute_query(q)
+            if first_rated not in (None, ''):
+                self.replay_ratings(q, first_rated)
 
             local_update_queue.append(
                 self.create_remote_update('delete', 'Matches', [], [], where={'tournament_stage': [stage_id]}
@@ -411,7 +984,7 @@ class DataBaseManager(QObject):
         self.db.open()
         local_update_queue = []
         try:
-            query = QSqlQuery()
+            query = Query(self.db)
             if data['status'] == TournamentStageStatus.COMPLETE:
                 if data['next_stage'] is None:
                     raise AssertionError('TOURNAMENT COMPLETE, THIS SHOULD NEVER HAPPEN ANYHOW')
@@ -448,9 +1021,9 @@ class DataBaseManager(QObject):
                     self.db.transaction()
                     query.prepare('INSERT INTO Matches(team1, team2, status, tournament_stage) '
                                   'VALUES (:t1, :t2, 0, :ts_id)')
-                    query.bindValue(':t1', [QVariant(m['team1_id']) for m in schedule])
-                    query.bindValue(':t2', [QVariant(m['team2_id']) for m in schedule])
-                    query.bindValue(':ts_id', [QVariant(data['next_stage']['id']) for m in schedule])
+                    query.bindValue(':t1', [m['team1_id'] for m in schedule])
+                    query.bindValue(':t2', [m['team2_id'] for m in schedule])
+                    query.bindValue(':ts_id', [data['next_stage']['id'] for m in schedule])
                     self.execute_query(query, batch=True)
 
                     query.prepare('SELECT * FROM Matches WHERE tournament_stage = :t_id')
@@ -517,9 +1090,9 @@ class DataBaseManager(QObject):
                         self.db.transaction()
                         query.prepare('INSERT INTO Matches(team1, team2, status, tournament_stage) '
                                       'VALUES (:t1, :t2, 0, :ts_id)')
-                        query.bindValue(':t1', [QVariant(m['team1_id']) for m in schedule])
-                        query.bindValue(':t2', [QVariant(m['team2_id']) for m in schedule])
-                        query.bindValue(':ts_id', [QVariant(m['stage']) for m in schedule])
+                        query.bindValue(':t1', [m['team1_id'] for m in schedule])
+                        query.bindValue(':t2', [m['team2_id'] for m in schedule])
+                        query.bindValue(':ts_id', [m['stage'] for m in schedule])
                         self.execute_query(query, batch=True)
 
                         query.prepare('SELECT * FROM Matches WHERE tournament_stage IN (%s)'
@@ -540,59 +1113,43 @@ class DataBaseManager(QObject):
                     else:
                         print('THIS IS A WEIRD STATE?', data)
 
+                elif data['next_stage']['name'].startswith('DE'):
+                    stage_id = data['next_stage']['id']
+                    team_count = int(data['next_stage']['name'][2:])
+                    qualified = self.seed_qualifiers(
+                        self.get_group_qualifiers(tournament_id, data['current_stage_id'], team_count))
+
+                    self.db.transaction()
+                    delete_stage_matches(stage_id)
+                    query.prepare('UPDATE Bracket_Slots SET team1 = NULL, team2 = NULL, match = NULL '
+                                  'WHERE tournament_stage = :ts_id')
+                    query.bindValue(':ts_id', stage_id)
+                    self.execute_query(query)
+                    local_update_queue.append(
+                        self.create_remote_update('update', 'Bracket_Slots', ['team1', 'team2', 'match'],
+                                                  [[None], [None], [None]], where={'tournament_stage': [stage_id]}))
+
+                    # seed the first upper bracket round, everything else is filled by update_match
+                    query.prepare('SELECT slot, position FROM Bracket_Slots WHERE tournament_stage = :ts_id '
+                                  'AND bracket = "U" AND round = 1 ORDER BY position')
+                    query.bindValue(':ts_id', stage_id)
+                    self.execute_query(query)
+                    first_round = self.simple_get_multiple(query, ['slot', 'position'])
+                    for slot in first_round:
+                        teams = qualified[2 * slot['position']:2 * slot['position'] + 2]
+                        print('DE-Match: %s - %s' % (teams[0]['name'], teams[1]['name']))
+                        for side in range(2):
+                            self.fill_bracket_slot(query, stage_id, slot['slot'], side, teams[side]['id'],
+                                                   local_update_queue)
+
+                    self.db.commit()
+                    self.remote_queue.extend(local_update_queue)
                 elif data['next_stage']['name'].startswith('KO'):
                     if data['name'] == 'GROUP':
                         match_count = int(data['next_stage']['name'][2:3])
                         team_count = match_count * 2
-                        groups = self.get_tournament_groups(tournament_id)
-                        self.db.open()
-                        direct_qualification = math.floor(team_count/len(groups))
-                        qualified = []
-                        pots = [[] for i in range(direct_qualification)]
-
-                        for group in groups:
-                            for q in range(direct_qualification):
-                                direct = group['teams'].pop(0)
-                                qualified.append(direct)
-                                pots[q].append(direct['name'])
-                        if len(qualified) < team_count:
-                            # fill the rest of the spots with the next best teams...
-                            left_over_teams = []
-                            for group in groups:
-                                left_over_teams.append(group['teams'].pop(0))
-                                #for t in group['teams']:
-                                #    left_over_teams.append(t['id'])
-                            print('drawing best from the %r. ranked of each group: %r' % (direct_qualification+1, left_over_teams))
-                            team_replacement = '(%s)' % ', '.join(['%r' % t['id'] for t in left_over_teams])
-                            query.prepare(
-                                'SELECT id as id, Teams.name as name, COALESCE(Games, 0) as games, '
-                                'COALESCE(Won, 0) as won, '
-                                'COALESCE(Lost, 0) as lost, COALESCE(Bierferenz, 0) as diff, '
-                                'COALESCE(Score, 0) as score, COALESCE(Against, 0) as conceded '
-                                'FROM Teams LEFT JOIN (SELECT team, SUM(Win)+SUM(Loss) as Games, SUM(Win) As Won, '
-                                'SUM(Loss) as Lost, Sum(score)-Sum(against) as Bierferenz, SUM(score) as Score , '
-                                'SUM(against) as Against FROM ( SELECT team1 as team, '
-                                'CASE WHEN team1_score > team2_score THEN 1 ELSE 0 END as Win, team2_score as against, '
-                                'CASE WHEN team1_score < team2_score THEN 1 ELSE 0 END as Loss, team1_score as score'
-                                ' FROM Matches WHERE tournament_stage = :stage_id '
-                                'UNION ALL SELECT team2 as team, '
-                                'CASE WHEN team2_score > team1_score THEN 1 ELSE 0 END as Win, team1_score as against, '
-                                'CASE WHEN team2_score < team1_score THEN 1 ELSE 0 END as Loss, team2_score as score '
-                                'FROM Matches WHERE tournament_stage = :stage_id '
-                                ') t '
-                                'GROUP BY team) as g_table ON Teams.id=g_table.team WHERE Teams.id in '
-                                '%s'
-                                ' ORDER By won DESC, diff DESC, score DESC, conceded' % team_replacement)
-                            query.bindValue(':stage_id', data['current_stage_id'])
-
-                            self.execute_query(query)
-                            table = self.simple_get_multiple(query, ['id', 'name', 'won', 'diff'])
-                            for i in range(team_count-len(qualified)):
-                                qualified.append(table.pop(0))
-
-                        print('qualified:', [t['name'] for t in qualified])
-                        # todo: use pots maybe?
-                        shuffle(qualified)
+                        qualified = self.seed_qualifiers(
+                            self.get_group_qualifiers(tournament_id, data['current_stage_id'], team_count))
 
                     else:
                         stages = self.get_tournament_ko_stages(tournament_id)
@@ -623,9 +1180,9 @@ class DataBaseManager(QObject):
                     self.db.transaction()
                     query.prepare('INSERT INTO Matches(team1, team2, status, tournament_stage) '
                                   'VALUES (:t1, :t2, 0, :ts_id)')
-                    query.bindValue(':t1', [QVariant(m['team1_id']) for m in schedule])
-                    query.bindValue(':t2', [QVariant(m['team2_id']) for m in schedule])
-                    query.bindValue(':ts_id', [QVariant(data['next_stage']['id']) for m in schedule])
+                    query.bindValue(':t1', [m['team1_id'] for m in schedule])
+                    query.bindValue(':t2', [m['team2_id'] for m in schedule])
+                    query.bindValue(':ts_id', [data['next_stage']['id'] for m in schedule])
                     self.execute_query(query, batch=True)
 
                     query.prepare('SELECT * FROM Matches WHERE tournament_stage = :t_id')
@@ -655,13 +1212,20 @@ class DataBaseManager(QObject):
         finally:
             self.db.close()
 
-    def update_tournament_stages(self, tournament_id, num_teams, group_size, teams_in_ko):
+    @traced()
+    def update_tournament_stages(self, tournament_id, num_teams, group_size, teams_in_ko, ko_mode='single'):
         print('create new stages. teams:', num_teams, 'group_size:', group_size)
         self.db.open()
         self.db.transaction()
         local_update_queue = []
-        query = QSqlQuery()
+        query = Query(self.db)
         try:
+            # the ratings of the matches left behind by the deleted stages are undone below
+            query.prepare('SELECT MIN(id) FROM Matches WHERE status == 2 AND tournament_stage IN '
+                          '(SELECT id FROM Tournament_Stages WHERE tournament = :tournament_id)')
+            query.bindValue(':tournament_id', tournament_id)
+            self.execute_query(query)
+            first_rated = query.value(0) if query.next() else None
 
             # delete all current stages
 
@@ -694,6 +1258,13 @@ class DataBaseManager(QObject):
 
                     local_update_queue.append(self.create_remote_update('delete', 'KO_Stages', [], [],
                                                                         where={'tournament_stage': [stage['id']]}))
+                    if stage['name'].startswith('DE'):
+                        query.prepare('DELETE FROM Bracket_Slots WHERE tournament_stage = :stage_id')
+                        query.bindValue(':stage_id', stage['id'])
+                        self.execute_query(query)
+
+                        local_update_queue.append(self.create_remote_update(
+                            'delete', 'Bracket_Slots', [], [], where={'tournament_stage': [stage['id']]}))
             # delete tournament-stage-entry
             query.prepare('DELETE FROM Tournament_Stages WHERE tournament = :tournament_id')
             query.bindValue(':tournament_id', tournament_id)
@@ -701,6 +1272,8 @@ class DataBaseManager(QObject):
 
             local_update_queue.append(self.create_remote_update('delete', 'Tournament_Stages', [], [],
                                                                 where={'tournament': [tournament_id]}))
+            if first_rated not in (None, ''):
+                self.replay_ratings(query, first_rated)
 
             # create group_stage
             query.prepare('INSERT INTO Tournament_Stages(tournament, stage_index, name) VALUES (:t_id, 1, "GROUP")')
@@ -736,44 +1309,7 @@ class DataBaseManager(QObject):
                                                                      [str(chr(g + 65))]]
                                                                     ))
 
-            # create ko-stages including 3rd place final
-            index = 2
-            while teams_in_ko >= 1:
-                query.prepare('INSERT INTO Tournament_Stages(tournament, stage_index, name) VALUES (:t_id, :idx, :name)')
-                query.bindValue(':t_id', tournament_id)
-                query.bindValue(':idx', index)
-                if teams_in_ko > 2:
-                    query.bindValue(':name', 'KO%r' % int(teams_in_ko / 2))
-                elif teams_in_ko == 2:
-                    if index > 2:
-                        query.bindValue(':name', 'KO_FINAL_3')
-                    else:
-                        query.bindValue(':name', 'KO_FINAL_1')
-                else:
-                    if index > 3:
-                        query.bindValue(':name', 'KO_FINAL_1')
-                    else:
-                        break
-
-                self.execute_query(query)
-                ts_id = self.get_current_id('Tournament_Stages')
-
-                local_update_queue.append(self.create_remote_update('insert', 'Tournament_Stages',
-                                                                    ['id', 'tournament', 'stage_index', 'name'],
-                                                                    [[ts_id], [tournament_id], [index],
-                                                                     [query.boundValue(':name')]]
-                                                                    ))
-
-                query.prepare('INSERT INTO KO_Stages(tournament_stage) VALUES (:ts_id)')
-                query.bindValue(':ts_id', ts_id)
-                self.execute_query(query)
-
-                local_update_queue.append(self.create_remote_update('insert', 'KO_Stages',
-                                                                    ['tournament_stage'],
-                                                                    [[ts_id]]
-                                                                    ))
-                index += 1
-                teams_in_ko /= 2
+            self.create_ko_stages(query, tournament_id, teams_in_ko, local_update_queue, ko_mode)
 
             self.db.commit()
             self.remote_queue.extend(local_update_queue)
@@ -783,12 +1319,13 @@ class DataBaseManager(QObject):
         finally:
             self.db.close()
 
+    @traced()
     def update_tournament_teams(self, tournament_id, teams, num_teams):
         self.db.open()
         local_update_queue = []
         self.db.transaction()
         try:
-            query = QSqlQuery()
+            query = Query(self.db)
             # set number of teams in database
             query.prepare('UPDATE Tournaments SET num_teams = :num_teams WHERE id = :id')
             query.bindValue(':num_teams', num_teams)
@@ -829,8 +1366,8 @@ class DataBaseManager(QObject):
 
             # add all new teams
             query.prepare('INSERT INTO Tournament_Teams(tournament, team) VALUES (:tournament_id, :team_id)')
-            query.bindValue(':tournament_id', [QVariant(tournament_id) for t in ids])
-            query.bindValue(':team_id', [QVariant(t) for t in ids])
+            query.bindValue(':tournament_id', [tournament_id for t in ids])
+            query.bindValue(':team_id', ids)
             self.execute_query(query, batch=True)
 
             local_update_queue.append(self.create_remote_update('insert', 'Tournament_Teams',
@@ -847,7 +1384,7 @@ class DataBaseManager(QObject):
 
     def get_team_id(self, team_name):
         self.db.open()
-        query = QSqlQuery()
+        query = Query(self.db)
         try:
             query.prepare('SELECT id FROM Teams WHERE name=:team_name')
             query.bindValue(':team_name', team_name)
@@ -858,7 +1395,7 @@ class DataBaseManager(QObject):
 
     def get_tournament_id(self, tournament_name):
         self.db.open()
-        query = QSqlQuery()
+        query = Query(self.db)
         try:
             query.prepare('SELECT id FROM Tournaments WHERE name=:tournament_name')
             query.bindValue(':tournament_name', tournament_name)
@@ -867,10 +1404,11 @@ class DataBaseManager(QObject):
         finally:
             self.db.close()
 
+    @traced()
     def get_tournament_status(self, tournament_id):
         self.db.open()
         try:
-            query = QSqlQuery()
+            query = Query(self.db)
             query.prepare('SELECT'
                           ' (SELECT COUNT() FROM Group_Teams WHERE group_id IN '
                           '    (SELECT id FROM Groups WHERE group_stage IN '
@@ -911,7 +1449,9 @@ class DataBaseManager(QObject):
                           ' 0 '
                           'END as stage_status'
                           ' FROM Tournament_Stages '
-                          'JOIN (SELECT id as stage, REPLACE(SUBSTR(name, 3,1),"_","1")*best_of as expected_matches '
+                          'JOIN (SELECT id as stage, CASE WHEN name LIKE "DE%" THEN '
+                          '(SELECT COUNT() FROM Bracket_Slots WHERE tournament_stage == Tournament_Stages.id) '
+                          'ELSE REPLACE(SUBSTR(name, 3,1),"_","1")*best_of END as expected_matches '
                           'FROM KO_Stages Join Tournament_Stages ON KO_Stages.tournament_stage == Tournament_Stages.id'
                           ' UNION '
                           'SELECT group_matches.group_stage as stage, SUM(exp_matches) as expected_matches FROM '
@@ -987,6 +1527,16 @@ class DataBaseManager(QObject):
                             'status': TournamentStageStatus.IN_PROGRESS
                         }
                         # print('stage', stage_index, 'in progress')
+                    elif stage['name'].startswith('DE') and match_sum > 0:
+                        # double elimination matches are created as soon as both teams of a slot are known
+                        current_status = {
+                            'current_stage_id': stage['id'],
+                            'current_stage': stage_index,
+                            'name': stage['name'],
+                            'status': TournamentStageStatus.IN_PROGRESS
+                            if stage['matches_in_progress'] > 0 or stage['complete_matches'] > 0
+                            else TournamentStageStatus.INITIALIZED
+                        }
                     elif stage['scheduled_matches'] == stage['expected_matches'] and \
                             prev_stage_complete(stage_index, current_status):
                         current_status = {
@@ -1003,9 +1553,10 @@ class DataBaseManager(QObject):
         finally:
             self.db.close()
 
+    @traced()
     def get_tournament_teams(self, tournament_id):
         self.db.open()
-        query = QSqlQuery()
+        query = Query(self.db)
         try:
             query.prepare('SELECT * FROM Tournament_Teams JOIN Teams ON Tournament_Teams.team = Teams.id '
                           'WHERE Tournament_Teams.tournament = :t_id')
@@ -1015,25 +1566,45 @@ class DataBaseManager(QObject):
         finally:
             self.db.close()
 
+    @traced()
+    def get_tournament_list(self):
+        """ The rows of Tournaments, all the home screen needs to show up."""
+        self.db.open()
+        query = Query(self.db)
+        try:
+            query.prepare('SELECT id, name, num_teams, stylesheet FROM Tournaments ORDER BY id')
+            self.execute_query(query)
+            return self.simple_get_multiple(query, ['id', 'name', 'num_teams', 'stylesheet'])
+        finally:
+            self.db.close()
+
+    @traced()
     def get_teams(self):
         self.db.open()
-        query = QSqlQuery()
+        query = Query(self.db)
         try:
-            query.prepare('SELECT * FROM Teams')
+            # last_played (the id of the last tournament, '' if none) ranks the team search
+            query.prepare('SELECT Teams.id as id, Teams.name as name, MAX(Tournament_Teams.tournament) as last_played '
+                          'FROM Teams LEFT JOIN Tournament_Teams ON Tournament_Teams.team = Teams.id '
+                          'GROUP BY Teams.id')
             self.execute_query(query)
-            return self.simple_get_multiple(query, ['id', 'name'])
+            return self.simple_get_multiple(query, ['id', 'name', 'last_played'])
         finally:
             self.db.close()
 
+    @traced()
     def get_tournament_ko_stages(self, tournament_id):
         self.db.open()
-        ko_matches_query = QSqlQuery()
+        ko_matches_query = Query(self.db)
         try:
-            ko_matches_query.prepare('SELECT Matches.id as id, tournament_stage, T1.id as team1_id, T2.id as team2_id, '
+            ko_matches_query.prepare('SELECT Matches.id as id, Matches.tournament_stage as tournament_stage, '
+                                     'T1.id as team1_id, T2.id as team2_id, '
                                      'Tournament_Stages.name as stage_name, field, status, '
-                                     'tournament, T1.name as team1, T2.name as team2, team1_score, team2_score, status '
+                                     'tournament, T1.name as team1, T2.name as team2, team1_score, team2_score, status, '
+                                     'Bracket_Slots.bracket as bracket, Bracket_Slots.round as round '
                                      'FROM Matches '
                                      'JOIN Tournament_Stages ON Tournament_Stages.id = Matches.tournament_stage '
+                                     'LEFT JOIN Bracket_Slots ON Bracket_Slots.match = Matches.id '
                                      'join Teams as T1 on Matches.team1 = T1.id '
                                      'join Teams as T2 on Matches.team2 = T2.id '
                                      'WHERE tournament = :t_id and Tournament_Stages.name != "GROUP"')
@@ -1043,7 +1614,7 @@ class DataBaseManager(QObject):
                                                   ['id', 'tournament_stage', 'stage_name',
                                                    'team1_id', 'team2_id', 'team1', 'team2',
                                                    'team1_score', 'team2_score',
-                                                   'status', 'field'])
+                                                   'status', 'field', 'bracket', 'round'])
             stages = OrderedDict()
             for m in ko_matches:
                 if m['tournament_stage'] not in stages:
@@ -1058,11 +1629,12 @@ class DataBaseManager(QObject):
         finally:
             self.db.close()
 
+    @traced()
     def get_tournament_groups(self, tournament_id):
         self.db.open()
-        query = QSqlQuery()
-        group_table_query = QSqlQuery()
-        group_matches_query = QSqlQuery()
+        query = Query(self.db)
+        group_table_query = Query(self.db)
+        group_matches_query = Query(self.db)
         try:
             groups = []
             query.prepare('SELECT id FROM Tournament_Stages WHERE tournament == :id AND stage_index == 1')
@@ -1116,20 +1688,8 @@ class DataBaseManager(QObject):
             # for each group
             while query.next():
                 group_table_query.bindValue(':g_id', query.record().value('id'))
-                teams = []
                 self.execute_query(group_table_query)
-                # for each team
-                while group_table_query.next():
-                    teams.append({
-                        'id': group_table_query.value('team'),
-                        'name': group_table_query.value('name'),
-                        'games': group_table_query.value('games'),
-                        'won': group_table_query.value('won'),
-                        'lost': group_table_query.value('lost'),
-                        'diff': group_table_query.value('diff'),
-                        'score': group_table_query.value('score'),
-                        'conceded': group_table_query.value('conceded')
-                    })
+                teams = self.simple_get_multiple(group_table_query, STANDING_KEYS, {'id': 'team'})
 
                 # solve position-clashes by direct comparison
                 last_data = ''
@@ -1145,7 +1705,7 @@ class DataBaseManager(QObject):
                     last_data = current_data
                     last_team = team['id']
 
-                direct_comp_query = QSqlQuery()
+                direct_comp_query = Query(self.db)
                 for conflict in conflicts:
                     team_replacement = '(%s)' % ','.join([':t%r' % t for t in conflicts[conflict]])
                     direct_comp_query.prepare(
@@ -1176,7 +1736,7 @@ class DataBaseManager(QObject):
 
                     direct_comp_query.bindValue(':stage_id', stage_id)
                     for t in conflicts[conflict]:
-                        direct_comp_query.bindValue(':t%r' % t, QVariant(t))
+                        direct_comp_query.bindValue(':t%r' % t, t)
                     self.execute_query(direct_comp_query)
                     resolution = self.simple_get_multiple(direct_comp_query, ['id'])
                     old_conf_teams = {}
@@ -1206,10 +1766,11 @@ class DataBaseManager(QObject):
         finally:
             self.db.close()
 
+    @traced()
     def get_all_time_table(self):
         self.db.open()
         try:
-            query = QSqlQuery()
+            query = Query(self.db)
             query.prepare('SELECT team, name, games, won, lost, diff, score, conceded FROM '
                           '(SELECT team, SUM(Win)+SUM(Loss) as games, SUM(Win) As won, SUM(Loss) as lost, '
                           'Sum(score)-Sum(against) as diff, SUM(score) as score , SUM(against) as conceded '
@@ -1223,19 +1784,7 @@ class DataBaseManager(QObject):
                           'ORDER By won DESC, diff DESC, score DESC) '
                           'as ewig JOIN Teams ON  ewig.team = Teams.id')
             self.execute_query(query)
-            teams = []
-            # for each team
-            while query.next():
-                teams.append({
-                    'id': query.value('team'),
-                    'name': query.value('name'),
-                    'games': query.value('games'),
-                    'won': query.value('won'),
-                    'lost': query.value('lost'),
-                    'diff': query.value('diff'),
-                    'score': query.value('score'),
-                    'conceded': query.value('conceded')
-                })
+            teams = self.simple_get_multiple(query, STANDING_KEYS, {'id': 'team'})
             group = {
                 'name': 'ALL TIME TABLE',
                 'id': None,
@@ -1250,8 +1799,8 @@ class DataBaseManager(QObject):
     #  data.keys = ['group_size': int, 'name': str, 'teams_in_ko': int, 'teams': dict{name:id}}
     def import_two_stage_tournament(self, data):
         self.db.open()
-        query = QSqlQuery()
-        query2 = QSqlQuery()
+        query = Query(self.db)
+        query2 = Query(self.db)
         self.db.transaction()
         try:
             self.db.transaction()
@@ -1359,11 +1908,12 @@ class DataBaseManager(QObject):
             self.db.close()
 
     # data.keys = ['group_size': int, 'name': str, 'teams_in_ko': int, 'teams': list(str)}
+    @traced()
     def store_tournament(self, data):
         print(data)
         self.db.open()
         local_update_queue = []
-        query = QSqlQuery()
+        query = Query(self.db)
         self.db.transaction()
         try:
             query.prepare('INSERT INTO Tournaments(name, stylesheet, num_teams) VALUES (:name, :stylesheet, :num_teams)')
@@ -1411,45 +1961,8 @@ class DataBaseManager(QObject):
                                                                     [[g_id], [ts_id], [data['group_size']], [str(chr(g+65))]]
                                                                     ))
 
-            # create ko-stages including 3rd place final
-            teams_in_ko = data['teams_in_ko']
-            index = 2
-            while teams_in_ko >= 1:
-                query.prepare('INSERT INTO Tournament_Stages(tournament, stage_index, name) VALUES (:t_id, :idx, :name)')
-                query.bindValue(':t_id', tournament_id)
-                query.bindValue(':idx', index)
-                if teams_in_ko > 2:
-                    query.bindValue(':name', 'KO%r' % int(teams_in_ko/2))
-                elif teams_in_ko == 2:
-                    if index > 2:
-                        query.bindValue(':name', 'KO_FINAL_3')
-                    else:
-                        query.bindValue(':name', 'KO_FINAL_1')
-                else:
-                    if index > 3:
-                        query.bindValue(':name', 'KO_FINAL_1')
-                    else:
-                        break
-
-                self.execute_query(query)
-                ts_id = self.get_current_id('Tournament_Stages')
-
-                local_update_queue.append(self.create_remote_update('insert', 'Tournament_Stages',
-                                                                    ['id', 'tournament', 'stage_index', 'name'],
-                                                                    [[ts_id], [tournament_id], [index],
-                                                                     [query.boundValue(':name')]]
-                                                                    ))
-
-                query.prepare('INSERT INTO KO_Stages(tournament_stage) VALUES (:ts_id)')
-                query.bindValue(':ts_id', ts_id)
-                self.execute_query(query)
-
-                local_update_queue.append(self.create_remote_update('insert', 'KO_Stages',
-                                                                    ['tournament_stage'],
-                                                                    [[ts_id]]
-                                                                    ))
-                index += 1
-                teams_in_ko /= 2
+            self.create_ko_stages(query, tournament_id, data['teams_in_ko'], local_update_queue,
+                                  data.get('ko_mode', 'single'))
 
             # add teams
             # maybe we can skip the query with the id information
@@ -1494,16 +2007,17 @@ class DataBaseManager(QObject):
 
     # this is just for testing purposes, of course there won't be a full copy of the database as a python dict
     # in the finished version, but it is very convenient for now
+    @traced()
     def read_data(self, table_names=None):
         self.db.open()
-        query = QSqlQuery()
+        query = Query(self.db)
         data = {}
         try:
             tables = set(table_names).intersection(self.db.tables()) if table_names is not None else self.db.tables()
             for table in tables:
 
                 data[table] = []
-                keys = [self.db.record(table).field(x).name() for x in range(self.db.record(table).count())]
+                keys = self.db.columns(table)
                 query.exec_('SELECT * from %s' % table)
                 while query.next():
                     entry = {}
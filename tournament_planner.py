@@ -1,17 +1,47 @@
 import sys
+import time
 
-from PyQt5.QtCore import pyqtSignal, QDir, QCoreApplication, Qt, QSize
+from PyQt5.QtCore import pyqtSignal, QDir, QCoreApplication, Qt, QSize, QEvent, QTimer
 
 from PyQt5.QtWidgets import QApplication, QWidget, QPushButton, QGridLayout, QSizePolicy, QStyle, QMainWindow, QToolBar
-from PyQt5.QtGui import QIcon, QImage, QPainter, QColor
+from PyQt5.QtGui import QIcon, QImage, QPainter, QColor, QPixmap
 
-from widgets import TournamentWidget, AllTimeTableWidget
+from assets import assets
+from pool import pool
+import simulation
+from stalls import StallWatchdog
+from widgets import TournamentWidget, AllTimeTableWidget, DiagnosticsDialog
 from wizards import TournamentWizard
 from tools import DataBaseManager, DBException
+from tracing import span, traced, tracer
+
+
+class StartupTimer:
+    """ Wall time of the startup phases, every phase() call ends the phase running since the last one."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = []
+
+    def phase(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        return 'startup %.0f ms: ' % ((self.last - self.start) * 1000) + \
+               ', '.join('%s %.0f ms' % (name, duration * 1000) for name, duration in self.phases)
 
 
 class App(QMainWindow):
+    # the remote queue reports from its sync thread, the signal takes that back to the GUI thread
+    sync_status = pyqtSignal(dict)
+    # finish the startup even if the home screen is never painted, e.g. on a minimised start
+    first_frame_timeout = 1000
+
     def __init__(self):
+        self.startup = StartupTimer()
         super().__init__()
         self.title = 'FlunkyRock Planner'
         self.left = 10
@@ -20,30 +50,42 @@ class App(QMainWindow):
         self.height = 700
         self.data = None
         self.database = DataBaseManager()
+        self.startup.phase('database')
         self.setGeometry(self.left, self.top, self.width, self.height)
         self.setWindowTitle(self.title)
-        self.setWindowIcon(QIcon('icons/favicon.ico'))
+        self.setWindowIcon(assets.icon('favicon.ico'))
         self.setStyleSheet('background-color: rgb(51,124,99); font-family: Helvetica; font-weight: bold; '
                            'color: white')
         self.toolbar = QToolBar("Main")
         self.addToolBar(Qt.BottomToolBarArea, self.toolbar)
-        self.homeAction = self.toolbar.addAction(QIcon('icons/home_large.png'), 'Home')
-        self.syncAction = self.toolbar.addAction(QIcon('icons/web_database.png'), 'Sync with FlunkyRock.de')
+        self.homeAction = self.toolbar.addAction(assets.icon('home_large.png'), 'Home')
+        self.syncAction = self.toolbar.addAction(assets.icon('web_database.png'), 'Sync with FlunkyRock.de')
+        self.diagnosticsAction = self.toolbar.addAction(self.style().standardIcon(QStyle.SP_MessageBoxInformation),
+                                                        'Diagnostics')
         self.homeAction.triggered.connect(self.go_home)
+        self.diagnosticsAction.triggered.connect(self.show_diagnostics)
+        self.watchdog = StallWatchdog()
+        self.watchdog.start()
+        self.diagnostics = None
         self.syncAction.triggered.connect(self.database.remote_queue.execute_updates)
-        self.database.remote_queue.sync_status.connect(self.update_remote_icon)
-        self.database.remote_queue.execute_updates()
-        self.fetch_data()
-        self.homeWidget = HomeWidget(self.data)
-        self.tournamentWidget = TournamentWidget(self.database, self)
-        self.allTimeTableWidget = AllTimeTableWidget(self)
-        self.tournamentWidget.hide()
-        self.allTimeTableWidget.hide()
+        self.database.remote_queue.sync_status.connect(self.sync_status.emit)
+        self.sync_status.connect(self.update_remote_icon)
+        self.startup.phase('window')
+        # the home screen only needs the tournament list, the teams, the sync and the tournament
+        # widgets follow after the first frame
+        self.data = {'Tournaments': self.database.get_tournament_list(), 'Teams': []}
+        self.startup.phase('tournament list')
+        self.homeWidget = HomeWidget(self.data, backgrounds=False)
+        self.tournamentWidget = None
+        self.allTimeTableWidget = None
         self.setCentralWidget(self.homeWidget)
 
         self.homeWidget.tournament_opened.connect(self.open_tournament)
         self.homeWidget.tournament_created.connect(self.create_tournament)
         self.homeWidget.show_all_time_table.connect(self.show_all_time_table)
+        self.homeWidget.installEventFilter(self)
+        QTimer.singleShot(self.first_frame_timeout, self.finish_startup)
+        self.startup.phase('home')
 
         #directory = QDir('icons')
         #files = directory.entryList(["*.png"])
@@ -55,6 +97,39 @@ class App(QMainWindow):
 
         self.show()
 
+    def eventFilter(self, obj, event):
+        if obj is self.homeWidget and event.type() == QEvent.Paint and self.startup is not None:
+            self.homeWidget.removeEventFilter(self)
+            self.startup.phase('first frame')
+            QTimer.singleShot(0, self.finish_startup)
+        return False
+
+    def finish_startup(self):
+        if self.startup is None:
+            return
+        self.data['Teams'] = self.database.get_teams()
+        self.startup.phase('teams')
+        self.database.remote_queue.execute_updates()
+        self.startup.phase('sync')
+        self.create_pages()
+        self.startup.phase('tournament widgets')
+        self.homeWidget.show_backgrounds()
+        print(self.startup.report())
+        self.startup = None
+
+    def show_diagnostics(self):
+        if self.diagnostics is None:
+            self.diagnostics = DiagnosticsDialog(self.watchdog, self)
+        self.diagnostics.show()
+        self.diagnostics.raise_()
+
+    def create_pages(self):
+        if self.tournamentWidget is None:
+            self.tournamentWidget = TournamentWidget(self.database, self)
+            self.allTimeTableWidget = AllTimeTableWidget(self)
+            self.tournamentWidget.hide()
+            self.allTimeTableWidget.hide()
+
     def fetch_data(self):
         self.data = self.database.read_data(['Tournaments', 'Teams'])
 
@@ -67,11 +142,14 @@ class App(QMainWindow):
         self.switch_central_widget(self.homeWidget)
 
     def show_all_time_table(self):
+        self.finish_startup()
         all_time_table = self.database.get_all_time_table()
         self.allTimeTableWidget.update_table(all_time_table)
         self.switch_central_widget(self.allTimeTableWidget)
 
+    @traced()
     def open_tournament(self, tournament):
+        self.finish_startup()
         try:
             t_teams = self.database.get_tournament_teams(tournament['id'])
             groups = self.database.get_tournament_groups(tournament['id'])
@@ -88,17 +166,13 @@ class App(QMainWindow):
         if self.database.store_tournament(data):
             self.database.remote_queue.execute_updates()
             self.fetch_data()
-            if type(self.centralWidget()) == HomeWidget:
-                self.homeWidget = HomeWidget(self.data)
-                self.homeWidget.tournament_opened.connect(self.open_tournament)
-                self.homeWidget.tournament_created.connect(self.create_tournament)
-                self.go_home()
+            self.homeWidget.set_data(self.data)
 
     def update_remote_icon(self, sync_status):
-        icon = QIcon('icons/web_database.png')
         queue_size = sync_status['queue_size']
         if queue_size > 0:
-            px = icon.pixmap(QSize(128, 128))
+            # paint on a copy, the cached pixmap is shared
+            px = QPixmap(assets.pixmap('web_database.png', QSize(128, 128)))
             painter = QPainter()
             painter.begin(px)
             painter.setPen(QColor(255, 0, 0))
@@ -115,7 +189,7 @@ class App(QMainWindow):
             painter.end()
             self.syncAction.setIcon(QIcon(px))
         else:
-            self.syncAction.setIcon(icon)
+            self.syncAction.setIcon(assets.icon('web_database.png'))
         # self.syncAction.setEnabled(sync_status['internet'])
 
 
@@ -124,11 +198,14 @@ class HomeWidget(QWidget):
     tournament_created = pyqtSignal(dict)
     show_all_time_table = pyqtSignal()
 
-    def __init__(self, data):
+    def __init__(self, data, backgrounds=True):
         super().__init__()
         self.tournament_wizard = None
         self.layout = None
         self.data = data
+        # decoding the background images of the tournament themes takes most of the first frame,
+        # without them the buttons are only coloured until show_backgrounds()
+        self.backgrounds = backgrounds
         self.init_ui()
 
     def init_ui(self):
@@ -137,39 +214,64 @@ class HomeWidget(QWidget):
         self.layout.setSpacing(45)
         self.layout.setContentsMargins(45, 45, 45, 45)
         self.setLayout(self.layout)
-        create_tournament_button = QPushButton('Create Tournament', self)
-        create_tournament_button.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-        create_tournament_button.setStyleSheet('background-color: rgb(190, 190, 190); color: rgb(0, 0, 0)')
-        create_tournament_button.setIcon(QIcon('icons/application_add'))
-        create_tournament_button.clicked.connect(self.show_tournament_wizard)
-        all_time_table_button = QPushButton('All-Time-Table', self)
-        all_time_table_button.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-        all_time_table_button.setIcon(QIcon('icons/medal_gold_1.png'))
-        all_time_table_button.clicked.connect(self.show_all_time_table)
-        row = 0
-        col = 0
-        for t in self.data['Tournaments']:
-            bt = QPushButton(t['name'])
-            bt.setStyleSheet(t['stylesheet'])
-            bt.setIcon(QIcon('icons/favicon.ico'))
-            bt.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-            bt.setProperty('tournament', t)
-            bt.setProperty('bg_img', 'true')
+        self.create_tournament_button = QPushButton('Create Tournament', self)
+        self.create_tournament_button.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.create_tournament_button.setStyleSheet('background-color: rgb(190, 190, 190); color: rgb(0, 0, 0)')
+        self.create_tournament_button.setIcon(assets.icon('application_add'))
+        self.create_tournament_button.clicked.connect(self.show_tournament_wizard)
+        self.all_time_table_button = QPushButton('All-Time-Table', self)
+        self.all_time_table_button.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.all_time_table_button.setIcon(assets.icon('medal_gold_1.png'))
+        self.all_time_table_button.clicked.connect(self.show_all_time_table)
+        self.tournament_buttons = []
+        self.set_data(self.data)
+
+    @staticmethod
+    def new_tournament_button():
+        bt = QPushButton()
+        bt.setIcon(assets.icon('favicon.ico'))
+        bt.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        return bt
+
+    def set_data(self, data):
+        # two buttons per row, the existing buttons keep their cells and only get new texts
+        self.data = data
+        tournaments = data['Tournaments']
+        while len(self.tournament_buttons) > len(tournaments):
+            bt = self.tournament_buttons.pop()
+            self.layout.removeWidget(bt)
+            pool.release('home_button', bt, signals=(bt.clicked,))
+        while len(self.tournament_buttons) < len(tournaments):
+            bt = pool.take('home_button', self.new_tournament_button)
+            bt.setParent(self)
             bt.clicked.connect(self.tournament_clicked)
-            self.layout.addWidget(bt, row, col)
-            if col == 0:
-                col = 1
-            else:
-                col = 0
-                row += 1
-
-        self.layout.addWidget(create_tournament_button, row, col)
-        if col == 0:
-            col = 1
-        else:
-            col = 0
-            row += 1
-        self.layout.addWidget(all_time_table_button, row, col)
+            self.layout.addWidget(bt, len(self.tournament_buttons) // 2, len(self.tournament_buttons) % 2)
+            bt.show()
+            self.tournament_buttons.append(bt)
+        for bt, t in zip(self.tournament_buttons, tournaments):
+            bt.setText(t['name'])
+            if self.backgrounds:
+                bt.setProperty('bg_img', 'true')
+            if bt.styleSheet() != t['stylesheet']:
+                bt.setStyleSheet(t['stylesheet'])
+            bt.setProperty('tournament', t)
+
+        count = len(tournaments)
+        for i, bt in enumerate([self.create_tournament_button, self.all_time_table_button]):
+            self.layout.removeWidget(bt)
+            self.layout.addWidget(bt, (count + i) // 2, (count + i) % 2)
+
+    def show_backgrounds(self):
+        """ Switch on the background images, one button per event loop pass to keep the ui responsive."""
+        self.backgrounds = True
+        for bt in self.tournament_buttons:
+            if not bt.property('bg_img'):
+                bt.setProperty('bg_img', 'true')
+                bt.style().unpolish(bt)
+                bt.style().polish(bt)
+                bt.update()
+                QTimer.singleShot(0, self.show_backgrounds)
+                return
 
     def tournament_clicked(self):
         self.tournament_opened.emit(self.sender().property('tournament'))
@@ -186,7 +288,20 @@ class HomeWidget(QWidget):
         self.tournament_wizard.show()
 
 
+class TracingApplication(QApplication):
+    """ QApplication recording the paint, repaint and layout events as spans, used while tracing."""
+    traced_events = {QEvent.Paint: 'paint', QEvent.UpdateRequest: 'repaint', QEvent.LayoutRequest: 'layout'}
+
+    def notify(self, receiver, event):
+        kind = self.traced_events.get(event.type())
+        if kind is None:
+            return super().notify(receiver, event)
+        with span(kind, 'qt', widget=type(receiver).__name__):
+            return super().notify(receiver, event)
+
+
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
+    app = TracingApplication(sys.argv) if tracer.enabled else QApplication(sys.argv)
+    app.aboutToQuit.connect(simulation.shutdown)
     ex = App()
     sys.exit(app.exec_())
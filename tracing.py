@@ -0,0 +1,125 @@
+import atexit
+import functools
+import json
+import os
+import threading
+from time import perf_counter
+
+MAX_EVENTS = 1000000
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.add(self.name, self.category, self.start, perf_counter(), self.args)
+        return False
+
+
+class NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+class Tracer:
+    """ Nested spans of wall time per thread, saved as Chrome trace json (chrome://tracing, Perfetto).
+
+    Enabled with TOURNAMENT_TRACE=<file> before the traced modules are imported: @traced leaves
+    the functions as they are while disabled and span() hands out one shared no-op. Spans are
+    complete events ('ph': 'X'), the viewer nests them by time on each thread."""
+
+    def __init__(self):
+        self.enabled = False
+        self.file_name = None
+        self.events = []
+        self.threads = {}
+        self.dropped = 0
+        self.origin = perf_counter()
+        self.registered = False
+
+    def enable(self, file_name):
+        self.enabled = True
+        self.file_name = file_name
+        if not self.registered:
+            atexit.register(self.save)
+            self.registered = True
+
+    def span(self, name, category='', **args):
+        """ with tracer.span('draw', teams=32): ..."""
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name, category, args)
+
+    def add(self, name, category, start, end, args=None):
+        """ Record a span from perf_counter() values."""
+        if not self.enabled:
+            return
+        if len(self.events) >= MAX_EVENTS:
+            self.dropped += 1
+            return
+        tid = threading.get_native_id()
+        if tid not in self.threads:
+            self.threads[tid] = threading.current_thread().name
+        event = {'name': name, 'cat': category, 'ph': 'X', 'ts': (start - self.origin) * 1e6,
+                 'dur': (end - start) * 1e6, 'pid': os.getpid(), 'tid': tid}
+        if args:
+            event['args'] = args
+        # list.append is atomic, spans of other threads need no lock
+        self.events.append(event)
+
+    def save(self, file_name=None):
+        file_name = file_name or self.file_name
+        if not file_name or not self.events:
+            return
+        pid = os.getpid()
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                    for tid, name in self.threads.items()]
+        try:
+            with open(file_name, 'w', encoding='utf-8') as output:
+                json.dump({'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms',
+                           'otherData': {'dropped': self.dropped}}, output, default=str)
+        except OSError as ex:
+            print('trace:', ex)
+
+
+tracer = Tracer()
+span = tracer.span
+if os.environ.get('TOURNAMENT_TRACE'):
+    tracer.enable(os.environ['TOURNAMENT_TRACE'])
+
+
+def traced(name=None, category=None):
+    """ Decorator recording a span per call, named after the function by default."""
+    def decorate(function):
+        if not tracer.enabled:
+            return function
+        span_name = name or function.__qualname__
+        span_category = category or function.__module__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                tracer.add(span_name, span_category, start, perf_counter())
+        return wrapper
+    return decorate
@@ -2,91 +2,95 @@ import inspect
 import math
 import os
 import random
-from collections import OrderedDict
+import time
+from collections import Counter, OrderedDict
+from threading import Lock, Thread
 
-from PyQt5.QtCore import Qt, pyqtSignal, QSortFilterProxyModel, QModelIndex, QSysInfo, QSize
+from PyQt5.QtCore import Qt, pyqtSignal, QSortFilterProxyModel, QModelIndex, QSysInfo, QSize, \
+    QAbstractTableModel, QEvent, QPersistentModelIndex, QRect, QTimer, QStringListModel
 
-from PyQt5.QtGui import QIcon, QPixmap, QColor, QPainter, QDropEvent, QStandardItemModel, QWheelEvent
+from PyQt5.QtGui import QIcon, QPixmap, QColor, QPainter, QDropEvent, QStandardItemModel, QWheelEvent, QFont
 
 from PyQt5.QtWidgets import QGridLayout, QScrollArea, QWidget, QTableWidgetItem, QPushButton, QToolButton, \
     QLabel, QHBoxLayout, QVBoxLayout, QHeaderView, QTableWidget, QListWidget, QListWidgetItem, QComboBox, \
     QCompleter, QStyleOption, QStyle, QAbstractItemView, QSpinBox, QFrame, QDialog, QFormLayout, \
-    QRadioButton, QButtonGroup, QSplitter, QLineEdit, QMainWindow
+    QRadioButton, QButtonGroup, QSplitter, QLineEdit, QMainWindow, QDockWidget, QTableView, \
+    QStyledItemDelegate, QStyleOptionButton, QApplication, QPlainTextEdit, QMessageBox
 
+from assets import assets
+from brackets import ko_size
+from clinch import CLINCHED, ELIMINATED, QualificationTracker
+from draw import DrawState, draw_teams
 from layout import FlowLayout
-from tools import TournamentStageStatus
+from pool import pool
+from refresh import ALL, GROUPS, KO, STATUS, TEAMS, RefreshScheduler
+from search import TeamSearchIndex
+import simulation
+from themes import compile_theme, css_color as parse_css_color, parse_stylesheet
+from tools import DEFAULT_STYLESHEET, BracketError, TournamentStageStatus
+from tracing import traced
 
 
 class WidgetTools:
+    # merged selectors per chain of stylesheets from the top level widget down, a changed
+    # stylesheet of any ancestor leads to a different chain
+    resolved_stylesheets = OrderedDict()
+
     @staticmethod
     def find_stylesheet(widget, return_as_dict=False):
-        def extract_styles(sheet):
-            styles = {}
-            if sheet is not None:
-                for pair in sheet.split(';'):
-                    try:
-                        _key, _val = pair.split(':')
-                        styles[_key.strip()] = _val.strip()
-                    except ValueError:  # invalid pair
-                        pass
-            return styles
-
-        def extract_selectors(sheet):
-            selectors = OrderedDict()
-            if sheet is not None:
-                sels = sheet.split('}')
-                for sel in sels:
-                    if sel.__contains__('{'):
-                        _key, _val = sel.split('{')
-                        selectors[_key.strip()] = _val.strip()
-            return selectors
-
-        selector_style = OrderedDict()
-        parent_list = [widget]
+        sheets = []
         p = widget
-        while p.parent() is not None:
+        while p is not None:
+            sheets.append(p.styleSheet())
             p = p.parent()
-            parent_list.append(p)
-        parent_list.reverse()
-        for p in parent_list:
-            p_sels = extract_selectors(p.styleSheet())
-            if not p_sels:
-                style = extract_styles(p.styleSheet())
-                if not selector_style.keys().__contains__('*'):
-                    selector_style['*'] = {}
-                for key in style:
-                    selector_style['*'][key] = style[key]
-            else:
-                for sel in p_sels:
-                    selector_style[sel] = {}
-                    sel_style = extract_styles(p_sels[sel])
-                    for key in sel_style:
-                        selector_style[sel][key] = sel_style[key]
-        if return_as_dict:
-            return selector_style
-        else:
+        key = tuple(reversed(sheets))
+        resolved = WidgetTools.resolved_stylesheets.get(key)
+        if resolved is None:
+            selector_style = OrderedDict()
+            for sheet in key:
+                p_sels = parse_stylesheet(sheet)
+                if '{' not in sheet:
+                    if not selector_style.keys().__contains__('*'):
+                        selector_style['*'] = {}
+                    for key_, value in p_sels.get('*', {}).items():
+                        selector_style['*'][key_] = value
+                else:
+                    for sel in p_sels:
+                        selector_style[sel] = dict(p_sels[sel])
             sheet = ''
             for selector in selector_style:
                 sheet += '%s{%s}' % (selector,
-                                     ';'.join(['%s:%s' % (key, selector_style[selector][key])
-                                               for key in selector_style[selector]]))
-            return sheet
+                                     ';'.join(['%s:%s' % (key_, selector_style[selector][key_])
+                                               for key_ in selector_style[selector]]))
+            resolved = (selector_style, sheet)
+            WidgetTools.resolved_stylesheets[key] = resolved
+            if len(WidgetTools.resolved_stylesheets) > 64:
+                WidgetTools.resolved_stylesheets.popitem(last=False)
+        # shared between all widgets with the same stylesheets, read only
+        return resolved[0] if return_as_dict else resolved[1]
 
     @staticmethod
     def css_color_to_rgb(css_color):
-        if css_color.startswith('rgb('):
-            triple = css_color.replace('rgb(', '').replace(')', '')
-            r, g, b = [int(t.strip()) for t in triple.split(',')]
-            return QColor(r, g, b, 255)
-        elif css_color.startswith('rgba('):
-            triple = css_color.replace('rgba(', '').replace(')', '')
-            r, g, b, a = [int(t.strip()) for t in triple.split(',')]
-            return QColor(r, g, b, a)
-        else:
-            return QColor(css_color)
+        return parse_css_color(css_color)
 
 
 class TournamentWidget(QWidget):
+    page_types = {
+        'groups': lambda parent: GroupStageWidget(parent),
+        'draw_groups': lambda parent: GroupDrawWidget(parent),
+        'generate_matches': lambda parent: GenerateMatchesWidget(parent),
+        'tournament_settings': lambda parent: TournamentSettingsWidget(parent),
+        'ko_stage': lambda parent: KOStageWidget(parent)
+    }
+    # the parts of the tournament every page shows
+    page_parts = {
+        'groups': {GROUPS, STATUS},
+        'draw_groups': {TEAMS, GROUPS, STATUS},
+        'generate_matches': {STATUS},
+        'tournament_settings': {TEAMS, GROUPS, STATUS},
+        'ko_stage': {KO, STATUS}
+    }
+    display_interval = 5000
 
     def __init__(self, database, parent=None):
         super().__init__(parent=parent)
@@ -94,6 +98,12 @@ class TournamentWidget(QWidget):
         self.db_teams = None
         self.tournament = None
         self.t_teams = None
+        self.groups = None
+        self.ko_stages = None
+        self.status = None
+        self.qualification = QualificationTracker()
+        self.theme = None
+        self.refresh_scheduler = RefreshScheduler(self.refresh_tournament)
         self.layout = QVBoxLayout()
         self.layout.setSpacing(0)
         self.layout.setContentsMargins(0, 0, 0, 0)
@@ -107,35 +117,54 @@ class TournamentWidget(QWidget):
         self.main_page_button = QToolButton()
         self.main_page_button.setFixedSize(35, 35)
         self.main_page_button.setIconSize(QSize(30, 30))
-        self.main_page_button.setIcon(QIcon('icons/back.png'))
+        self.main_page_button.setIcon(assets.icon('back.png'))
         self.main_page_button.clicked.connect(self.show_main_page)
+        self.display_button = QToolButton()
+        self.display_button.setFixedSize(35, 35)
+        self.display_button.setIconSize(QSize(30, 30))
+        self.display_button.setIcon(assets.icon('application_view_list.png'))
+        self.display_button.setToolTip('Display window')
+        self.display_button.setCheckable(True)
+        self.display_button.toggled.connect(self.toggle_display_window)
         self.toolbar.layout().setContentsMargins(5, 0, 0, 0)
         self.toolbar.layout().addWidget(self.main_page_button)
         self.toolbar.layout().addWidget(self.nameLabel)
+        self.toolbar.layout().addWidget(self.display_button)
         self.main_widget = TournamentMainWidget(self)
         self.layout.addWidget(self.toolbar)
         self.layout.addWidget(self.main_widget)
-        self.widgets = {
-            'groups': GroupStageWidget(self),
-            'draw_groups': GroupDrawWidget(self),
-            'generate_matches': GenerateMatchesWidget(self),
-            'tournament_settings': TournamentSettingsWidget(self),
-            'ko_stage': KOStageWidget(self)
-        }
-        for widget_name in self.widgets:
-            self.layout.addWidget(self.widgets[widget_name])
-        self.widgets['tournament_settings'].tournament_updated.connect(self.update_tournament_settings)
-        self.widgets['draw_groups'].groups_drawn.connect(self.update_tournament_groups)
-        self.widgets['generate_matches'].match_generation_requested.connect(self.generate_matches)
-        self.widgets['groups'].match_edited.connect(self.update_match)
-        self.widgets['ko_stage'].match_edited.connect(self.update_match)
+        # pages are built on their first show and only refreshed while visible
+        self.widgets = {}
+        self.stale_pages = set()
         self.main_widget.button_clicked.connect(self.show_widget)
 
-        self.display_window = DisplayWindow(self)
-        self.display_window.show()
+        # the display window is opened on request and follows the tournament at its own pace
+        self.display_window = None
+        self.data_version = 0
+        self.display_version = None
+        self.display_timer = QTimer(self)
+        self.display_timer.setInterval(self.display_interval)
+        self.display_timer.timeout.connect(self.refresh_display)
 
         self.show_main_page()
 
+    def page(self, widget_name):
+        if widget_name not in self.widgets:
+            widget = self.page_types[widget_name](self)
+            widget.hide()
+            self.layout.addWidget(widget)
+            if widget_name == 'tournament_settings':
+                widget.tournament_updated.connect(self.update_tournament_settings)
+            elif widget_name == 'draw_groups':
+                widget.groups_drawn.connect(self.update_tournament_groups)
+            elif widget_name == 'generate_matches':
+                widget.match_generation_requested.connect(self.generate_matches)
+            elif widget_name in ('groups', 'ko_stage'):
+                widget.match_edited.connect(self.update_match)
+            self.widgets[widget_name] = widget
+            self.stale_pages.add(widget_name)
+        return self.widgets[widget_name]
+
     def show_main_page(self):
         for widget_name in self.widgets:
             self.widgets[widget_name].hide()
@@ -143,14 +172,28 @@ class TournamentWidget(QWidget):
         self.main_page_button.hide()
 
     def show_widget(self, widget_name):
-        if widget_name in self.widgets:
+        if widget_name in self.page_types:
+            widget = self.page(widget_name)
+            if widget_name in self.stale_pages and self.tournament is not None:
+                self.update_page(widget_name)
             self.main_widget.hide()
             self.main_page_button.show()
-            self.widgets[widget_name].show()
-
-    def set_tournament(self, tournament, db_teams=None, t_teams=None, groups=None, ko_stages=None, status=None):
+            widget.show()
+
+    @traced()
+    def set_tournament(self, tournament, db_teams=None, t_teams=None, groups=None, ko_stages=None, status=None,
+                       parts=ALL):
+        """ Show tournament, only the visible widgets depending on the given parts are updated, hidden
+        pages are updated when they are shown next."""
+        if parts == ALL:
+            # everything is set anew, pending refreshes would only load the same data again
+            self.refresh_scheduler.cancel()
         self.tournament = tournament
-        self.setStyleSheet(tournament['stylesheet'])
+        # restyling repolishes every child widget, only do it when the tournament theme changes
+        theme = compile_theme(tournament['stylesheet'])
+        if theme is not self.theme:
+            self.theme = theme
+            self.setStyleSheet(theme.sheet)
         self.nameLabel.setText(tournament['name'])
         if db_teams is None:
             db_teams = []
@@ -160,69 +203,147 @@ class TournamentWidget(QWidget):
             ko_stages = []
         self.db_teams = db_teams
         self.t_teams = t_teams
-        if groups is not None:
+        self.groups = groups
+        self.ko_stages = ko_stages
+        self.status = status
+        for widget_name in self.page_types:
+            if self.page_parts[widget_name] & parts:
+                self.stale_pages.add(widget_name)
+        for widget_name, widget in self.widgets.items():
+            if widget_name in self.stale_pages and widget.isVisible():
+                self.update_page(widget_name)
+        if parts & {GROUPS, KO, STATUS}:
+            # picked up by the next tick of the display timer
+            self.data_version += 1
+
+        if STATUS in parts and status is not None:
+            self.main_widget.set_status(status)
+
+    def annotate_qualification(self):
+        if self.status is not None and self.status['name'] != 'SETUP':
+            self.qualification.update(self.groups, ko_size(self.database.get_first_ko_stage(self.tournament['id'])))
+
+    @traced()
+    def update_page(self, widget_name):
+        self.stale_pages.discard(widget_name)
+        widget = self.page(widget_name)
+        status = self.status
+        if widget_name == 'generate_matches':
+            widget.set_stage(status)
+        if self.groups is None:
+            return
+        groups = self.groups
+        if widget_name == 'groups':
             try:
                 g_editable = status['name'] == 'GROUP'
             except KeyError:
                 g_editable = False
-            self.widgets['tournament_settings'].set_teams(t_teams=t_teams, db_teams=db_teams,
-                                                          group_size=groups[0]['size'] if len(groups) > 0 else None,
-                                                          tournament=tournament, status=status)
-            self.widgets['groups'].set_groups(groups, editable=g_editable)
-            self.widgets['draw_groups'].set_groups_and_teams(groups, t_teams)
-            self.widgets['ko_stage'].set_stages(ko_stages, status)
-
-            self.display_window.set_data(groups, ko_stages, status)
-
-        self.widgets['generate_matches'].set_stage(status)
-        if status is not None:
-            self.main_widget.set_status(status)
+            self.annotate_qualification()
+            widget.set_groups(groups, editable=g_editable)
+        elif widget_name == 'tournament_settings':
+            widget.set_teams(t_teams=self.t_teams, db_teams=self.db_teams,
+                             group_size=groups[0]['size'] if len(groups) > 0 else None,
+                             tournament=self.tournament, status=status)
+        elif widget_name == 'draw_groups':
+            draw_info = self.database.get_draw_info(self.tournament['id']) \
+                if status is not None and status['current_stage'] == 0 else None
+            widget.set_groups_and_teams(groups, self.t_teams, draw_info=draw_info)
+        elif widget_name == 'ko_stage':
+            widget.set_stages(self.ko_stages, status)
+
+    def toggle_display_window(self, checked):
+        if checked:
+            if self.display_window is None:
+                self.display_window = DisplayWindow(self)
+                self.display_window.closed.connect(lambda: self.display_button.setChecked(False))
+            self.display_window.show()
+            self.display_version = None
+            self.refresh_display()
+            self.display_timer.start()
+        else:
+            self.display_timer.stop()
+            if self.display_window is not None:
+                self.display_window.hide()
+
+    @traced()
+    def refresh_display(self):
+        """ Called every display_interval while the display window is open, redraws it if the data changed."""
+        if self.display_window is None or not self.display_window.isVisible() or self.groups is None:
+            return
+        if self.display_version == self.data_version:
+            return
+        self.display_version = self.data_version
+        self.annotate_qualification()
+        status = self.status
+        score_data = self.database.get_score_model_data(self.tournament['id']) \
+            if simulation.available() and status is not None and status['name'] != 'SETUP' else None
+        self.display_window.set_data(self.groups, self.ko_stages, status, score_data=score_data)
+
+    @traced()
+    def refresh_tournament(self, parts):
+        """ Reload the dirty parts from the database and update the widgets showing them."""
+        tournament_id = self.tournament['id']
+        if TEAMS in parts:
+            db_teams = self.database.get_teams()
+            for t in self.database.read_data(['Tournaments'])['Tournaments']:
+                if t['id'] == tournament_id:
+                    self.tournament = t
+            t_teams = self.database.get_tournament_teams(tournament_id)
+        else:
+            db_teams = self.db_teams
+            t_teams = self.t_teams
+        ko_stages = self.database.get_tournament_ko_stages(tournament_id) if KO in parts else self.ko_stages
+        groups = self.database.get_tournament_groups(tournament_id) if GROUPS in parts else self.groups
+        status = self.database.get_tournament_status(tournament_id) if STATUS in parts else self.status
+        self.set_tournament(self.tournament, db_teams=db_teams, t_teams=t_teams, groups=groups,
+                            ko_stages=ko_stages, status=status, parts=parts)
 
     def update_tournament(self):
-        db_teams = self.database.get_teams()
-        data = self.database.read_data(['Tournaments'])
-        for t in data['Tournaments']:
-            if t['id'] == self.tournament['id']:
-                self.tournament = t
-        t_teams = self.database.get_tournament_teams(self.tournament['id'])
-        ko_stages = self.database.get_tournament_ko_stages(self.tournament['id'])
-        groups = self.database.get_tournament_groups(self.tournament['id'])
-        status = self.database.get_tournament_status(self.tournament['id'])
-        self.set_tournament(self.tournament, db_teams=db_teams,
-                            t_teams=t_teams, groups=groups, ko_stages=ko_stages, status=status)
+        self.refresh_tournament(ALL)
 
     def update_tournament_teams(self, teams, changed=False):
         if changed:
             self.database.update_tournament_teams(self.tournament['id'], teams)
             self.database.remote_queue.execute_updates()
-            self.update_tournament()
+            self.refresh_scheduler.mark(*ALL)
         self.show_main_page()
 
     def update_tournament_settings(self, data):
         if 'teams' in data:
             self.database.update_tournament_teams(self.tournament['id'], data['teams'], data['num_teams'])
             self.database.update_tournament_stages(self.tournament['id'], data['num_teams'], data['group_size'],
-                                                   data['teams_in_ko'])
+                                                   data['teams_in_ko'], data.get('ko_mode', 'single'))
         self.database.remote_queue.execute_updates()
-        self.update_tournament()
+        self.refresh_scheduler.mark(*ALL)
         self.show_main_page()
 
+    @traced()
     def update_tournament_groups(self, groups):
         self.database.update_tournament_groups(self.tournament['id'], groups)
         self.database.remote_queue.execute_updates()
-        self.update_tournament()
+        self.refresh_scheduler.mark(GROUPS, STATUS)
         self.show_main_page()
 
+    @traced()
     def generate_matches(self, data):
         self.database.generate_matches(self.tournament['id'], data)
         self.database.remote_queue.execute_updates()
-        self.update_tournament()
+        self.refresh_scheduler.mark(GROUPS, KO, STATUS)
         self.show_main_page()
 
+    @traced()
     def update_match(self, match):
-        self.database.update_match(match)
+        try:
+            self.database.update_match(match)
+        except BracketError as ex:
+            QMessageBox.warning(self, 'Edit Match', str(ex))
+            # the dialog already wrote the rejected result into the shown match
+            self.refresh_scheduler.mark(GROUPS, KO)
+            return
         self.database.remote_queue.execute_updates()
-        self.update_tournament()
+        group_match = any(m['id'] == match['id'] for g in self.groups or [] for m in g['matches'] or [])
+        # a finished KO match moves its winner on, the status may change with every result
+        self.refresh_scheduler.mark(GROUPS if group_match else KO, STATUS)
 
 
 class TournamentMainWidget(QWidget):
@@ -241,31 +362,32 @@ class TournamentMainWidget(QWidget):
         self.buttons = {
             'tournament_settings': {
                 'bt': QPushButton('Tournament Settings', self),
-                'icon': QIcon('icons/application_edit.png'),
+                'icon': assets.icon('application_edit.png'),
                 'enabled': lambda stage, name, status: True
                              },
             'groups': {
                 'bt': QPushButton('Groups', self),
-                'icon': QIcon('icons/table.png'),
+                'icon': assets.icon('table.png'),
                 'enabled': lambda stage, name, status: True
                 # always show, empty groups aren't a bad thing :P
                              },
             'draw_groups': {
                 'bt': QPushButton('Draw Groups', self),
-                'icon': QIcon('icons/application_side_boxes.png'),
+                'icon': assets.icon('application_side_boxes.png'),
                 'enabled': lambda stage, name, status: stage == 0 and status != TournamentStageStatus.INITIALIZED
                 # as soon as teams are complete, until matches are generated
                              },
             'generate_matches': {
                 'bt': QPushButton('Generate next Matches', self),
-                'icon': QIcon('icons/application_form.png'),
+                'icon': assets.icon('application_form.png'),
                 'enabled': lambda stage, name, status: status == TournamentStageStatus.COMPLETE
                                                        and not name.startswith('KO_FINAL_')
+                                                       and not name.startswith('DE')
                 # show if current stage is complete, but not the final stage
                              },
             'ko_stage': {
                 'bt': QPushButton('KO-Stage', self),
-                'icon': QIcon('icons/sitemap.png'),
+                'icon': assets.icon('sitemap.png'),
                 'enabled': lambda stage, name, status: True
                              },
         }
@@ -354,6 +476,101 @@ class TournamentSettingsWidget(QWidget):
         self.style().drawPrimitive(QStyle.PE_Widget,  opt,  p, self)
 
 
+class TeamNameModel(QStringListModel):
+    """ The names of all known teams after an empty first row, shared by the combo boxes of a
+    TeamSelectorWidget.
+
+    taken counts how many combo boxes show a name, a name changing between taken and free
+    emits dataChanged for its row only, so every AvailableTeamsProxy re-checks one row."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.names = []
+        self.rows = {}
+        self.taken = Counter()
+        self.used = {}
+        self.search = None
+        self.set_names([])
+
+    def set_names(self, names, used=None):
+        self.names = [''] + list(names)
+        self.rows = dict((name, row) for row, name in enumerate(self.names))
+        self.used = used or {}
+        self.search = None
+        self.setStringList(self.names)
+
+    def search_index(self):
+        """ The TeamSearchIndex of the names, built when the first search needs it."""
+        if self.search is None:
+            self.search = TeamSearchIndex()
+            for name in self.names[1:]:
+                self.search.add(name, self.used.get(name))
+        return self.search
+
+    def available(self, name, own):
+        return name in self.rows and (name == own or name not in self.taken)
+
+    def name_changed(self, name):
+        row = self.rows.get(name)
+        # the empty row is always shown and is the current row of every combo box, which would
+        # overwrite its text on dataChanged
+        if row:
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+    def take(self, name):
+        if name:
+            self.taken[name] += 1
+            if self.taken[name] == 1:
+                self.name_changed(name)
+
+    def give_back(self, name):
+        if name and self.taken[name] > 0:
+            self.taken[name] -= 1
+            if self.taken[name] == 0:
+                del self.taken[name]
+                self.name_changed(name)
+
+    def set_taken(self, names):
+        taken = Counter(name for name in names if name)
+        changed = set(self.taken).symmetric_difference(taken)
+        self.taken = taken
+        for name in changed:
+            self.name_changed(name)
+
+
+class AvailableTeamsProxy(QSortFilterProxyModel):
+    """ The names of a TeamNameModel that no other combo box has taken."""
+
+    def __init__(self, names, parent=None):
+        super().__init__(parent)
+        self.names = names
+        self.own = ''
+        self.setSourceModel(names)
+
+    def set_own(self, name):
+        if name != self.own:
+            old = self.own
+            self.own = name
+            self.names.name_changed(old)
+            self.names.name_changed(name)
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        name = self.names.names[source_row]
+        return name == self.own or name not in self.names.taken
+
+    def search(self, text, limit):
+        """ The available names best matching text, for FilteringComboBox."""
+        index = self.names.search_index()
+        # names taken by other boxes are skipped, so ask for a few more
+        names = index.search(text, limit + len(self.names.taken))
+        return [name for name in names if self.names.available(name, self.own)][:limit]
+
+    def touch(self, name):
+        if self.names.search is not None:
+            self.names.search.touch(name)
+
+
 class TeamSelectorWidget(QListWidget):
     def __init__(self, parent=None):
         super().__init__(parent=parent)
@@ -361,6 +578,7 @@ class TeamSelectorWidget(QListWidget):
         self.t_teams = []
         self.db_teams = []
         self.team_selection_enabled = True
+        self.team_names = TeamNameModel(self)
         sheet = WidgetTools.find_stylesheet(self, return_as_dict=True)
         self.number_color = None
         self.number_font_weight = None
@@ -380,17 +598,27 @@ class TeamSelectorWidget(QListWidget):
         for i in range(self.count()):
             self.itemWidget(self.item(i)).setEnabled(status)
 
+    def combo_boxes(self):
+        return [self.itemWidget(self.item(i)) for i in range(self.count())]
+
     def set_teams(self, db_teams, count, t_teams=None):
         self.t_teams = t_teams
         self.db_teams = db_teams
-        # clear old
-        while 0 < self.count():
+        while self.count() > count:
             self.remove_last_team_item()
         while count > self.count():
-            if t_teams is not None and len(t_teams) > self.count():
-                self.add_team_item(t_teams[self.count()]['name'])
-            else:
-                self.add_team_item()
+            self.add_team_item()
+        combo_boxes = self.combo_boxes()
+        for combo in combo_boxes:
+            combo.blockSignals(True)
+        names = [t['name'] for t in db_teams]
+        if names != self.team_names.names[1:]:
+            # resetting the model clears the line edits, the texts are set right after anyway
+            self.team_names.set_names(names, dict((t['name'], t.get('last_played')) for t in db_teams))
+        for i, combo in enumerate(combo_boxes):
+            combo.setCurrentIndex(0)
+            combo.setCurrentText(t_teams[i]['name'] if t_teams is not None and len(t_teams) > i else '')
+            combo.blockSignals(False)
         self.team_selected()
 
     def get_teams(self, none_on_no_change=False):
@@ -409,14 +637,19 @@ class TeamSelectorWidget(QListWidget):
         return teams
 
     def remove_last_team_item(self):
+        item = self.item(self.count()-1)
+        self.team_names.give_back(self.itemWidget(item).model().own)
+        # taking the item leaves its combo box alive, removing the item widget deletes it
+        self.removeItemWidget(item)
         self.takeItem(self.count()-1)
 
     def add_team_item(self, team_name=None):
         item = QListWidgetItem(self)
         team_item = FilteringComboBox(self)
+        team_item.setModel(AvailableTeamsProxy(self.team_names, team_item))
         if team_name is not None:
             team_item.setCurrentText(team_name)
-        team_item.currentTextChanged.connect(self.team_selected)
+        team_item.currentTextChanged.connect(lambda text, combo=team_item: self.slot_changed(combo, text))
         px = QPixmap(16, 16)
         px.fill(QColor(0, 0, 0, 0))
         painter = QPainter()
@@ -433,28 +666,53 @@ class TeamSelectorWidget(QListWidget):
         self.addItem(item)
         self.setItemWidget(item, team_item)
         item.setSizeHint(team_item.sizeHint())
+        self.slot_changed(team_item, team_item.currentText())
+
+    def slot_changed(self, combo, text):
+        """ Move the name taken by one combo box, the other boxes only re-check the rows involved."""
+        proxy = combo.model()
+        if text != '' and text != proxy.own and text in self.team_names.taken:
+            # the same team can't be entered twice
+            text += ' (2)'
+            combo.blockSignals(True)
+            combo.setCurrentText(text)
+            combo.blockSignals(False)
+        old = proxy.own
+        proxy.set_own(text)
+        self.team_names.give_back(old)
+        self.team_names.take(text)
+        self.reset_current_index(combo, text)
 
-    def team_selected(self):
-        selections = {}
-        for i in range(0, self.count()):
-            item = self.itemWidget(self.item(i))
+    @staticmethod
+    def reset_current_index(combo, text):
+        # a picked name becomes the current row of the combo box. Qt replaces the text of an editable
+        # combo box whenever its current row changes or disappears, so the current row is kept at the
+        # empty first row, which never does
+        if combo.currentIndex() != 0:
+            line_edit = combo.lineEdit()
+            position = line_edit.cursorPosition()
+            combo.blockSignals(True)
+            combo.setCurrentIndex(0)
+            combo.setEditText(text)
+            line_edit.setCursorPosition(position)
+            combo.blockSignals(False)
 
-            item.blockSignals(True)
-            if item.currentText() in selections.values() and item.currentText() != '':
-                selections[item] = item.currentText()+' (2)'
-            else:
-                selections[item] = item.currentText()
-            item.clear()
-            item.blockSignals(False)
-        for i in range(0, self.count()):
-            item = self.itemWidget(self.item(i))
-            item.blockSignals(True)
-            item.addItem('')
-            for t in self.db_teams:
-                if t['name'] not in selections.values() or selections[item] == t['name']:
-                    item.addItem(t['name'])
-            item.setCurrentText(selections[item])
-            item.blockSignals(False)
+    def team_selected(self):
+        """ Recount the names taken by all combo boxes."""
+        selected = set()
+        combo_boxes = self.combo_boxes()
+        for combo in combo_boxes:
+            text = combo.currentText()
+            if text != '' and text in selected:
+                text += ' (2)'
+                combo.blockSignals(True)
+                combo.setCurrentText(text)
+                combo.blockSignals(False)
+            selected.add(text)
+            combo.model().set_own(text)
+        self.team_names.set_taken(combo.model().own for combo in combo_boxes)
+        for combo in combo_boxes:
+            self.reset_current_index(combo, combo.model().own)
 
 
 class GroupDrawWidget(QWidget):
@@ -469,7 +727,7 @@ class GroupDrawWidget(QWidget):
         self.layout.setContentsMargins(0, 0, 0, 0)
         self.group_stage_widget = GroupStageWidget(parent=self, enable_drag_drop=True)
         self.team_list_widget = TeamDrawListWidget()
-        self.team_list_widget.list_empty_changed.connect(self.list_empty_changed)
+        self.team_list_widget.team_dropped.connect(lambda team: self.move_team(team, None))
         self.layout.addWidget(self.group_stage_widget)
         self.layout.addWidget(self.team_list_widget)
         self.v_layout.addLayout(self.layout)
@@ -477,56 +735,105 @@ class GroupDrawWidget(QWidget):
         self.accept_button.clicked.connect(self.draw_accepted)
         self.accept_button.setEnabled(False)
         self.auto_draw_button = QPushButton('Auto-Draw')
-        self.auto_draw_button.clicked.connect(self.auto_draw)
+        self.auto_draw_button.clicked.connect(lambda: self.auto_draw())
         self.v_layout.addLayout(self.h_layout)
         self.h_layout.addWidget(self.auto_draw_button)
         self.h_layout.addWidget(self.accept_button)
         self.setLayout(self.v_layout)
         self.t_teams = {}
-        self.g_teams = []
+        self.names = {}
         self.groups = {}
+        self.draw_info = None
+        self.state = DrawState([])
+        self.list_items = {}
+        self.seed = None
+
+    def slot_table(self, group):
+        return self.group_stage_widget.group_widgets[group].table
+
+    def auto_draw(self, seed=None):
+        """ Fill all empty slots at once, the same seed and starting state give the same draw."""
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        placed = draw_teams(self.state, self.draw_info, seed)
+        for team, (g, s) in placed:
+            self.slot_table(g).set_slot(s, team, self.names[team])
+        if self.state.complete():
+            self.team_list_widget.clear()
+            self.list_items = {}
+        else:
+            for team, position in placed:
+                self.take_list_item(team)
+        self.update_accept_button()
+
+    def move_team(self, team, target):
+        """ Move a dropped team to the target (group, slot) or back to the list (None)."""
+        source = self.state.position(team)
+        occupant = self.state.move(team, target)
+        if source is not None and occupant is None:
+            self.slot_table(source[0]).set_slot(source[1])
+        self.show_team(team)
+        if occupant is not None:
+            self.show_team(occupant)
+        self.update_accept_button()
+
+    def show_team(self, team):
+        position = self.state.position(team)
+        if position is None:
+            if team not in self.list_items:
+                self.add_list_item(team)
+        else:
+            self.take_list_item(team)
+            self.slot_table(position[0]).set_slot(position[1], team, self.names[team])
+
+    def add_list_item(self, team):
+        item = QListWidgetItem(self.names[team])
+        item.setData(Qt.UserRole, team)
+        self.team_list_widget.addItem(item)
+        self.list_items[team] = item
 
-    # not yet considering drawing-pots
-    def auto_draw(self):
-        for group_w in self.group_stage_widget.group_widgets:
-            for i in range(group_w.table.model().rowCount()):
-                # check if slot empty and teams left to fill it
-                if group_w.table.item(i, 0).text() == '' and self.team_list_widget.count() > 0:
-                    random_index = random.randrange(self.team_list_widget.count())
-                    group_w.table.setItem(i, 0, QTableWidgetItem(self.team_list_widget.item(random_index).icon(),
-                                                        self.team_list_widget.item(random_index).text()))
-                    self.team_list_widget.remove_item_by_text(self.team_list_widget.item(random_index).text())
+    def take_list_item(self, team):
+        item = self.list_items.pop(team, None)
+        if item is not None:
+            self.team_list_widget.takeItem(self.team_list_widget.row(item))
+
+    def update_accept_button(self):
+        self.accept_button.setEnabled(self.state.complete())
 
     def draw_accepted(self):
-        groups = self.group_stage_widget.get_groups()
-        for group in groups:
-            teams = group['teams']
-            team_ids = [self.t_teams[team] for team in teams]
-            group['teams'] = team_ids
-            group['id'] = self.groups[group['name']]
+        groups = []
+        for g, teams in enumerate(self.state.groups()):
+            table = self.slot_table(g)
+            name = table.model().headerData(0, Qt.Horizontal)
+            groups.append({'name': name, 'id': self.groups[name], 'teams': teams,
+                           'rounds': table.roundSpinBox.value()})
         self.groups_drawn.emit(groups)
 
-    def list_empty_changed(self, empty):
-        self.accept_button.setEnabled(empty)
-
-    def set_groups_and_teams(self, groups, t_teams):
+    @traced()
+    def set_groups_and_teams(self, groups, t_teams, draw_info=None):
+        self.draw_info = draw_info
         self.group_stage_widget.set_groups(groups, teams_only=True)
-        widget_group_teams = self.group_stage_widget.get_team_list()
-        self.t_teams = {}
-        self.g_teams = []
-        self.groups = {}
-        for g in groups:
-            self.groups[g['name']] = g['id']
-            for t in g['teams']:
-                self.g_teams.append(t['id'])
+        self.t_teams = dict((t['name'], t['id']) for t in t_teams)
+        self.names = dict((t['id'], t['name']) for t in t_teams)
+        self.groups = dict((g['name'], g['id']) for g in groups)
+        self.state = DrawState([max(g['size'], len(g['teams'])) for g in groups], self.names)
+        for g, group in enumerate(groups):
+            for s, t in enumerate(group['teams']):
+                self.names.setdefault(t['id'], t['name'])
+                self.state.move(t['id'], (g, s))
+        for g, group_w in enumerate(self.group_stage_widget.group_widgets):
+            group_w.table.group_index = g
+            try:
+                group_w.table.team_dropped.disconnect()
+            except TypeError:  # nothing connected
+                pass
+            group_w.table.team_dropped.connect(lambda team, g, s: self.move_team(team, (g, s)))
         self.team_list_widget.clear()
-        for t in t_teams:
-            self.t_teams[t['name']] = t['id']
-            if t['id'] not in self.g_teams and t['name'] not in widget_group_teams:
-                item = QListWidgetItem(t['name'])
-                self.team_list_widget.addItem(item)
-        if self.team_list_widget.count() == 0:
-            self.team_list_widget.list_empty_changed.emit(True)
+        self.list_items = {}
+        for team in self.state.unassigned:
+            self.add_list_item(team)
+        self.update_accept_button()
 
     def paintEvent(self, q_paint_event):
         opt = QStyleOption()
@@ -535,8 +842,19 @@ class GroupDrawWidget(QWidget):
         self.style().drawPrimitive(QStyle.PE_Widget,  opt,  p, self)
 
 
+class GroupPlaceholder(QWidget):
+    """ Keeps the place of a group in the flow layout, a GroupWidget is only attached while it is visible."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.group_widget = None
+
+
 class GroupStageWidget(QWidget):
     match_edited = pyqtSignal(dict)
+    # pixels above and below the viewport whose groups are materialised ahead of scrolling
+    overscan = 200
+    spare_widgets = 4
 
     def __init__(self, parent=None, enable_drag_drop=False, show_upcoming_games=False):
         super().__init__(parent=parent)
@@ -561,6 +879,21 @@ class GroupStageWidget(QWidget):
             self.layout().addWidget(self.scroll)
         self.group_widgets = []
         self.drag_drop_enabled = enable_drag_drop
+        # the draw reads the teams back from every table, so it keeps one widget per group,
+        # otherwise only the groups inside the viewport get a GroupWidget
+        self.virtual = not enable_drag_drop
+        self.groups = []
+        self.group_args = {'teams_only': False, 'editable': True}
+        self.placeholders = []
+        self.free_widgets = []
+        self.card_sizes = {}
+        self.update_timer = QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.timeout.connect(self.update_visible)
+        if self.virtual:
+            self.scroll.verticalScrollBar().valueChanged.connect(self.schedule_update)
+            self.scroll.viewport().installEventFilter(self)
+            self.widget.installEventFilter(self)
 
     def paintEvent(self, q_paint_event):
         opt = QStyleOption()
@@ -568,26 +901,133 @@ class GroupStageWidget(QWidget):
         p = QPainter(self)
         self.style().drawPrimitive(QStyle.PE_Widget,  opt,  p, self)
 
+    def eventFilter(self, obj, event):
+        if event.type() in (QEvent.Resize, QEvent.LayoutRequest):
+            self.schedule_update()
+        return False
+
+    @traced()
     def set_groups(self, groups, teams_only=False, editable=True):
-        if self.flow_layout.count() != len(groups):
-            for i in reversed(range(self.flow_layout.count())):
-                self.flow_layout.itemAt(i).widget().setParent(None)
-            self.group_widgets.clear()
-            for group in groups:
-                gw = GroupWidget(parent=self)
-                gw.match_edited.connect(self.match_edited)
-                if self.drag_drop_enabled:
-                    gw.table.setDefaultDropAction(Qt.MoveAction)
-                    gw.table.setDragDropMode(QAbstractItemView.DragDrop)
-                    gw.table.setDragDropOverwriteMode(False)
-                    gw.table.setDropIndicatorShown(False)
-                self.group_widgets.append(gw)
-                self.flow_layout.addWidget(gw)
+        if self.virtual:
+            self.set_virtual_groups(groups, teams_only, editable)
+            return
+        kind = 'draw_group_widget' if self.drag_drop_enabled else 'group_widget'
+        while len(self.group_widgets) > len(groups):
+            gw = self.group_widgets.pop()
+            self.flow_layout.removeWidget(gw)
+            signals = (gw.match_edited, gw.table.team_dropped) if self.drag_drop_enabled else (gw.match_edited,)
+            pool.release(kind, gw, signals=signals)
+        while len(self.group_widgets) < len(groups):
+            gw = pool.take(kind, self.create_group_widget)
+            gw.setParent(self.widget)
+            gw.match_edited.connect(self.match_edited)
+            self.group_widgets.append(gw)
+            self.flow_layout.addWidget(gw)
+            gw.show()
         i = 0
         for gw in self.group_widgets:
             gw.set_group(groups[i], teams_only=teams_only, editable=editable)
             i += 1
 
+    def create_group_widget(self):
+        gw = GroupWidget(draw=self.drag_drop_enabled)
+        if self.drag_drop_enabled:
+            gw.table.setDefaultDropAction(Qt.MoveAction)
+            gw.table.setDragDropMode(QAbstractItemView.DragDrop)
+            gw.table.setDragDropOverwriteMode(False)
+            gw.table.setDropIndicatorShown(False)
+        return gw
+
+    def set_virtual_groups(self, groups, teams_only, editable):
+        self.groups = groups
+        self.group_args = {'teams_only': teams_only, 'editable': editable}
+        if len(self.placeholders) != len(groups):
+            for placeholder in self.placeholders:
+                self.release_widget(placeholder)
+                self.flow_layout.removeWidget(placeholder)
+                placeholder.setParent(None)
+            self.placeholders = []
+            for group in groups:
+                placeholder = GroupPlaceholder(self.widget)
+                self.placeholders.append(placeholder)
+                self.flow_layout.addWidget(placeholder)
+        for placeholder, group in zip(self.placeholders, groups):
+            placeholder.setFixedSize(self.card_size(group))
+            if placeholder.group_widget is not None:
+                # unchanged rows don't cost anything, see MatchModel.set_matches
+                placeholder.group_widget.set_group(group, **self.group_args)
+        self.schedule_update()
+
+    def card_size(self, group):
+        """ Size of the GroupWidget of group, measured once per number of rows."""
+        key = (max(group['size'], len(group['teams'])), len(group['matches'] or []),
+               self.group_args['teams_only'], self.group_args['editable'])
+        if key not in self.card_sizes:
+            gw = self.take_widget()
+            gw.set_group(group, **self.group_args)
+            self.card_sizes[key] = gw.sizeHint()
+            self.free_widgets.append(gw)
+        return self.card_sizes[key]
+
+    def take_widget(self):
+        if self.free_widgets:
+            return self.free_widgets.pop()
+        gw = pool.take('group_widget', self.create_group_widget)
+        gw.setParent(self.widget)
+        gw.hide()
+        gw.match_edited.connect(self.match_edited)
+        gw.ensurePolished()
+        self.group_widgets.append(gw)
+        return gw
+
+    def release_widget(self, placeholder):
+        gw = placeholder.group_widget
+        if gw is None:
+            return
+        gw.hide()
+        gw.setParent(self.widget)
+        placeholder.group_widget = None
+        self.free_widgets.append(gw)
+
+    def schedule_update(self):
+        if self.virtual and not self.update_timer.isActive():
+            self.update_timer.start(0)
+
+    @traced()
+    def update_visible(self):
+        """ Attach GroupWidgets to the placeholders intersecting the viewport and give back the others."""
+        viewport = self.scroll.viewport()
+        top = self.scroll.verticalScrollBar().value()
+        visible = QRect(0, top - self.overscan, viewport.width(), viewport.height() + 2 * self.overscan)
+        hidden = []
+        shown = []
+        for placeholder, group in zip(self.placeholders, self.groups):
+            if placeholder.geometry().intersects(visible):
+                if placeholder.group_widget is None:
+                    shown.append((placeholder, group))
+            else:
+                hidden.append(placeholder)
+        # give back first, so scrolling reuses the widgets that just left the viewport
+        for placeholder in hidden:
+            self.release_widget(placeholder)
+        for placeholder, group in shown:
+            gw = self.take_widget()
+            gw.setParent(placeholder)
+            gw.set_group(group, **self.group_args)
+            gw.setGeometry(0, 0, placeholder.width(), placeholder.height())
+            gw.show()
+            placeholder.group_widget = gw
+        # keep a few spare widgets for scrolling, the rest can serve other views
+        while len(self.free_widgets) > self.spare_widgets:
+            gw = self.free_widgets.pop()
+            self.group_widgets.remove(gw)
+            pool.release('group_widget', gw, signals=(gw.match_edited,))
+
+    def visible_group_widgets(self):
+        if not self.virtual:
+            return list(self.group_widgets)
+        return [p.group_widget for p in self.placeholders if p.group_widget is not None]
+
     def get_groups(self):
         groups = []
         for w in self.group_widgets:
@@ -600,18 +1040,9 @@ class GroupStageWidget(QWidget):
                            'teams': group, 'rounds': w.table.roundSpinBox.value()})
         return groups
 
-    def get_team_list(self):
-        teams = []
-        for w in self.group_widgets:
-            for r in range(w.table.rowCount()):
-                item = w.table.item(r, 0)
-                if item is not None and item.text() is not '':
-                    teams.append(item.text())
-        return teams
-
     def show(self):
         super().show()
-        for gw in self.group_widgets:
+        for gw in self.visible_group_widgets():
             gw.table.recalculate_size()
 
 
@@ -621,16 +1052,25 @@ class KOStageWidget(QWidget):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.flow_layout = FlowLayout()
+        self.lower_flow_layout = FlowLayout()
+        self.lower_bracket_label = QLabel('Lower Bracket')
+        self.box_layout = QVBoxLayout()
+        self.box_layout.addLayout(self.flow_layout)
+        self.box_layout.addWidget(self.lower_bracket_label)
+        self.box_layout.addLayout(self.lower_flow_layout)
+        self.box_layout.addStretch()
         self.widget = QWidget(self)
         self.scroll = QScrollArea()
         self.scroll.setWidget(self.widget)
         self.scroll.setWidgetResizable(True)
         self.widget.setProperty('bg_img', 'true')
-        self.widget.setLayout(self.flow_layout)
+        self.widget.setLayout(self.box_layout)
         self.grid_layout = QGridLayout()
         self.grid_layout.setContentsMargins(0, 0, 0, 0)
         self.setLayout(self.grid_layout)
         self.stage_containers = []
+        self.lower_stage_containers = []
+        self.lower_bracket_label.hide()
 
         self.layout().addWidget(self.scroll)
 
@@ -650,28 +1090,70 @@ class KOStageWidget(QWidget):
         stage_name = stage_name.replace('KO_FINAL_1', 'Final')
         return stage_name
 
+    @staticmethod
+    def get_bracket_round_name(bracket, rnd, team_count):
+        upper_rounds = int(math.log2(team_count))
+        if bracket == 'F':
+            return 'Grand Final'
+        elif bracket == 'U':
+            return 'Upper Final' if rnd == upper_rounds else 'Upper Round %r' % rnd
+        else:
+            return 'Lower Final' if rnd == 2 * (upper_rounds - 1) else 'Lower Round %r' % rnd
+
+    @staticmethod
+    def split_bracket_rounds(stage):
+        # double elimination stages are shown as one container per bracket round,
+        # upper rounds and the grand final in the upper flow, lower rounds in the lower flow
+        rounds = OrderedDict()
+        for match in stage['matches']:
+            key = (match['bracket'], match['round'])
+            if key not in rounds:
+                rounds[key] = []
+            rounds[key].append(match)
+        order = {'U': 0, 'F': 1, 'L': 2}
+        return [(key, rounds[key]) for key in sorted(rounds, key=lambda k: (order[k[0]], k[1]))]
+
+    @traced()
     def set_stages(self, stages, status, editable=None):
-        if len(stages) != self.flow_layout.count():
-            for i in reversed(range(self.flow_layout.count())):
-                self.flow_layout.itemAt(i).widget().setParent(None)
-            self.stage_containers.clear()
-            for stage in stages:
-                sw = KOStageContainerWidget(self)
-                sw.match_edited.connect(self.match_edited)
-                self.stage_containers.append(sw)
-                self.flow_layout.addWidget(sw)
-        i = 0
+        upper = []
+        lower = []
         for stage in stages:
-            group = {'matches': stages[stage]['matches']}
             can_edit = status['current_stage_id'] == stages[stage]['tournament_stage'] or \
                        (status['current_stage_id'] == (stages[stage]['tournament_stage'] + 1) and
                         status['name'] == 'KO_FINAL_1') or \
                        (status['current_stage_id'] == (stages[stage]['tournament_stage'] - 1) and
                         status['name'] == 'KO_FINAL_3') if editable is None else editable
-
-            self.stage_containers[i].set_group(group, editable=can_edit)
-            self.stage_containers[i].set_title(self.get_stage_name(stages[stage]['name']))
-            i += 1
+            if stages[stage]['name'].startswith('DE'):
+                team_count = int(stages[stage]['name'][2:])
+                for (bracket, rnd), matches in self.split_bracket_rounds(stages[stage]):
+                    entry = ({'matches': matches}, self.get_bracket_round_name(bracket, rnd, team_count), can_edit)
+                    if bracket == 'L':
+                        lower.append(entry)
+                    else:
+                        upper.append(entry)
+            else:
+                upper.append(({'matches': stages[stage]['matches']},
+                              self.get_stage_name(stages[stage]['name']), can_edit))
+
+        self.fill_flow(self.flow_layout, self.stage_containers, upper)
+        self.fill_flow(self.lower_flow_layout, self.lower_stage_containers, lower)
+        self.lower_bracket_label.setVisible(len(lower) > 0)
+
+    def fill_flow(self, flow_layout, containers, entries):
+        while len(containers) > len(entries):
+            sw = containers.pop()
+            flow_layout.removeWidget(sw)
+            pool.release('ko_stage_container', sw, signals=(sw.match_edited,))
+        while len(containers) < len(entries):
+            sw = pool.take('ko_stage_container', KOStageContainerWidget)
+            sw.setParent(self.widget)
+            sw.match_edited.connect(self.match_edited)
+            containers.append(sw)
+            flow_layout.addWidget(sw)
+            sw.show()
+        for container, (group, title, can_edit) in zip(containers, entries):
+            container.set_group(group, editable=can_edit)
+            container.set_title(title)
 
 
 class KOStageContainerWidget(QFrame):
@@ -688,21 +1170,26 @@ class KOStageContainerWidget(QFrame):
         self.layout().addWidget(self.stage_title_label)
         self.layout().addWidget(self.match_table)
 
+    @traced()
     def set_group(self, group, editable=False):
         self.match_table.set_group(group, editable)
 
     def set_title(self, title):
         self.stage_title_label.setText(title)
 
+    def reset_state(self):
+        self.match_table.reset_state()
+
 
 class GroupWidget(QFrame):
     match_edited = pyqtSignal(dict)
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, draw=False):
         super().__init__(parent)
         self.setLayout(QVBoxLayout())
         # self.setProperty('bg_img', 'true')
-        self.table = GroupTable(parent=self, )
+        # the draw moves teams between tables, the standings are read only
+        self.table = DrawGroupTable(parent=self) if draw else GroupTable(parent=self)
         self.match_table = MatchTable(parent=self)
         self.match_table.match_edited.connect(self.match_edited)
         self.layout().addWidget(self.table)
@@ -711,33 +1198,168 @@ class GroupWidget(QFrame):
         self.setFrameShadow(QFrame.Sunken)
         # self.match_table.hide()
 
+    @traced()
     def set_group(self, group, teams_only=False, editable=False):
         self.table.set_group(group, teams_only=teams_only)
         self.match_table.set_group(group, editable=editable)
 
+    def reset_state(self):
+        self.match_table.reset_state()
+
+
+def row_ranges(rows):
+    """ Contiguous (first, last) ranges of sorted row numbers."""
+    ranges = []
+    for row in rows:
+        if ranges and ranges[-1][1] == row - 1:
+            ranges[-1][1] = row
+        else:
+            ranges.append([row, row])
+    return ranges
+
+
+class MatchModel(QAbstractTableModel):
+    default_highlight_color = QColor(193, 8, 38)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.matches = []
+        self.rows = {}
+        self.editable = False
+        self.highlight_color = self.default_highlight_color
+
+    @staticmethod
+    def display_row(match):
+        return (match['team1'], '-', match['team2'],
+                str(match['team1_score']) if str(match['team1_score']) != '' else '-', ':',
+                str(match['team2_score']) if str(match['team2_score']) != '' else '-', match['status'])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.matches)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 7 if self.editable else 6
+
+    def data(self, index, role=Qt.DisplayRole):
+        column = index.column()
+        if column > 5:
+            return 'Edit match' if role == Qt.ToolTipRole else None
+        match = self.matches[index.row()]
+        if role == Qt.DisplayRole:
+            return self.display_row(match)[column]
+        if role == Qt.TextAlignmentRole:
+            if column in (0, 3):
+                return Qt.AlignRight | Qt.AlignVCenter
+            if column in (1, 4):
+                return Qt.AlignHCenter | Qt.AlignVCenter
+            return Qt.AlignLeft | Qt.AlignVCenter
+        if role == Qt.ForegroundRole and match['status'] == 1:
+            return self.highlight_color
+        return None
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled
+
+    def set_highlight_color(self, color):
+        """ The colour of the matches in progress, None for the default."""
+        color = color if color is not None else self.default_highlight_color
+        if color == self.highlight_color:
+            return
+        self.highlight_color = color
+        for row, match in enumerate(self.matches):
+            if match['status'] == 1:
+                self.dataChanged.emit(self.index(row, 0), self.index(row, 5), [Qt.ForegroundRole])
+
+    def match(self, match_id):
+        return self.matches[self.rows[match_id]]
+
+    def set_matches(self, matches, editable=False):
+        """ Returns True if the rows were replaced, otherwise only the changed rows are announced."""
+        if editable != self.editable or [m['id'] for m in matches] != [m['id'] for m in self.matches]:
+            self.beginResetModel()
+            self.matches = list(matches)
+            self.rows = dict((m['id'], row) for row, m in enumerate(self.matches))
+            self.editable = editable
+            self.endResetModel()
+            return True
+        changed = [row for row, m in enumerate(matches) if self.display_row(m) != self.display_row(self.matches[row])]
+        self.matches = list(matches)
+        for first, last in row_ranges(changed):
+            self.dataChanged.emit(self.index(first, 0), self.index(last, self.columnCount() - 1))
+        return False
+
+
+class EditButtonDelegate(QStyledItemDelegate):
+    """ Paints an edit button into every cell of its column and reports clicks on it."""
+    clicked = pyqtSignal(QModelIndex)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pressed = None
+
+    @staticmethod
+    def button_rect(rect):
+        size = QSize(min(rect.width() - 2, 26), min(rect.height() - 2, 22))
+        return QStyle.alignedRect(Qt.LeftToRight, Qt.AlignCenter, size, rect)
+
+    def paint(self, painter, option, index):
+        button = QStyleOptionButton()
+        button.rect = self.button_rect(option.rect)
+        button.icon = assets.icon('pencil.png')
+        button.iconSize = QSize(16, 16)
+        button.state = QStyle.State_Enabled
+        if self.pressed is not None and self.pressed == index:
+            button.state |= QStyle.State_Sunken
+        elif option.state & QStyle.State_MouseOver:
+            button.state |= QStyle.State_MouseOver
+        else:
+            button.state |= QStyle.State_Raised
+        widget = option.widget
+        style = widget.style() if widget is not None else QApplication.style()
+        style.drawControl(QStyle.CE_PushButton, button, painter, widget)
+
+    def sizeHint(self, option, index):
+        return QSize(26, 22)
+
+    def editorEvent(self, event, model, option, index):
+        inside = event.type() in (QEvent.MouseButtonPress, QEvent.MouseButtonRelease) and \
+            self.button_rect(option.rect).contains(event.pos())
+        if event.type() == QEvent.MouseButtonPress and event.button() == Qt.LeftButton and inside:
+            self.pressed = QPersistentModelIndex(index)
+            option.widget.viewport().update(option.rect)
+            return True
+        if event.type() == QEvent.MouseButtonRelease and self.pressed is not None:
+            was_pressed = self.pressed == index
+            self.pressed = None
+            option.widget.viewport().update(option.rect)
+            if was_pressed and inside:
+                self.clicked.emit(index)
+            return True
+        return False
+
 
-class MatchTable(QTableWidget):
+class MatchTable(QTableView):
     match_edited = pyqtSignal(dict)
 
     def __init__(self, parent=None):
         super().__init__(parent=parent)
+        self.setModel(MatchModel(self))
         self.verticalHeader().setDefaultSectionSize(20)
-        self.horizontalHeader().sectionPressed.disconnect()
         self.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.horizontalHeader().hide()
-        self.verticalHeader().sectionPressed.disconnect()
         self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.verticalHeader().hide()
         self.setFocusPolicy(Qt.NoFocus)
         self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
         self.setShowGrid(False)
         self.setFrameStyle(QFrame.NoFrame)
+        self.setMouseTracking(True)
         self.dialog = None
-        self.highlight_color = QColor(193, 8, 38)
-        sheet = WidgetTools.find_stylesheet(self, return_as_dict=True)
-        if '*[highlighted]' in sheet.keys():
-            if 'color' in sheet['*[highlighted]'].keys():
-                self.highlight_color = WidgetTools.css_color_to_rgb(sheet['*[highlighted]']['color'])
+        # the edit column is painted, no widgets per row
+        self.edit_delegate = EditButtonDelegate(self)
+        self.edit_delegate.clicked.connect(self.edit_match)
+        self.setItemDelegateForColumn(6, self.edit_delegate)
 
         self.setProperty('transp_bg', 'true')
         # self.setStyleSheet('background-color: rgba(255,255,255,0)')
@@ -760,77 +1382,167 @@ class MatchTable(QTableWidget):
                     "background-color:white;"
                     "}")
 
+    def update_highlight_color(self):
+        # pooled tables are built without a parent and move between tournaments, so the
+        # colour comes from the stylesheets of the current parents
+        sheet = WidgetTools.find_stylesheet(self, return_as_dict=True)
+        color = sheet.get('*[highlighted]', {}).get('color')
+        self.model().set_highlight_color(WidgetTools.css_color_to_rgb(color) if color else None)
+
+    @traced()
     def set_group(self, group, editable=False):
+        self.update_highlight_color()
         matches = group['matches'] if group['matches'] is not None else []
-        self.clear()
+        if not self.model().set_matches(matches, editable):
+            return
 
-        #print('update', matches)
-        self.setColumnCount(7 if editable else 6)
-        self.setRowCount(len(matches))
-        self.setColumnWidth(0, 140 if editable else 150)
-        self.setColumnWidth(1, 10)
-        self.setColumnWidth(2, 140 if editable else 150)
-        self.setColumnWidth(3, 20)
-        self.setColumnWidth(4, 10)
-        self.setColumnWidth(5, 20)
-        if editable:
-            self.setColumnWidth(6, 20)
-        row = 0
-        for match in matches:
-            self.setItem(row, 0, QTableWidgetItem(match['team1']))
-            self.item(row, 0).setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
-            self.setItem(row, 1, QTableWidgetItem('-'))
-            self.item(row, 1).setTextAlignment(Qt.AlignHCenter | Qt.AlignVCenter)
-            self.setItem(row, 2, QTableWidgetItem(match['team2']))
-            self.setItem(row, 3, QTableWidgetItem(str(match['team1_score'])
-                                                  if str(match['team1_score']) != '' else '-'))
-
-            self.item(row, 3).setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
-            self.setItem(row, 4, QTableWidgetItem(':'))
-
-            self.item(row, 4).setTextAlignment(Qt.AlignHCenter | Qt.AlignVCenter)
-            self.setItem(row, 5, QTableWidgetItem(str(match['team2_score'])
-                                                  if str(match['team2_score']) != '' else '-'))
-            if editable:
-                button_widget = QWidget()
-                btn_edit = QPushButton()
-                btn_edit.setIcon(QIcon('icons/pencil.png'))
-                btn_edit.setProperty('match', match)
-                btn_edit.clicked.connect(self.edit_match)
-                button_layout = QHBoxLayout(button_widget)
-                button_layout.addWidget(btn_edit)
-                button_layout.setAlignment(Qt.AlignCenter)
-                button_layout.setContentsMargins(0, 0, 0, 0)
-                button_widget.setLayout(button_layout)
-                self.setCellWidget(row, 6, button_widget)
-            for c in range(0, 6):
-                if match['status'] == 1:
-                    self.item(row, c).setForeground(self.highlight_color)
-                self.item(row, c).setFlags(self.item(row, c).flags() ^ Qt.ItemIsSelectable)
-                self.item(row, c).setFlags(self.item(row, c).flags() ^ Qt.ItemIsEditable)
-            row += 1
+        widths = [140 if editable else 150, 10, 140 if editable else 150, 20, 10, 20] + ([20] if editable else [])
+        for column, width in enumerate(widths):
+            self.setColumnWidth(column, width)
 
-        width = 4
-        height = 4
-        for column in range(self.model().columnCount()):
-            width += self.columnWidth(column)
-        for row in range(self.model().rowCount()):
-            height += self.rowHeight(row)
-        self.setMinimumWidth(width)
+        # all rows and columns have fixed sizes, the header may have widened narrow columns though
+        height = 4 + len(matches) * (self.rowHeight(0) if matches else 0)
+        self.setMinimumWidth(4 + sum(self.columnWidth(column) for column in range(len(widths))))
         self.setMinimumHeight(height)
         self.setMaximumHeight(height)
 
-    def edit_match(self):
-        self.dialog = EditMatchDialog(self.sender().property('match'), parent=self)
+    def edit_match(self, index):
+        self.dialog = EditMatchDialog(self.model().matches[index.row()], parent=self)
         self.dialog.match_updated.connect(self.match_edited)
         self.dialog.show()
 
+    def reset_state(self):
+        # a dialog left open would edit a match of whatever the table shows next
+        if self.dialog is not None:
+            self.dialog.close()
+            self.dialog = None
+
+
+class StandingsModel(QAbstractTableModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.headers = ['', 'G', 'W', 'L', 'BD']
+        self.teams = []
+        self.row_count = 0
+        self.teams_only = False
+
+    @staticmethod
+    def display_row(team):
+        if team is None:
+            return None
+        return (team['name'], str(team['games']), str(team['won']), str(team['lost']),
+                '%r:%r' % (team['score'], team['conceded']), team.get('qualification'))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.row_count
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 1 if self.teams_only else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        row = index.row()
+        if row >= len(self.teams):
+            return None
+        team = self.teams[row]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            return self.display_row(team)[column]
+        if column != 0:
+            return None
+        if role == Qt.DecorationRole:
+            return assets.team_icon(team['name'])
+        qualification = team.get('qualification')
+        if role == Qt.FontRole and qualification == CLINCHED:
+            font = QFont()
+            font.setBold(True)
+            return font
+        if role == Qt.ForegroundRole and qualification == ELIMINATED:
+            return QColor('gray')
+        if role == Qt.ToolTipRole and qualification in (CLINCHED, ELIMINATED):
+            return 'qualified' if qualification == CLINCHED else 'eliminated'
+        return None
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled
+
+    def set_group(self, group, teams_only=False):
+        """ Returns (rows replaced, anything changed)."""
+        teams = list(group['teams'])
+        if group['name'] != self.headers[0]:
+            self.headers[0] = group['name']
+            self.headerDataChanged.emit(Qt.Horizontal, 0, 0)
+        row_count = max(group['size'], len(teams))
+        if teams_only != self.teams_only or row_count != self.row_count:
+            self.beginResetModel()
+            self.teams = teams
+            self.row_count = row_count
+            self.teams_only = teams_only
+            self.endResetModel()
+            return True, True
+        old = [self.display_row(t) for t in self.teams]
+        changed = [row for row, team in enumerate(teams) if row >= len(old) or self.display_row(team) != old[row]]
+        changed += range(len(teams), len(old))
+        self.teams = teams
+        for first, last in row_ranges(changed):
+            self.dataChanged.emit(self.index(first, 0), self.index(last, self.columnCount() - 1))
+        return False, len(changed) > 0
+
+
+class GroupTable(QTableView):
+    def __init__(self, parent=None):
+        super().__init__(parent=parent)
+        self.setModel(StandingsModel(self))
+        self.setAttribute(Qt.WA_TranslucentBackground)
+        self.verticalHeader().setDefaultSectionSize(20)
+        self.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.horizontalHeader().setSectionsClickable(False)
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.verticalHeader().setSectionsClickable(False)
+        self.setFocusPolicy(Qt.NoFocus)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setFrameStyle(QFrame.NoFrame)
+        self.total_column_width = 350
+
+    @traced()
+    def set_group(self, group, teams_only=False):
+        reset, changed = self.model().set_group(group, teams_only=teams_only)
+        if reset:
+            for column, width in enumerate([250, 20, 20, 20, 40][:self.model().columnCount()]):
+                self.setColumnWidth(column, width)
+        if changed:
+            self.recalculate_size()
+
+    def recalculate_size(self):
+        resizable_width = 0
+        for i in range(1, self.model().columnCount()):
+            self.resizeColumnToContents(i)
+            resizable_width += self.columnWidth(i)
+
+        self.setColumnWidth(0, self.total_column_width-resizable_width)
+        # all rows have the same fixed height
+        width = self.verticalHeader().width() + 4 + self.total_column_width
+        height = self.horizontalHeader().height() + 4 + \
+            self.model().rowCount() * (self.rowHeight(0) if self.model().rowCount() else 0)
+        self.setMinimumWidth(width)
+        self.setMinimumHeight(height)
+        self.setMaximumHeight(height)
+
+
+class DrawGroupTable(QTableWidget):
+    # team id, group index, row
+    team_dropped = pyqtSignal(int, int, int)
 
-class GroupTable(QTableWidget):
     def __init__(self, parent=None):
         super().__init__(parent=parent)
         self.setAttribute(Qt.WA_TranslucentBackground)
         self.team_count = 0
+        self.group_index = -1
         self.verticalHeader().setDefaultSectionSize(20)
         self.horizontalHeader().sectionPressed.disconnect()
         self.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
@@ -852,9 +1564,11 @@ class GroupTable(QTableWidget):
             self.setColumnWidth(3, 20)
             self.setColumnWidth(4, 40)
         else:
-            self.roundSpinBox = QSpinBox(self)
-            self.roundSpinBox.setMinimum(1)
-            self.roundSpinBox.setToolTip('Number of rounds for this group')
+            if self.roundSpinBox is None:
+                self.roundSpinBox = QSpinBox(self)
+                self.roundSpinBox.setMinimum(1)
+                self.roundSpinBox.setToolTip('Number of rounds for this group')
+            self.roundSpinBox.setValue(1)
             self.setColumnCount(1)
             self.setHorizontalHeaderLabels([group['name']])
         self.setColumnWidth(0, 250)
@@ -863,10 +1577,9 @@ class GroupTable(QTableWidget):
 
         row = 0
         for team in group['teams']:
-            icon_path = 'icons/%s.png' % team['name']
-            # if not os.path.isfile(os.path.abspath(icon_path)):
-            #    icon_path = 'icons/trophy.png'
-            self.setItem(row, 0, QTableWidgetItem(QIcon(icon_path), team['name']))
+            self.setItem(row, 0, QTableWidgetItem(assets.team_icon(team['name']), team['name']))
+            if 'id' in team:
+                self.item(row, 0).setData(Qt.UserRole, team['id'])
             if not teams_only:
                 self.setItem(row, 1, QTableWidgetItem(str(team['games'])))
                 self.setItem(row, 2, QTableWidgetItem(str(team['won'])))
@@ -900,69 +1613,28 @@ class GroupTable(QTableWidget):
         self.setMinimumHeight(height)
         self.setMaximumHeight(height)
 
-    def switch_item(self, original, new, icon=None, internal_switch=False):
-        if internal_switch:
-            idx1, idx2 = -1, -1
-            for i in range(self.rowCount()):
-                if self.item(i, 0) is not None:
-                    if self.item(i, 0).text() == original:
-                        idx1 = i
-                    elif self.item(i, 0).text() == new:
-                        idx2 = i
-            if idx1 > -1 and idx2 > -1:
-                cp_o = QTableWidgetItem(self.item(idx1, 0).icon(), self.item(idx1, 0).text())
-                self.setItem(idx1, 0, QTableWidgetItem(self.item(idx2, 0).icon(), self.item(idx2, 0).text()))
-                self.setItem(idx2, 0, cp_o)
-                return True
+    def set_slot(self, row, team=None, name=''):
+        """ Show team in row, an empty slot if team is None."""
+        if team is None:
+            item = QTableWidgetItem()
+            item.setFlags(item.flags() ^ Qt.ItemIsEditable)
+            item.setFlags(item.flags() ^ Qt.ItemIsSelectable)
         else:
-            for i in range(self.rowCount()):
-                if self.item(i, 0) is not None and self.item(i, 0).text() == original:
-                    self.item(i, 0).setText(new)
-                    if icon is not None:
-                        self.item(i, 0).setIcon(icon)
-                    return True
-        return False
-
-    def remove_item_by_text(self, text):
-        for i in range(self.team_count):
-            if self.item(i, 0) is not None:
-                if self.item(i, 0).text() == text:
-                    self.setItem(i, 0, QTableWidgetItem())
-                    self.item(i, 0).setFlags(self.item(i, 0).flags() ^ Qt.ItemIsEditable)
-                    self.item(i, 0).setFlags(self.item(i, 0).flags() ^ Qt.ItemIsSelectable)
+            item = QTableWidgetItem(assets.team_icon(name), name)
+            item.setData(Qt.UserRole, team)
+        self.setItem(row, 0, item)
 
     def dropEvent(self, event: QDropEvent):
         model = QStandardItemModel()
         model.dropMimeData(event.mimeData(), Qt.CopyAction, 0, 0, QModelIndex())
+        team = model.item(0, 0).data(Qt.UserRole)
+        row = self.indexAt(event.pos()).row()
+        # the GroupDrawWidget moves the team in its draw state and renders it, the source must not
+        # remove the dragged item on its own
+        event.ignore()
+        if team is not None and 0 <= row < self.team_count:
+            self.team_dropped.emit(team, self.group_index, row)
         source = event.source()
-        index = self.indexAt(event.pos())
-        row = index.row()
-        if index.isValid() and self.team_count >= row+1:
-            target_item = self.item(row, 0)
-            if target_item is not None and target_item.text() != '':
-                event.ignore()
-                # swap manually
-                source_data = model.item(0, 0).text()
-                source_icon = model.item(0, 0).icon()
-                target_data = target_item.text()
-                target_icon = target_item.icon()
-                if source == self:
-                    self.switch_item(target_data, source_data, internal_switch=True)
-                else:
-                    self.switch_item(target_data, source_data, icon=source_icon)
-                    source.switch_item(source_data, target_data, icon=target_icon)
-            else:
-                if type(source) == GroupTable or type(source) == TeamDrawListWidget:
-                    # manually remove item from source
-                    source.remove_item_by_text(model.item(0, 0).text())
-                else:
-                    # remove item from source
-                    event.acceptProposedAction()
-                # manually add item to target table (self)
-                self.setItem(row, 0, QTableWidgetItem(model.item(0, 0).icon(), model.item(0, 0).text()))
-
-        else:
-            event.ignore()
         self.clearSelection()
         self.clearFocus()
         source.clearSelection()
@@ -1038,7 +1710,7 @@ class FieldWidget(QTableWidget):
 
 
 class TeamDrawListWidget(QListWidget):
-    list_empty_changed = pyqtSignal(bool)
+    team_dropped = pyqtSignal(int)
 
     def __init__(self, parent=None):
         super().__init__(parent=parent)
@@ -1050,40 +1722,15 @@ class TeamDrawListWidget(QListWidget):
     def dropEvent(self, event: QDropEvent):
         model = QStandardItemModel()
         model.dropMimeData(event.mimeData(), Qt.CopyAction, 0, 0, QModelIndex())
-        drop_text = model.item(0, 0).text()
-        drop_icon = model.item(0, 0).icon()
-        if drop_text == '':
-            event.ignore()
-        else:
-            source = event.source()
-            if type(source) == GroupTable:
-                self.addItem(QListWidgetItem(drop_icon, drop_text))
-                source.remove_item_by_text(drop_text)
-                self.list_empty_changed.emit(False)
-            self.clearSelection()
-            self.clearFocus()
-            source.clearSelection()
-            source.clearFocus()
-
-    def remove_item_by_text(self, text):
-        item_to_remove = None
-        for i in range(self.count()):
-            if self.item(i) is not None:
-                if self.item(i).text() == text:
-                    item_to_remove = i
-        if item_to_remove is not None:
-            self.takeItem(item_to_remove)
-        if self.count() == 0:
-            self.list_empty_changed.emit(True)
-
-    def switch_item(self, original, new, icon=None):
-        for i in range(self.count()):
-            if self.item(i) is not None and self.item(i).text() == original:
-                self.item(i).setText(new)
-                if icon is not None:
-                    self.item(i).setIcon(icon)
-                return True
-        return False
+        team = model.item(0, 0).data(Qt.UserRole)
+        event.ignore()
+        source = event.source()
+        if team is not None and source is not self:
+            self.team_dropped.emit(team)
+        self.clearSelection()
+        self.clearFocus()
+        source.clearSelection()
+        source.clearFocus()
 
 
 class GenerateMatchesWidget(QWidget):
@@ -1118,7 +1765,7 @@ class EditMatchDialog(QDialog):
         self.match = match
         self.setGeometry(self.geometry().x(), self.geometry().y(), 400, 150)
         self.setWindowTitle('Edit Match')
-        self.setWindowIcon(QIcon('icons/pencil.png'))
+        self.setWindowIcon(assets.icon('pencil.png'))
         self.setWindowModality(Qt.ApplicationModal)
         self.layout = QFormLayout(self)
         self.t1_spin = QSpinBox(self)
@@ -1170,6 +1817,67 @@ class EditMatchDialog(QDialog):
             self.accept()
 
 
+class DiagnosticsDialog(QDialog):
+    """ The event loop stalls the watchdog saw, by site and the most recent ones with their stack."""
+    refresh_interval = 1000
+
+    def __init__(self, watchdog, parent=None):
+        super().__init__(parent)
+        self.watchdog = watchdog
+        self.setWindowTitle('Diagnostics')
+        self.resize(900, 600)
+        self.summary_label = QLabel(self)
+        self.sites_table = QTableWidget(0, 4, self)
+        self.sites_table.setHorizontalHeaderLabels(['Site', 'Stalls', 'Total ms', 'Max ms'])
+        self.sites_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.sites_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.stall_list = QListWidget(self)
+        self.stall_list.currentRowChanged.connect(self.show_stack)
+        self.stack_text = QPlainTextEdit(self)
+        self.stack_text.setReadOnly(True)
+        splitter = QSplitter(Qt.Vertical, self)
+        splitter.addWidget(self.sites_table)
+        splitter.addWidget(self.stall_list)
+        splitter.addWidget(self.stack_text)
+        self.setLayout(QVBoxLayout())
+        self.layout().addWidget(self.summary_label)
+        self.layout().addWidget(splitter)
+        self.stalls = []
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start(self.refresh_interval)
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        stats = self.watchdog.stats()
+        latency = stats['latency_ms']
+        self.summary_label.setText('%d stalls over %.0f ms, %.0f ms in total, longest %.0f ms. '
+                                   'Event loop latency: median %.1f ms, 95%% %.1f ms, max %.0f ms' % (
+                                       stats['stalls'], stats['threshold_ms'], stats['stalled_ms'], stats['max_ms'],
+                                       latency['p50'], latency['p95'], latency['max']))
+        self.sites_table.setRowCount(len(stats['sites']))
+        for row, entry in enumerate(stats['sites']):
+            for column, text in enumerate((entry['site'], str(entry['count']), '%.0f' % entry['ms'],
+                                           '%.0f' % entry['max_ms'])):
+                self.sites_table.setItem(row, column, QTableWidgetItem(text))
+        if len(stats['recent']) != len(self.stalls) or stats['recent'][-1:] != self.stalls[-1:]:
+            self.stalls = list(reversed(stats['recent']))
+            self.stall_list.clear()
+            for stall in self.stalls:
+                self.stall_list.addItem('%s  %6.0f ms  %s' % (
+                    time.strftime('%H:%M:%S', time.localtime(stall['started'])), stall['ms'], stall['site']))
+
+    def show_stack(self, row):
+        self.stack_text.setPlainText(self.stalls[row]['stack'] if 0 <= row < len(self.stalls) else '')
+
+
 # todo: implement match view next to group-stage-widget
 class AllTimeTableWidget(QWidget):
     def __init__(self, *args, **kwargs):
@@ -1213,6 +1921,10 @@ class ManageTournamentWidget(QWidget):
         self.groupComboBox = QComboBox(self)
         self.finalLabel = QLabel('Teams in KO Round:')
         self.finalComboBox = QComboBox(self)
+        self.koModeLabel = QLabel('KO Mode:')
+        self.koModeComboBox = QComboBox(self)
+        self.koModeComboBox.addItem('Single Elimination', 'single')
+        self.koModeComboBox.addItem('Double Elimination', 'double')
         self.maxGamesLabel = QLabel(self)
 
         layout = QGridLayout()
@@ -1229,11 +1941,14 @@ class ManageTournamentWidget(QWidget):
         layout.addWidget(self.groupComboBox, 3, 1)
         layout.addWidget(self.finalLabel, 4, 0)
         layout.addWidget(self.finalComboBox, 4, 1)
-        layout.addWidget(QLabel('Max # of Games:'), 5, 0)
-        layout.addWidget(self.maxGamesLabel, 5, 1)
+        layout.addWidget(self.koModeLabel, 5, 0)
+        layout.addWidget(self.koModeComboBox, 5, 1)
+        layout.addWidget(QLabel('Max # of Games:'), 6, 0)
+        layout.addWidget(self.maxGamesLabel, 6, 1)
 
         self.groupComboBox.currentTextChanged.connect(self.num_groups_changed)
         self.finalComboBox.currentTextChanged.connect(self.estimate_games)
+        self.koModeComboBox.currentTextChanged.connect(self.estimate_games)
 
         self.setLayout(layout)
 
@@ -1263,6 +1978,7 @@ class ManageTournamentWidget(QWidget):
         self.teamTable.set_status(manage_teams)
         self.groupComboBox.setEnabled(edit_group_size)
         self.finalComboBox.setEnabled(edit_finals)
+        self.koModeComboBox.setEnabled(edit_finals)
         if manage_teams:
             self.teamLabel.setText('Teams:\n\n(team names can\nalso be manually\nadded later on)')
         else:
@@ -1276,20 +1992,19 @@ class ManageTournamentWidget(QWidget):
         if not edit_finals:
             self.finalLabel.hide()
             self.finalComboBox.hide()
+            self.koModeLabel.hide()
+            self.koModeComboBox.hide()
         else:
             self.finalLabel.show()
             self.finalComboBox.show()
+            self.koModeLabel.show()
+            self.koModeComboBox.show()
 
     def get_data(self):
         data = {}
         if self.lineEdit.isEnabled():
             data['name'] = self.lineEdit.text()
-            data['stylesheet'] = '*{background-color: rgb(161,58,139); color: rgb(255,255,255)} ' \
-                                 '*[highlighted]{color: rgb(40,154,183)}' \
-                                 '*[bg_img]{background-image: url(bg_imgs/2018.png)}' \
-                                 'QLabel, QLineEdit, ' \
-                                 'QRadioButton{background-color: rgba(255, 255, 255, 0)} ' \
-                                 '*[transp_bg="true"]{background-color: rgba(255, 255, 255, 0)}'
+            data['stylesheet'] = DEFAULT_STYLESHEET
         if self.teamTable.team_selection_enabled:
             data['teams'] = self.teamTable.get_teams()
             data['num_teams'] = self.spinBox.value()
@@ -1297,6 +2012,8 @@ class ManageTournamentWidget(QWidget):
             data['group_size'] = int(self.groupComboBox.currentData())
         if self.finalComboBox.isEnabled():
             data['teams_in_ko'] = int(self.finalComboBox.currentData())
+            # a double elimination bracket needs at least two rounds
+            data['ko_mode'] = self.koModeComboBox.currentData() if data['teams_in_ko'] >= 4 else 'single'
 
         return data
 
@@ -1366,12 +2083,18 @@ class ManageTournamentWidget(QWidget):
 
     def estimate_games(self):
         if self.finalComboBox.currentData() is not None and self.groupComboBox.currentData() is not None:
-            est_games = int(math.log2(int(self.finalComboBox.currentData()))) + int(
-                self.groupComboBox.currentData()) - 1
+            ko_games = int(math.log2(int(self.finalComboBox.currentData())))
+            if self.koModeComboBox.currentData() == 'double':
+                # dropping to the lower bracket in the first round means two games per upper round
+                ko_games *= 2
+            est_games = ko_games + int(self.groupComboBox.currentData()) - 1
             self.maxGamesLabel.setText(str(est_games))
 
 
 class DisplayWindow(QMainWindow):
+    simulation_finished = pyqtSignal(object, object)
+    closed = pyqtSignal()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.resize(800, 600)
@@ -1380,14 +2103,59 @@ class DisplayWindow(QMainWindow):
         self.ko_stage_widget = KOStageWidget(self)
         self.setCentralWidget(self.group_stage_widget)
         self.ko_stage_widget.hide()
-
-    def set_data(self, groups, ko_stages, status):
+        self.simulation_state = None
+        # one worker simulates the latest state, states sent while it runs replace each other
+        self.simulation_lock = Lock()
+        self.pending_state = None
+        self.simulation_thread = None
+        self.probability_table = ProbabilityTable(self)
+        self.probability_dock = QDockWidget('Chances', self)
+        self.probability_dock.setWidget(self.probability_table)
+        self.probability_dock.setFeatures(QDockWidget.NoDockWidgetFeatures)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.probability_dock)
+        self.probability_dock.hide()
+        self.simulation_finished.connect(self.show_probabilities)
+
+    @traced()
+    def set_data(self, groups, ko_stages, status, score_data=None):
         self.group_stage_widget.set_groups(groups, teams_only=False, editable=False)
         self.ko_stage_widget.set_stages(ko_stages, status, editable=False)
-        if status['name'].startswith('KO'):
+        if status['name'].startswith('KO') or status['name'].startswith('DE'):
             self.switch_to_ko()
         elif status['name'] == 'GROUP':
             self.switch_to_group()
+        if score_data is not None:
+            model = simulation.fit_score_model(score_data['ratings'], score_data['margins'])
+            self.simulation_state = simulation.build_state(groups, ko_stages, model, score_data['first_ko_stage'])
+            self.request_simulation(self.simulation_state)
+
+    def closeEvent(self, event):
+        super().closeEvent(event)
+        self.closed.emit()
+
+    def request_simulation(self, state):
+        with self.simulation_lock:
+            self.pending_state = state
+            if self.simulation_thread is None:
+                self.simulation_thread = Thread(target=self.run_simulations, daemon=True)
+                self.simulation_thread.start()
+
+    def run_simulations(self):
+        while True:
+            with self.simulation_lock:
+                state = self.pending_state
+                self.pending_state = None
+                if state is None:
+                    self.simulation_thread = None
+                    return
+            self.simulation_finished.emit(state, simulation.simulate(state))
+
+    def show_probabilities(self, state, result):
+        # a newer state may have been sent off while this one was simulated
+        if state is not self.simulation_state:
+            return
+        self.probability_table.set_probabilities(simulation.round_names(state), result)
+        self.probability_dock.show()
 
     def switch_to_ko(self):
         self.centralWidget().setParent(None)
@@ -1402,6 +2170,30 @@ class DisplayWindow(QMainWindow):
         self.group_stage_widget.show()
 
 
+class ProbabilityTable(QTableWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.verticalHeader().hide()
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setFocusPolicy(Qt.NoFocus)
+
+    def set_probabilities(self, round_names, result):
+        headers = ['Team', 'Qualify'] + round_names
+        rows = sorted(result.values(), key=lambda r: [-p for p in reversed(r['rounds'])] + [-r['qualify']])
+        self.clear()
+        self.setColumnCount(len(headers))
+        self.setHorizontalHeaderLabels(headers)
+        self.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            self.setItem(i, 0, QTableWidgetItem(row['name']))
+            for j, p in enumerate([row['qualify']] + row['rounds']):
+                item = QTableWidgetItem('%.1f %%' % (100 * p))
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.setItem(i, j + 1, item)
+        self.resizeColumnsToContents()
+
+
 #  ----------------------------------------------------------------------------
 #
 #  FilteringComboBox class taken from http://www.gulon.co.uk/2013/05/07/a-filtering-qcombobox/
@@ -1414,6 +2206,13 @@ class DisplayWindow(QMainWindow):
 
 
 class FilteringComboBox(QComboBox):
+    """ Editable combo box completing the typed text.
+
+    If the model has a search(text, limit) method (like AvailableTeamsProxy) the completer lists
+    its results, otherwise the items containing the text."""
+
+    completion_limit = 50
+
     def __init__(self, parent=None, *args):
         QComboBox.__init__(self, parent, *args)
         self.setEditable(True)
@@ -1421,6 +2220,7 @@ class FilteringComboBox(QComboBox):
         self._proxy = QSortFilterProxyModel(self)
         self._proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
         self._proxy.setSourceModel(self.model())
+        self._matches = QStringListModel(self)
 
         self._completer = QCompleter(self._proxy, self)
         self._completer.activated.connect(self.on_completer_activated)
@@ -1428,13 +2228,30 @@ class FilteringComboBox(QComboBox):
         self._completer.popup().setStyleSheet(WidgetTools.find_stylesheet(self))
         self.setCompleter(self._completer)
 
-        self.lineEdit().textEdited.connect(self._proxy.setFilterFixedString)
+        self.lineEdit().textEdited.connect(self.filter_completions)
+
+    def searchable(self):
+        return hasattr(self.model(), 'search')
+
+    def setModel(self, model):
+        super().setModel(model)
+        # QComboBox hands the new model to the completer, which has to keep filtering it
+        self._proxy.setSourceModel(model)
+        self._completer.setModel(self._matches if self.searchable() else self._proxy)
+
+    def filter_completions(self, text):
+        if self.searchable():
+            self._matches.setStringList(self.model().search(text, self.completion_limit))
+        else:
+            self._proxy.setFilterFixedString(text)
 
     def wheelEvent(self, event: QWheelEvent):
         event.ignore()
 
     def on_completer_activated(self, text):
         if not text: return
+        if hasattr(self.model(), 'touch'):
+            self.model().touch(text)
         self.setCurrentIndex(self.findText(text))
         self.activated[str].emit(self.currentText())
 
@@ -1,7 +1,7 @@
 from PyQt5.QtCore import pyqtSignal
-from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QWizard, QWizardPage, QGridLayout
 
+from assets import assets
 from widgets import ManageTournamentWidget
 
 
@@ -12,7 +12,7 @@ class TournamentWizard(QWizard):
     def __init__(self, teams):
         super().__init__()
         self.setWindowTitle('Create Tournament')
-        self.setWindowIcon(QIcon('icons/application_add'))
+        self.setWindowIcon(assets.icon('application_add'))
         self.setStyleSheet('background-color: rgb(51,124,99); font-family: Helvetica; font-weight: bold; '
                            'color: rgb(255,255,255)')
         self.resize(700, 700)